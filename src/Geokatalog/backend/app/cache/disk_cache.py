@@ -0,0 +1,111 @@
+"""Size-bounded on-disk cache for rendered tiles"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Allocation unit of most filesystems; every entry counts as whole blocks
+BLOCK_SIZE = 4096
+
+
+def _footprint(size: int) -> int:
+    """Disk space taken by a file of `size` bytes, at least one block"""
+    return max(1, -(-size // BLOCK_SIZE)) * BLOCK_SIZE
+
+
+class DiskCache:
+    """
+    Byte cache stored as files under a directory, bounded by total size.
+
+    Keys are hashed into a two-level directory layout. When the cache grows past
+    `max_bytes`, the least recently used files (by mtime, refreshed on hit) are
+    removed until it is back under 90% of the limit. Files are counted in whole
+    filesystem blocks, so even empty entries use up the budget.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = 1024 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(_footprint(p.stat().st_size) for p in self.directory.rglob('*.bin'))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return self.directory / digest[:2] / f"{digest}.bin"
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            # Write to a temp file first so readers never see partial tiles
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            previous = _footprint(path.stat().st_size) if path.exists() else 0
+            os.replace(tmp_name, path)
+        except OSError as e:
+            logger.warning(f"Could not write tile cache entry {path}: {e}")
+            return
+        with self._lock:
+            self._size += _footprint(len(data)) - previous
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self._evict()
+
+    def _evict(self):
+        """Remove least recently used files until below 90% of the budget"""
+        with self._lock:
+            files = []
+            for path in self.directory.rglob('*.bin'):
+                try:
+                    st = path.stat()
+                    files.append((st.st_mtime, _footprint(st.st_size), path))
+                except OSError:
+                    continue
+            files.sort()
+            total = sum(size for _, size, _ in files)
+            target = int(self.max_bytes * 0.9)
+            for _, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    path.unlink()
+                    total -= size
+                    self.evictions += 1
+                except OSError:
+                    continue
+            self._size = total
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'directory': str(self.directory),
+            'size': self._size,
+            'max_size': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions,
+        }
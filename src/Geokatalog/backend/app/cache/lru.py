@@ -0,0 +1,109 @@
+"""Size-bounded LRU cache shared by the serving and tile caches"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class SizedLRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values.
+
+    Values larger than `max_entry_size` are never cached, so a single large
+    object cannot flush everything else out of the cache.
+    """
+
+    def __init__(self, max_size: int, sizeof: Callable[[Any], int] = len,
+                 max_entry_size: Optional[int] = None,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size if max_entry_size is not None else max_size
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value and mark it as recently used"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> bool:
+        """Insert a value, evicting least recently used entries. Returns False if too large."""
+        size = self.sizeof(value)
+        if size > self.max_entry_size or size > self.max_size:
+            return False
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._sizes.pop(key)
+                del self._entries[key]
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._size += size
+            while self._size > self.max_size:
+                old_key, old_value = self._entries.popitem(last=False)
+                self._size -= self._sizes.pop(old_key)
+                self.evictions += 1
+                evicted.append((old_key, old_value))
+        if self.on_evict:
+            for old_key, old_value in evicted:
+                self.on_evict(old_key, old_value)
+        return True
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove a value without counting it as an eviction"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._size -= self._sizes.pop(key)
+            return self._entries.pop(key)
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Remove all entries whose key matches the predicate"""
+        with self._lock:
+            keys = [k for k in self._entries if predicate(k)]
+            for key in keys:
+                self._size -= self._sizes.pop(key)
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._size = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and memory use"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'size': self._size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,213 @@
+"""
+Persistent cache of extracted file metadata, keyed by file identity.
+
+Usage:
+    python -m app.cache.metadata_cache stats
+    python -m app.cache.metadata_cache warm [--base-url http://localhost:8000] [--workers 8]
+    python -m app.cache.metadata_cache purge [--all]
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from app.serving.json_response import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """
+    SQLite table of extraction results by (path, size, mtime_ns, format,
+    extractor version).
+
+    Unlike the catalog store, which holds the state of the last published
+    scan, this only memoizes extraction: any scan, refresh or single-file
+    update finds the metadata of a file that did not change since it was
+    last extracted, even after the catalog store was discarded. Bumping
+    the extractor version of one format invalidates only that format's
+    entries. Failed extractions are not cached.
+
+    Each path has at most one entry; extracting a changed file replaces it,
+    and entries of deleted files are removed with `evict` or `purge`.
+    Metadata holds asset hrefs, so the cache is tied to the base URL it was
+    filled with.
+    """
+
+    def __init__(self, path: Path, base_url: Optional[str] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS entries (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                format TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                metadata TEXT NOT NULL,
+                extracted_at REAL NOT NULL
+            );
+        """)
+        with self._conn:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'base_url'").fetchone()
+            if base_url is None:
+                # Opened for maintenance: keep the entries of whichever server filled it
+                base_url = row[0] if row else None
+            elif row is None or row[0] != base_url:
+                if row is not None:
+                    logger.info(f"Metadata cache {self.path} was filled for {row[0]}, clearing it")
+                self._conn.execute("DELETE FROM entries")
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('base_url', ?)", (base_url,))
+        self.base_url = base_url
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path) -> str:
+        return os.path.abspath(path)
+
+    def get(self, path: Path, stat_result: os.stat_result, file_format: str, version: int) -> Optional[Dict]:
+        """Cached metadata of this version of the file, None on a miss"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT metadata FROM entries WHERE path = ? AND size = ? AND mtime_ns = ? "
+                "AND format = ? AND version = ?",
+                (self._key(path), stat_result.st_size, stat_result.st_mtime_ns, file_format, version)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        try:
+            return loads(row[0])
+        except ValueError:
+            return None
+
+    def put(self, path: Path, stat_result: os.stat_result, file_format: str, version: int, metadata: Dict):
+        """Store what was extracted from the file version described by `stat_result`"""
+        try:
+            data = dumps(metadata).decode('utf-8')
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Could not cache metadata of {path}: {e}")
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (path, size, mtime_ns, format, version, metadata, extracted_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(path), stat_result.st_size, stat_result.st_mtime_ns, file_format, version,
+                 data, time.time())
+            )
+
+    def evict(self, paths: Iterable):
+        """Remove the entries of deleted files"""
+        keys = [(self._key(path),) for path in paths]
+        if not keys:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM entries WHERE path = ?", keys)
+
+    def purge(self, versions: Optional[Dict[str, int]] = None) -> int:
+        """
+        Remove entries whose file is gone or changed, and with `versions`
+        (format -> current extractor version) those of older extractors.
+
+        Returns:
+            Number of removed entries
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime_ns, format, version FROM entries").fetchall()
+        stale = []
+        for path, size, mtime_ns, file_format, version in rows:
+            try:
+                st = os.stat(path)
+            except OSError:
+                stale.append((path,))
+                continue
+            if st.st_size != size or st.st_mtime_ns != mtime_ns \
+                    or (versions is not None and versions.get(file_format) != version):
+                stale.append((path,))
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM entries WHERE path = ?", stale)
+        return len(stale)
+
+    def clear(self) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM entries").rowcount
+
+    def stats(self) -> Dict:
+        with self._lock:
+            formats = dict(self._conn.execute("SELECT format, COUNT(*) FROM entries GROUP BY format").fetchall())
+        return {
+            'path': str(self.path),
+            'entries': sum(formats.values()),
+            'formats': formats,
+            'size_bytes': self.path.stat().st_size if self.path.exists() else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the metadata extraction cache")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help="Entries per format and file size")
+    warm = commands.add_parser('warm', help="Extract every file of the data directory missing from the cache")
+    warm.add_argument('--base-url', default=None,
+                      help="External URL of the server (default the one the cache was filled for)")
+    warm.add_argument('--workers', type=int, default=None,
+                      help="Extraction processes (default EXTRACTION_WORKERS, else one per CPU)")
+    purge = commands.add_parser('purge', help="Remove entries of deleted or changed files and older extractors")
+    purge.add_argument('--all', action='store_true', help="Remove every entry")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # The scanner imports GDAL and friends; only load it for commands that need it
+    from app.models.config import settings
+    from app.scanner.extraction import ParallelExtractor
+    from app.scanner.file_scanner import FileScanner
+
+    if not settings.metadata_cache_path:
+        parser.error("METADATA_CACHE_PATH is not set")
+    cache = MetadataCache(settings.metadata_cache_path, getattr(args, 'base_url', None))
+    try:
+        if args.command == 'stats':
+            print(json.dumps(cache.stats(), indent=2))
+        elif args.command == 'purge':
+            removed = cache.clear() if args.all else cache.purge(FileScanner.EXTRACTOR_VERSIONS)
+            print(f"Removed {removed} entries")
+        elif args.command == 'warm':
+            if cache.base_url is None:
+                parser.error("The cache is empty; pass --base-url")
+            scanner = FileScanner(settings.data_directory, cache.base_url, exclude=settings.scan_exclude,
+                                  max_depth=settings.scan_max_depth, walk_workers=settings.scan_workers)
+            extractor = ParallelExtractor(
+                scanner, workers=args.workers or settings.extraction_workers or os.cpu_count() or 1,
+                io_threads=settings.extraction_io_threads, timeout=settings.extraction_timeout, cache=cache
+            )
+            paths = [entry.path for entries in scanner.scan_entries().values() for entry in entries]
+            counts = {'cached': 0, 'extracted': 0, 'failed': 0}
+            started = time.perf_counter()
+            for result in extractor.extract(paths):
+                counts['failed' if result.metadata is None else 'cached' if result.cached else 'extracted'] += 1
+            print(f"{len(paths)} files in {time.perf_counter() - started:.1f} s: {counts['extracted']} extracted, "
+                  f"{counts['cached']} already cached, {counts['failed']} failed")
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
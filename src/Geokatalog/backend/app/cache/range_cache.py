@@ -0,0 +1,218 @@
+"""In-memory cache for hot byte ranges (COG/PMTiles/FlatGeobuf/GeoParquet/COPC headers)"""
+import bisect
+import logging
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.cache.lru import SizedLRUCache
+
+logger = logging.getLogger(__name__)
+
+FileIdentity = Tuple[int, int, int, int]
+
+# GDAL reads this many bytes when it opens a GeoTIFF (GDAL_INGESTED_BYTES_AT_OPEN)
+COG_HEADER_BYTES = 16384
+# pmtiles.js and most PMTiles clients fetch the first 16 KiB in one request
+PMTILES_INITIAL_BYTES = 16384
+PMTILES_HEADER_BYTES = 127
+FLATGEOBUF_MAGIC_BYTES = 8
+LAS_HEADER_BYTES = 375
+COPC_INFO_VLR_BYTES = 54 + 160
+
+
+def file_identity(stat_result: os.stat_result) -> FileIdentity:
+    """Identity of a file version: (device, inode, size, mtime_ns)"""
+    return (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+
+def _read_at(f, offset: int, length: int) -> bytes:
+    f.seek(offset)
+    return f.read(length)
+
+
+def header_ranges(file_path: Path, file_type: str) -> List[Tuple[int, int]]:
+    """
+    Byte ranges that every client reads when it opens a file of this format.
+
+    Args:
+        file_path: Path to the file
+        file_type: Collection/format id from FileScanner (cog, pmtiles, ...)
+
+    Returns:
+        List of (offset, length) tuples, clipped to the file size
+    """
+    file_size = os.path.getsize(file_path)
+    ranges: List[Tuple[int, int]] = []
+
+    with open(file_path, 'rb') as f:
+        if file_type == 'cog':
+            ranges.append((0, COG_HEADER_BYTES))
+            head = _read_at(f, 0, 8)
+            if head[:2] in (b'II', b'MM'):
+                endian = '<' if head[:2] == b'II' else '>'
+                version = struct.unpack(endian + 'H', head[2:4])[0]
+                if version == 42:
+                    ifd_offset = struct.unpack(endian + 'I', head[4:8])[0]
+                else:
+                    ifd_offset = struct.unpack(endian + 'Q', _read_at(f, 8, 8))[0]
+                if ifd_offset >= COG_HEADER_BYTES:
+                    ranges.append((ifd_offset, COG_HEADER_BYTES))
+
+        elif file_type == 'pmtiles':
+            header = _read_at(f, 0, PMTILES_HEADER_BYTES)
+            if len(header) == PMTILES_HEADER_BYTES and header[:7] == b'PMTiles':
+                root_offset, root_length = struct.unpack('<QQ', header[8:24])
+                ranges.append((0, max(PMTILES_INITIAL_BYTES, root_offset + root_length)))
+
+        elif file_type == 'flatgeobuf':
+            head = _read_at(f, 0, FLATGEOBUF_MAGIC_BYTES + 4)
+            if len(head) == FLATGEOBUF_MAGIC_BYTES + 4 and head[:3] == b'fgb':
+                # Imported here because app.features.flatgeobuf imports this module
+                from app.features.flatgeobuf import NODE_ITEM_BYTES, read_header
+                header = read_header(f)
+                end = header.index_offset
+                if header.has_index:
+                    # Header plus every R-tree level above the leaves; clients walk these on each query
+                    end += header.level_bounds()[0][0] * NODE_ITEM_BYTES
+                ranges.append((0, end))
+
+        elif file_type == 'geoparquet':
+            tail = _read_at(f, max(0, file_size - 8), 8) if file_size >= 8 else b''
+            if len(tail) == 8 and tail[4:] == b'PAR1':
+                footer_length = struct.unpack('<I', tail[:4])[0]
+                footer_start = max(0, file_size - 8 - footer_length)
+                ranges.append((footer_start, file_size - footer_start))
+
+        elif file_type == 'copc':
+            header = _read_at(f, 0, LAS_HEADER_BYTES + COPC_INFO_VLR_BYTES)
+            if len(header) >= LAS_HEADER_BYTES and header[:4] == b'LASF':
+                offset_to_points = struct.unpack('<I', header[96:100])[0]
+                ranges.append((0, offset_to_points))
+                # COPC info VLR directly follows the header and points to the root hierarchy page
+                info = header[LAS_HEADER_BYTES + 54:]
+                if header[LAS_HEADER_BYTES + 2:LAS_HEADER_BYTES + 6] == b'copc' and len(info) >= 56:
+                    root_offset, root_size = struct.unpack('<QQ', info[40:56])
+                    ranges.append((root_offset, root_size))
+
+    return [(offset, min(length, file_size - offset)) for offset, length in ranges
+            if 0 <= offset < file_size and length > 0]
+
+
+class RangeCache:
+    """
+    Memory-bounded cache of file byte ranges, keyed by file identity and offset.
+
+    A lookup is served from any cached block that fully contains the requested
+    range, so a cached 16 KiB header also answers the 127-byte PMTiles header read.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, max_block_bytes: int = 8 * 1024 * 1024):
+        self.max_block_bytes = max_block_bytes
+        self._blocks = SizedLRUCache(max_bytes, max_entry_size=max_block_bytes,
+                                     on_evict=self._on_evict)
+        self._offsets: Dict[FileIdentity, List[int]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prefetched_files = 0
+
+    def _on_evict(self, key, _value):
+        identity, offset = key
+        self._remove_offset(identity, offset)
+
+    def _remove_offset(self, identity: FileIdentity, offset: int):
+        with self._lock:
+            offsets = self._offsets.get(identity)
+            if not offsets:
+                return
+            index = bisect.bisect_left(offsets, offset)
+            if index < len(offsets) and offsets[index] == offset:
+                offsets.pop(index)
+            if not offsets:
+                del self._offsets[identity]
+
+    def get(self, identity: FileIdentity, start: int, length: int) -> Optional[bytes]:
+        """Get `length` bytes at `start` if a cached block covers them"""
+        if length > self.max_block_bytes:
+            return None
+        with self._lock:
+            offsets = self._offsets.get(identity)
+            candidate = None
+            if offsets:
+                index = bisect.bisect_right(offsets, start) - 1
+                if index >= 0:
+                    candidate = offsets[index]
+        block = self._blocks.get((identity, candidate)) if candidate is not None else None
+        if block is None or candidate + len(block) < start + length:
+            self.misses += 1
+            return None
+        self.hits += 1
+        relative = start - candidate
+        return block[relative:relative + length]
+
+    def put(self, identity: FileIdentity, offset: int, data: bytes) -> bool:
+        """Cache a block of file data starting at `offset`"""
+        if not self._blocks.put((identity, offset), data):
+            return False
+        with self._lock:
+            offsets = self._offsets.setdefault(identity, [])
+            index = bisect.bisect_left(offsets, offset)
+            if index == len(offsets) or offsets[index] != offset:
+                offsets.insert(index, offset)
+        return True
+
+    def prefetch(self, file_path: Path, file_type: str) -> int:
+        """
+        Load the format-specific header ranges of a file into the cache.
+
+        Returns:
+            Number of bytes cached
+        """
+        try:
+            stat_result = os.stat(file_path)
+            identity = file_identity(stat_result)
+            self.invalidate(file_path, keep=identity)
+            cached = 0
+            with open(file_path, 'rb') as f:
+                for offset, length in header_ranges(file_path, file_type):
+                    data = _read_at(f, offset, length)
+                    if self.put(identity, offset, data):
+                        cached += len(data)
+            self.prefetched_files += 1
+            return cached
+        except Exception as e:
+            logger.warning(f"Could not prefetch header ranges for {file_path}: {e}")
+            return 0
+
+    def invalidate(self, file_path: Path, keep: Optional[FileIdentity] = None) -> int:
+        """Drop cached blocks of older versions of a file (same device and inode)"""
+        try:
+            st = os.stat(file_path)
+            dev_ino = (st.st_dev, st.st_ino)
+        except OSError:
+            return 0
+        with self._lock:
+            stale = [i for i in self._offsets if i[:2] == dev_ino and i != keep]
+            for identity in stale:
+                del self._offsets[identity]
+        stale_set = set(stale)
+        return self._blocks.discard_where(lambda key: key[0] in stale_set)
+
+    def clear(self):
+        with self._lock:
+            self._offsets.clear()
+        self._blocks.clear()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and memory use"""
+        stats = self._blocks.stats()
+        lookups = self.hits + self.misses
+        stats['hits'] = self.hits
+        stats['misses'] = self.misses
+        stats['hit_ratio'] = round(self.hits / lookups, 4) if lookups else None
+        stats['files'] = len(self._offsets)
+        stats['prefetched_files'] = self.prefetched_files
+        return stats
@@ -0,0 +1,256 @@
+"""COPC octree point queries by bbox and level of detail"""
+import io
+import logging
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import laspy
+import numpy as np
+import pyarrow as pa
+from laspy.copc import CopcHierarchyVlr, CopcInfoVlr
+from laspy.vlrs.known import LasZipVlr
+
+from app.cache.lru import SizedLRUCache
+from app.cache.range_cache import FileIdentity, file_identity
+
+logger = logging.getLogger(__name__)
+
+# lazrs is optional - laspy only needs it for LAZ, COPC queries cannot work without it
+try:
+    import lazrs
+    HAS_LAZRS = True
+except ImportError:
+    HAS_LAZRS = False
+    logger.warning("lazrs not installed. COPC point queries are disabled.")
+
+BBox = Tuple[float, float, float, float]
+VoxelKey = Tuple[int, int, int, int]
+
+# VoxelKey (level, x, y, z) followed by offset, byte size and point count
+HIERARCHY_ENTRY = struct.Struct('<iiiiQii')
+# Upper bound on the compressed bytes decompressed into one output batch
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+
+class OctreeNode(NamedTuple):
+    key: VoxelKey
+    offset: int
+    byte_size: int
+    point_count: int
+
+
+def parse_hierarchy_page(data: bytes) -> Dict[VoxelKey, Tuple[int, int, int]]:
+    """Parse a COPC hierarchy page into {key: (offset, byte_size, point_count)}"""
+    entries = {}
+    for level, x, y, z, offset, byte_size, point_count in HIERARCHY_ENTRY.iter_unpack(
+            data[:len(data) - len(data) % HIERARCHY_ENTRY.size]):
+        entries[(level, x, y, z)] = (offset, byte_size, point_count)
+    return entries
+
+
+class COPCFile:
+    """
+    Point queries on one version of a COPC file.
+
+    Hierarchy pages are read on demand and kept in a page cache shared by all
+    files, bounded by the number of entries; point chunks are only read for the
+    octree nodes a query selects.
+    """
+
+    def __init__(self, path: Path, identity: FileIdentity, page_cache: SizedLRUCache):
+        self.path = path
+        self.identity = identity
+        self.page_cache = page_cache
+
+        with open(path, 'rb') as f:
+            self.header = laspy.LasHeader.read_from(f)
+        info = self.header.vlrs[0] if self.header.vlrs else None
+        if not isinstance(info, CopcInfoVlr):
+            raise ValueError(f"{path} has no COPC info VLR")
+        self.info = info
+        self.laszip_vlr = next(v for v in self.header.vlrs if isinstance(v, LasZipVlr))
+        self.root_mins = info.center - info.halfsize
+
+    def _page(self, f, offset: int, size: int) -> Dict[VoxelKey, Tuple[int, int, int]]:
+        key = (self.identity, offset)
+        page = self.page_cache.get(key)
+        if page is None:
+            f.seek(offset)
+            page = parse_hierarchy_page(f.read(size))
+            self.page_cache.put(key, page)
+        return page
+
+    def _overlaps(self, key: VoxelKey, bbox: BBox) -> bool:
+        level, x, y, _ = key
+        side = 2 * self.info.halfsize / 2 ** level
+        min_x = self.root_mins[0] + x * side
+        min_y = self.root_mins[1] + y * side
+        return not (min_x > bbox[2] or min_x + side < bbox[0] or min_y > bbox[3] or min_y + side < bbox[1])
+
+    def select_nodes(self, f, bbox: Optional[BBox] = None, max_depth: Optional[int] = None,
+                     max_points: Optional[int] = None) -> Tuple[List[OctreeNode], int]:
+        """
+        Select the octree nodes with points inside `bbox`, down to `max_depth`.
+
+        When `max_points` is given, whole levels are taken from the root down
+        until the next level would exceed it, so the result is always an
+        evenly thinned preview.
+
+        Returns:
+            (nodes sorted by file offset, deepest level included or -1)
+        """
+        by_level: Dict[int, List[OctreeNode]] = {}
+        stack = [((0, 0, 0, 0), (self.info.hierarchy_root_offset, self.info.hierarchy_root_size))]
+        while stack:
+            key, page_location = stack.pop()
+            if max_depth is not None and key[0] > max_depth:
+                continue
+            if bbox is not None and not self._overlaps(key, bbox):
+                continue
+            entry = self._page(f, *page_location).get(key)
+            if entry is None:
+                continue
+            offset, byte_size, point_count = entry
+            if point_count == -1:
+                # Entry lives in a child page, which repeats the key with its chunk
+                stack.append((key, (offset, byte_size)))
+                continue
+            if point_count > 0:
+                by_level.setdefault(key[0], []).append(OctreeNode(key, offset, byte_size, point_count))
+            level, x, y, z = key
+            for direction in range(8):
+                child = (level + 1, (x << 1) | (direction & 1),
+                         (y << 1) | ((direction >> 1) & 1), (z << 1) | ((direction >> 2) & 1))
+                stack.append((child, page_location))
+
+        nodes: List[OctreeNode] = []
+        depth = -1
+        total = 0
+        for level in sorted(by_level):
+            level_points = sum(node.point_count for node in by_level[level])
+            if max_points is not None and nodes and total + level_points > max_points:
+                break
+            nodes.extend(by_level[level])
+            total += level_points
+            depth = level
+        nodes.sort(key=lambda node: node.offset)
+        return nodes, depth
+
+    def _batches(self, nodes: List[OctreeNode]) -> Iterator[List[OctreeNode]]:
+        """Split nodes into runs of adjacent chunks, each read with one seek"""
+        batch: List[OctreeNode] = []
+        batch_bytes = 0
+        for node in nodes:
+            if batch and (node.offset != batch[-1].offset + batch[-1].byte_size
+                          or batch_bytes + node.byte_size > MAX_BATCH_BYTES):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(node)
+            batch_bytes += node.byte_size
+        if batch:
+            yield batch
+
+    def _decompress(self, f, batch: List[OctreeNode]) -> laspy.ScaleAwarePointRecord:
+        f.seek(batch[0].offset)
+        compressed = f.read(sum(node.byte_size for node in batch))
+        point_format = self.header.point_format
+        points = np.zeros(sum(node.point_count for node in batch) * point_format.size, dtype=np.uint8)
+        lazrs.decompress_points_with_chunk_table(
+            compressed,
+            self.laszip_vlr.record_data,
+            points,
+            [(node.point_count, node.byte_size) for node in batch],
+            lazrs.DecompressionSelection(lazrs.SELECTIVE_DECOMPRESS_ALL),
+        )
+        record = laspy.PackedPointRecord.from_buffer(points, point_format)
+        return laspy.ScaleAwarePointRecord(record.array, point_format,
+                                           self.header.scales, self.header.offsets)
+
+    def select(self, bbox: Optional[BBox] = None, max_depth: Optional[int] = None,
+               max_points: Optional[int] = None) -> Tuple[List[OctreeNode], int]:
+        """Select nodes for a query (see select_nodes)"""
+        with open(self.path, 'rb') as f:
+            return self.select_nodes(f, bbox, max_depth, max_points)
+
+    def iter_points(self, nodes: List[OctreeNode],
+                    bbox: Optional[BBox] = None) -> Iterator[laspy.ScaleAwarePointRecord]:
+        """Decompress the selected nodes batch by batch, dropping points outside `bbox`"""
+        if not HAS_LAZRS:
+            raise RuntimeError("COPC point queries require the lazrs package")
+        with open(self.path, 'rb') as f:
+            for batch in self._batches(nodes):
+                record = self._decompress(f, batch)
+                if bbox is not None:
+                    x, y = record.x, record.y
+                    keep = (x >= bbox[0]) & (x <= bbox[2]) & (y >= bbox[1]) & (y <= bbox[3])
+                    record.array = record.array[keep]
+                if len(record):
+                    yield record
+
+    def _record_batch(self, record: laspy.ScaleAwarePointRecord) -> pa.RecordBatch:
+        columns = {'x': np.asarray(record.x), 'y': np.asarray(record.y), 'z': np.asarray(record.z)}
+        for name in record.point_format.dimension_names:
+            if name not in ('X', 'Y', 'Z'):
+                columns[name] = np.asarray(record[name])
+        return pa.RecordBatch.from_pydict(columns)
+
+    def iter_arrow(self, nodes: List[OctreeNode], bbox: Optional[BBox] = None) -> Iterator[bytes]:
+        """Stream points as an Arrow IPC stream: scaled x/y/z plus all point dimensions"""
+        empty = laspy.ScaleAwarePointRecord.zeros(0, point_format=self.header.point_format,
+                                                  scales=self.header.scales, offsets=self.header.offsets)
+        schema = self._record_batch(empty).schema
+        sink = io.BytesIO()
+        writer = pa.ipc.new_stream(sink, schema)
+        for record in self.iter_points(nodes, bbox):
+            writer.write_batch(self._record_batch(record))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+        writer.close()
+        yield sink.getvalue()
+
+    def to_laz(self, nodes: List[OctreeNode], bbox: Optional[BBox] = None) -> bytes:
+        """Write the selected points to a plain LAZ file (no COPC VLRs)"""
+        records = list(self.iter_points(nodes, bbox))
+        header = laspy.LasHeader(point_format=self.header.point_format, version=self.header.version)
+        header.scales = self.header.scales
+        header.offsets = self.header.offsets
+        header.global_encoding = self.header.global_encoding
+        header.vlrs.extend(
+            vlr for vlr in self.header.vlrs
+            if not isinstance(vlr, (CopcInfoVlr, CopcHierarchyVlr, LasZipVlr))
+        )
+        las = laspy.LasData(header)
+        if records:
+            array = np.concatenate([record.array for record in records])
+        else:
+            array = np.zeros(0, dtype=self.header.point_format.dtype())
+        las.points = laspy.ScaleAwarePointRecord(array, self.header.point_format,
+                                                 self.header.scales, self.header.offsets)
+        output = io.BytesIO()
+        las.write(output, do_compress=True, laz_backend=laspy.LazBackend.Lazrs)
+        return output.getvalue()
+
+
+class COPCFileCache:
+    """Parsed COPC headers by file identity, sharing one bounded hierarchy page cache"""
+
+    def __init__(self, max_files: int = 64, hierarchy_cache_entries: int = 1_000_000):
+        self.page_cache = SizedLRUCache(hierarchy_cache_entries, sizeof=len)
+        self._files = SizedLRUCache(max_files, sizeof=lambda _: 1)
+
+    def open(self, path: Path) -> COPCFile:
+        identity = file_identity(os.stat(path))
+        copc = self._files.get(identity)
+        if copc is None:
+            copc = COPCFile(path, identity, self.page_cache)
+            self._files.put(identity, copc)
+        return copc
+
+    def stats(self) -> Dict:
+        return {
+            'open_files': len(self._files),
+            'hierarchy_cache': self.page_cache.stats(),
+        }
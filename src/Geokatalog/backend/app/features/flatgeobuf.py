@@ -0,0 +1,545 @@
+"""FlatGeobuf bbox queries through the packed Hilbert R-tree index"""
+import base64
+import json
+import logging
+import math
+import os
+import struct
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.cache.lru import SizedLRUCache
+from app.cache.range_cache import FileIdentity, file_identity
+
+logger = logging.getLogger(__name__)
+
+BBox = Tuple[float, float, float, float]
+
+MAGIC_BYTES = 8
+NODE_ITEM_BYTES = 40
+NODE_DTYPE = np.dtype([
+    ('min_x', '<f8'), ('min_y', '<f8'), ('max_x', '<f8'), ('max_y', '<f8'), ('offset', '<u8')
+])
+
+# FlatBuffer schemas (header.fbs / feature.fbs) as (name, kind, default) by field id
+COLUMN_SCHEMA = [
+    ('name', 'string', None), ('type', 'u8', 0), ('title', 'string', None),
+    ('description', 'string', None), ('width', 'i32', -1), ('precision', 'i32', -1),
+    ('scale', 'i32', -1), ('nullable', 'bool', True), ('unique', 'bool', False),
+    ('primary_key', 'bool', False), ('metadata', 'string', None),
+]
+CRS_SCHEMA = [
+    ('org', 'string', None), ('code', 'i32', 0), ('name', 'string', None),
+    ('description', 'string', None), ('wkt', 'string', None), ('code_string', 'string', None),
+]
+HEADER_SCHEMA = [
+    ('name', 'string', None), ('envelope', 'f64vec', None), ('geometry_type', 'u8', 0),
+    ('has_z', 'bool', False), ('has_m', 'bool', False), ('has_t', 'bool', False),
+    ('has_tm', 'bool', False), ('columns', ('tables', COLUMN_SCHEMA), None),
+    ('features_count', 'u64', 0), ('index_node_size', 'u16', 16),
+    ('crs', ('table', CRS_SCHEMA), None), ('title', 'string', None),
+    ('description', 'string', None), ('metadata', 'string', None),
+]
+GEOMETRY_SCHEMA: List = [
+    ('ends', 'u32vec', None), ('xy', 'f64vec', None), ('z', 'f64vec', None),
+    ('m', 'f64vec', None), ('t', 'f64vec', None), ('tm', 'u64vec', None),
+    ('type', 'u8', 0), ('parts', None, None),
+]
+GEOMETRY_SCHEMA[7] = ('parts', ('tables', GEOMETRY_SCHEMA), None)
+FEATURE_SCHEMA = [
+    ('geometry', ('table', GEOMETRY_SCHEMA), None), ('properties', 'bytes', None),
+    ('columns', ('tables', COLUMN_SCHEMA), None),
+]
+
+_SCALARS = {'u8': '<B', 'bool': '<?', 'u16': '<H', 'i32': '<i', 'u64': '<Q'}
+_VECTORS = {'f64vec': '<f8', 'u32vec': '<u4', 'u64vec': '<u8'}
+
+
+def _is_scalar(kind) -> bool:
+    return isinstance(kind, str) and kind in _SCALARS
+
+
+GEOMETRY_TYPES = {
+    1: 'Point', 2: 'LineString', 3: 'Polygon', 4: 'MultiPoint',
+    5: 'MultiLineString', 6: 'MultiPolygon', 7: 'GeometryCollection',
+}
+
+# Fixed-size property encodings by ColumnType; String, Json, DateTime and Binary are length-prefixed
+_PROPERTY_FORMATS = {
+    0: '<b', 1: '<B', 2: '<?', 3: '<h', 4: '<H', 5: '<i',
+    6: '<I', 7: '<q', 8: '<Q', 9: '<f', 10: '<d',
+}
+COLUMN_TYPE_STRING, COLUMN_TYPE_JSON, COLUMN_TYPE_DATETIME, COLUMN_TYPE_BINARY = 11, 12, 13, 14
+
+
+def _read_table(buf, pos: int, schema: List) -> Dict:
+    """Read a FlatBuffer table at `pos` into a dict, using defaults for absent fields"""
+    vtable = pos - struct.unpack_from('<i', buf, pos)[0]
+    vtable_size = struct.unpack_from('<H', buf, vtable)[0]
+    result = {}
+    for index, (name, kind, default) in enumerate(schema):
+        entry = 4 + 2 * index
+        offset = struct.unpack_from('<H', buf, vtable + entry)[0] if entry < vtable_size else 0
+        if not offset:
+            result[name] = default
+            continue
+        field = pos + offset
+        if _is_scalar(kind):
+            result[name] = struct.unpack_from(_SCALARS[kind], buf, field)[0]
+            continue
+        target = field + struct.unpack_from('<I', buf, field)[0]
+        length = struct.unpack_from('<I', buf, target)[0]
+        if isinstance(kind, tuple):
+            container, sub_schema = kind
+            if container == 'table':
+                result[name] = _read_table(buf, target, sub_schema)
+            else:
+                elements = (target + 4 + 4 * i for i in range(length))
+                result[name] = [_read_table(buf, e + struct.unpack_from('<I', buf, e)[0], sub_schema)
+                                for e in elements]
+        elif kind == 'string':
+            result[name] = bytes(buf[target + 4:target + 4 + length]).decode('utf-8')
+        elif kind == 'bytes':
+            result[name] = bytes(buf[target + 4:target + 4 + length])
+        else:
+            result[name] = np.frombuffer(buf, dtype=_VECTORS[kind], count=length, offset=target + 4)
+    return result
+
+
+class _FlatBufferWriter:
+    """
+    Minimal FlatBuffer writer. Objects are laid out front to back (each table
+    is followed by the strings, vectors and tables it references), which keeps
+    every offset positive as the format requires.
+    """
+
+    def __init__(self):
+        self.buf = bytearray(4)
+
+    def _align(self, alignment: int, extra: int = 0):
+        self.buf.extend(bytes(-(len(self.buf) + extra) % alignment))
+
+    def finish(self, schema: List, values: Dict) -> bytes:
+        root = self._table(schema, values)
+        struct.pack_into('<I', self.buf, 0, root)
+        return bytes(self.buf)
+
+    def _table(self, schema: List, values: Dict) -> int:
+        slots = []
+        relative = 4
+        for index, (name, kind, default) in enumerate(schema):
+            value = values.get(name, default)
+            if value is None or (_is_scalar(kind) and value == default):
+                continue
+            size = struct.calcsize(_SCALARS[kind]) if _is_scalar(kind) else 4
+            relative += -relative % size
+            slots.append((index, kind, value, relative))
+            relative += size
+
+        field_count = slots[-1][0] + 1 if slots else 0
+        field_offsets = [0] * field_count
+        for index, _, _, offset in slots:
+            field_offsets[index] = offset
+        self._align(2)
+        vtable_pos = len(self.buf)
+        self.buf.extend(struct.pack(f'<HH{field_count}H', 4 + 2 * field_count, relative, *field_offsets))
+        self._align(8)
+        table_pos = len(self.buf)
+        self.buf.extend(bytes(relative))
+        struct.pack_into('<i', self.buf, table_pos, table_pos - vtable_pos)
+
+        for _, kind, value, offset in slots:
+            field = table_pos + offset
+            if _is_scalar(kind):
+                struct.pack_into(_SCALARS[kind], self.buf, field, value)
+            else:
+                struct.pack_into('<I', self.buf, field, self._child(kind, value) - field)
+        return table_pos
+
+    def _child(self, kind, value) -> int:
+        if isinstance(kind, tuple):
+            container, sub_schema = kind
+            if container == 'table':
+                return self._table(sub_schema, value)
+            self._align(4)
+            pos = len(self.buf)
+            self.buf.extend(struct.pack('<I', len(value)) + bytes(4 * len(value)))
+            for i, element in enumerate(value):
+                element_pos = pos + 4 + 4 * i
+                struct.pack_into('<I', self.buf, element_pos, self._table(sub_schema, element) - element_pos)
+            return pos
+        if kind in ('string', 'bytes'):
+            data = value.encode('utf-8') + b'\0' if kind == 'string' else value
+            self._align(4)
+            pos = len(self.buf)
+            self.buf.extend(struct.pack('<I', len(data) - (kind == 'string')) + data)
+            return pos
+        array = np.asarray(value, dtype=_VECTORS[kind])
+        self._align(array.itemsize, extra=4)
+        pos = len(self.buf)
+        self.buf.extend(struct.pack('<I', len(array)) + array.tobytes())
+        return pos
+
+
+def packed_rtree_level_bounds(num_items: int, node_size: int) -> List[Tuple[int, int]]:
+    """
+    Node index ranges of each level of a packed Hilbert R-tree.
+
+    Level 0 holds the leaves (stored last); the last level is the root at node 0.
+    """
+    level_sizes = [num_items]
+    count = num_items
+    # A do-while as in the reference implementation: even a single item gets a root above it
+    while True:
+        count = math.ceil(count / node_size)
+        level_sizes.append(count)
+        if count == 1:
+            break
+    num_nodes = sum(level_sizes)
+    bounds = []
+    end = num_nodes
+    for size in level_sizes:
+        bounds.append((end - size, end))
+        end -= size
+    return bounds
+
+
+def packed_rtree_size(num_items: int, node_size: int) -> int:
+    """Size in bytes of the index section"""
+    if num_items == 0 or node_size == 0:
+        return 0
+    node_size = min(max(node_size, 2), 65535)
+    return packed_rtree_level_bounds(num_items, node_size)[0][1] * NODE_ITEM_BYTES
+
+
+class FlatGeobufHeader:
+    """Parsed FlatGeobuf header and the file offsets derived from it"""
+
+    def __init__(self, magic: bytes, header: Dict, header_size: int):
+        self.magic = magic
+        self.fields = header
+        self.header_size = header_size
+        self.geometry_type = header['geometry_type']
+        self.has_z = header['has_z']
+        self.columns = header['columns'] or []
+        self.features_count = header['features_count']
+        self.index_node_size = header['index_node_size']
+        self.crs = header['crs']
+        self.envelope = tuple(header['envelope']) if header['envelope'] is not None else None
+
+        self.index_offset = MAGIC_BYTES + 4 + header_size
+        self.index_size = packed_rtree_size(self.features_count, self.index_node_size)
+        self.features_offset = self.index_offset + self.index_size
+
+    @property
+    def has_index(self) -> bool:
+        return self.index_size > 0
+
+    def level_bounds(self) -> List[Tuple[int, int]]:
+        return packed_rtree_level_bounds(self.features_count, self.index_node_size)
+
+
+def read_header(f) -> FlatGeobufHeader:
+    """Read the magic bytes and header of an open FlatGeobuf file"""
+    f.seek(0)
+    head = f.read(MAGIC_BYTES + 4)
+    if len(head) < MAGIC_BYTES + 4 or head[:3] != b'fgb' or head[4:7] != b'fgb':
+        raise ValueError("Not a FlatGeobuf file")
+    header_size = struct.unpack('<I', head[MAGIC_BYTES:])[0]
+    buf = f.read(header_size)
+    if len(buf) < header_size:
+        raise ValueError("Truncated FlatGeobuf header")
+    header = _read_table(buf, struct.unpack_from('<I', buf, 0)[0], HEADER_SCHEMA)
+    return FlatGeobufHeader(head[:MAGIC_BYTES], header, header_size)
+
+
+def _coordinates(xy: np.ndarray, z: Optional[np.ndarray], start: int, end: int) -> List:
+    points = xy[2 * start:2 * end].reshape(-1, 2)
+    if z is not None and len(z):
+        points = np.column_stack([points, z[start:end]])
+    return points.tolist()
+
+
+def geometry_to_geojson(geometry: Dict, geometry_type: int) -> Dict:
+    """Convert a decoded FlatGeobuf Geometry table to a GeoJSON geometry"""
+    geometry_type = geometry['type'] or geometry_type
+    name = GEOMETRY_TYPES.get(geometry_type)
+    if name is None:
+        raise ValueError(f"Unsupported FlatGeobuf geometry type {geometry_type}")
+
+    parts = geometry['parts']
+    if geometry_type == 6:
+        return {'type': name, 'coordinates': [geometry_to_geojson(p, 3)['coordinates'] for p in parts or []]}
+    if geometry_type == 7:
+        return {'type': name, 'geometries': [geometry_to_geojson(p, 0) for p in parts or []]}
+
+    xy = geometry['xy'] if geometry['xy'] is not None else np.empty(0)
+    z = geometry['z']
+    count = len(xy) // 2
+    if geometry_type == 1:
+        return {'type': name, 'coordinates': _coordinates(xy, z, 0, count)[0] if count else []}
+    if geometry_type in (2, 4):
+        return {'type': name, 'coordinates': _coordinates(xy, z, 0, count)}
+
+    ends = geometry['ends'] if geometry['ends'] is not None else [count]
+    rings = []
+    start = 0
+    for end in ends:
+        rings.append(_coordinates(xy, z, start, int(end)))
+        start = int(end)
+    return {'type': name, 'coordinates': rings}
+
+
+def geometry_bounds(geometry: Dict) -> Optional[BBox]:
+    """Bounding box of a decoded Geometry table, or None if it is empty"""
+    arrays = []
+    stack = [geometry]
+    while stack:
+        current = stack.pop()
+        if current['xy'] is not None and len(current['xy']):
+            arrays.append(current['xy'].reshape(-1, 2))
+        stack.extend(current['parts'] or [])
+    if not arrays:
+        return None
+    points = np.concatenate(arrays)
+    return (*points.min(axis=0).tolist(), *points.max(axis=0).tolist())
+
+
+def decode_properties(data: Optional[bytes], columns: Sequence[Dict]) -> Dict:
+    """Decode the binary property buffer of a feature (absent columns are None)"""
+    properties = {column['name']: None for column in columns}
+    if not data:
+        return properties
+    position = 0
+    while position < len(data):
+        column_index = struct.unpack_from('<H', data, position)[0]
+        position += 2
+        column = columns[column_index]
+        column_type = column['type']
+        fmt = _PROPERTY_FORMATS.get(column_type)
+        if fmt is not None:
+            value = struct.unpack_from(fmt, data, position)[0]
+            position += struct.calcsize(fmt)
+        else:
+            length = struct.unpack_from('<I', data, position)[0]
+            raw = data[position + 4:position + 4 + length]
+            position += 4 + length
+            if column_type == COLUMN_TYPE_BINARY:
+                value = base64.b64encode(raw).decode('ascii')
+            elif column_type == COLUMN_TYPE_JSON:
+                value = json.loads(raw)
+            else:
+                value = raw.decode('utf-8')
+        properties[column['name']] = value
+    return properties
+
+
+class FlatGeobufFile:
+    """
+    Spatial queries on one version of a FlatGeobuf file.
+
+    The header is parsed once; R-tree node blocks are read on demand and kept
+    in a node cache shared between files, so repeated viewport queries only
+    touch the disk for feature data.
+    """
+
+    def __init__(self, path: Path, identity: FileIdentity, node_cache: SizedLRUCache):
+        self.path = path
+        self.identity = identity
+        self.node_cache = node_cache
+        with open(path, 'rb') as f:
+            self.header = read_header(f)
+        self._level_bounds = self.header.level_bounds() if self.header.has_index else []
+
+    def _nodes(self, f, start: int, end: int) -> np.ndarray:
+        key = (self.identity, start, end)
+        nodes = self.node_cache.get(key)
+        if nodes is None:
+            f.seek(self.header.index_offset + start * NODE_ITEM_BYTES)
+            data = f.read((end - start) * NODE_ITEM_BYTES)
+            nodes = np.frombuffer(data, dtype=NODE_DTYPE, count=end - start)
+            self.node_cache.put(key, nodes)
+        return nodes
+
+    def search(self, f, bbox: BBox) -> List[int]:
+        """
+        Walk the R-tree from the root and collect matching leaves.
+
+        Returns:
+            Sorted feature offsets relative to the start of the feature section
+        """
+        node_size = self.header.index_node_size
+        leaf_start = self._level_bounds[0][0]
+        offsets: List[int] = []
+        queue = deque([(0, len(self._level_bounds) - 1)])
+        while queue:
+            node_index, level = queue.popleft()
+            end = min(node_index + node_size, self._level_bounds[level][1])
+            nodes = self._nodes(f, node_index, end)
+            matches = nodes['offset'][
+                (nodes['min_x'] <= bbox[2]) & (nodes['min_y'] <= bbox[3])
+                & (nodes['max_x'] >= bbox[0]) & (nodes['max_y'] >= bbox[1])
+            ]
+            if node_index >= leaf_start:
+                offsets.extend(matches.tolist())
+            else:
+                queue.extend((int(child), level - 1) for child in matches)
+        offsets.sort()
+        return offsets
+
+    def level_nodes(self, f, max_nodes: int) -> np.ndarray:
+        """
+        Node boxes of the lowest R-tree level with at most `max_nodes` nodes:
+        a coarse cover of all features read with one small request (the
+        leaves themselves for small files). Empty without an index.
+        """
+        for start, end in self._level_bounds:
+            if end - start <= max_nodes:
+                return self._nodes(f, start, end)
+        return np.empty(0, dtype=NODE_DTYPE)
+
+    def scan_extent(self) -> Tuple[int, Optional[BBox]]:
+        """Feature count and bounds from decoding every geometry, for headers that lack them"""
+        count = 0
+        total: Optional[BBox] = None
+        with open(self.path, 'rb') as f:
+            for feature in self._scan_features(f):
+                count += 1
+                table = _read_table(feature, 4 + struct.unpack_from('<I', feature, 4)[0], FEATURE_SCHEMA)
+                bounds = geometry_bounds(table['geometry']) if table['geometry'] else None
+                if bounds is None:
+                    continue
+                total = bounds if total is None else (min(total[0], bounds[0]), min(total[1], bounds[1]),
+                                                      max(total[2], bounds[2]), max(total[3], bounds[3]))
+        return count, total
+
+    def _read_features(self, f, offsets: List[int]) -> Iterator[bytes]:
+        """Read size-prefixed features, one read per run of adjacent features"""
+        base = self.header.features_offset
+        i = 0
+        while i < len(offsets):
+            # Extend the run while the next match starts where this one ends
+            j = i
+            f.seek(base + offsets[i])
+            size = struct.unpack('<I', f.read(4))[0]
+            run_end = offsets[i] + 4 + size
+            while j + 1 < len(offsets) and offsets[j + 1] == run_end:
+                j += 1
+                f.seek(base + run_end)
+                run_end += 4 + struct.unpack('<I', f.read(4))[0]
+            f.seek(base + offsets[i])
+            data = f.read(run_end - offsets[i])
+            position = 0
+            while position < len(data):
+                size = struct.unpack_from('<I', data, position)[0]
+                yield data[position:position + 4 + size]
+                position += 4 + size
+            i = j + 1
+
+    def _scan_features(self, f) -> Iterator[bytes]:
+        """Read every feature in file order (files without an index)"""
+        f.seek(self.header.features_offset)
+        while True:
+            prefix = f.read(4)
+            if len(prefix) < 4:
+                return
+            size = struct.unpack('<I', prefix)[0]
+            yield prefix + f.read(size)
+
+    def decode(self, feature: bytes) -> Tuple[Optional[Dict], Dict]:
+        """Decode a size-prefixed feature into (decoded geometry table, properties)"""
+        table = _read_table(feature, 4 + struct.unpack_from('<I', feature, 4)[0], FEATURE_SCHEMA)
+        columns = table['columns'] or self.header.columns
+        return table['geometry'], decode_properties(table['properties'], columns)
+
+    def iter_features(self, bbox: Optional[BBox] = None, limit: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Matching features as raw size-prefixed FlatBuffers.
+
+        Uses the R-tree when the file has one; otherwise scans all features
+        and compares their geometry bounds against the query box.
+        """
+        returned = 0
+        with open(self.path, 'rb') as f:
+            if bbox is not None and self.header.has_index:
+                offsets = self.search(f, bbox)
+                if limit is not None:
+                    offsets = offsets[:limit]
+                yield from self._read_features(f, offsets)
+                return
+            for feature in self._scan_features(f):
+                if limit is not None and returned >= limit:
+                    return
+                if bbox is not None:
+                    geometry, _ = self.decode(feature)
+                    bounds = geometry_bounds(geometry) if geometry else None
+                    if bounds is None or bounds[0] > bbox[2] or bounds[2] < bbox[0] \
+                            or bounds[1] > bbox[3] or bounds[3] < bbox[1]:
+                        continue
+                returned += 1
+                yield feature
+
+    def count(self, bbox: Optional[BBox] = None) -> Optional[int]:
+        """Number of matching features if it is known without reading them"""
+        if bbox is None:
+            return self.header.features_count or None
+        if self.header.has_index:
+            with open(self.path, 'rb') as f:
+                return len(self.search(f, bbox))
+        return None
+
+    def iter_geojson(self, bbox: Optional[BBox] = None, limit: Optional[int] = None) -> Iterator[bytes]:
+        """Stream a GeoJSON FeatureCollection of the matching features"""
+        yield b'{"type":"FeatureCollection","features":['
+        returned = 0
+        for feature in self.iter_features(bbox, limit):
+            geometry, properties = self.decode(feature)
+            item = {
+                'type': 'Feature',
+                'geometry': geometry_to_geojson(geometry, self.header.geometry_type) if geometry else None,
+                'properties': properties,
+            }
+            yield ((',' if returned else '') + json.dumps(item, default=str)).encode('utf-8')
+            returned += 1
+        yield f'],"numberReturned":{returned}}}'.encode('utf-8')
+
+    def iter_flatgeobuf(self, bbox: Optional[BBox] = None, limit: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Stream the matching features as a FlatGeobuf file without an index.
+
+        Feature buffers are copied unchanged; only the header is rewritten
+        (index_node_size = 0 and the new feature count, 0 when unknown).
+        """
+        features_count = self.count(bbox)
+        if features_count is not None and limit is not None:
+            features_count = min(features_count, limit)
+        header = dict(self.header.fields, index_node_size=0, features_count=features_count or 0)
+        header_bytes = _FlatBufferWriter().finish(HEADER_SCHEMA, header)
+        yield self.header.magic + struct.pack('<I', len(header_bytes)) + header_bytes
+        for feature in self.iter_features(bbox, limit):
+            yield feature
+
+
+class FlatGeobufFileCache:
+    """Parsed FlatGeobuf headers by file identity, sharing one R-tree node cache"""
+
+    def __init__(self, max_files: int = 256, node_cache_bytes: int = 64 * 1024 * 1024):
+        self.node_cache = SizedLRUCache(node_cache_bytes, sizeof=lambda nodes: nodes.nbytes)
+        self._files = SizedLRUCache(max_files, sizeof=lambda _: 1)
+
+    def open(self, path: Path) -> FlatGeobufFile:
+        identity = file_identity(os.stat(path))
+        fgb = self._files.get(identity)
+        if fgb is None:
+            fgb = FlatGeobufFile(path, identity, self.node_cache)
+            self._files.put(identity, fgb)
+        return fgb
+
+    def stats(self) -> Dict:
+        return {
+            'open_files': len(self._files),
+            'node_cache': self.node_cache.stats(),
+        }
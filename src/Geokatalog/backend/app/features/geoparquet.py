@@ -0,0 +1,254 @@
+"""GeoParquet feature queries with row-group bbox pushdown"""
+import io
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import shapely
+
+from app.cache.lru import SizedLRUCache
+from app.cache.range_cache import FileIdentity, file_identity
+
+logger = logging.getLogger(__name__)
+
+BBox = Tuple[float, float, float, float]
+
+# Rows decoded per record batch when streaming a row group
+BATCH_ROWS = 65536
+
+
+class GeoParquetDataset:
+    """
+    Parsed footer of a GeoParquet file: `geo` metadata, schema and the
+    per-row-group bounding boxes from the covering `bbox` column statistics.
+    """
+
+    def __init__(self, path: Path, identity: FileIdentity):
+        self.path = path
+        self.identity = identity
+        self.parquet = pq.ParquetFile(path)
+        metadata = self.parquet.schema_arrow.metadata or {}
+        if b'geo' not in metadata:
+            raise ValueError(f"{path} has no GeoParquet 'geo' metadata")
+        self.geo = json.loads(metadata[b'geo'])
+        self.geometry_column = self.geo.get('primary_column', 'geometry')
+        column_meta = self.geo.get('columns', {}).get(self.geometry_column, {})
+        self.encoding = column_meta.get('encoding', 'WKB').upper()
+        if self.encoding != 'WKB':
+            raise ValueError(f"Unsupported GeoParquet geometry encoding {self.encoding} in {path}")
+
+        # covering: {"bbox": {"xmin": ["bbox", "xmin"], ...}}
+        covering = column_meta.get('covering', {}).get('bbox')
+        self.covering: Optional[Dict[str, List[str]]] = covering if covering else None
+        self.covering_column = covering['xmin'][0] if covering else None
+        self.row_group_bboxes = self._row_group_bboxes()
+
+        self.property_columns = [
+            name for name in self.parquet.schema_arrow.names
+            if name not in (self.geometry_column, self.covering_column)
+        ]
+
+    def _row_group_bboxes(self) -> List[Optional[BBox]]:
+        """Bounding box of every row group from the covering column statistics"""
+        metadata = self.parquet.metadata
+        if not self.covering or metadata.num_row_groups == 0:
+            return [None] * metadata.num_row_groups
+
+        first = metadata.row_group(0)
+        column_index = {first.column(i).path_in_schema: i for i in range(first.num_columns)}
+        paths = {key: '.'.join(self.covering[key]) for key in ('xmin', 'ymin', 'xmax', 'ymax')}
+        if not all(path in column_index for path in paths.values()):
+            return [None] * metadata.num_row_groups
+
+        bboxes: List[Optional[BBox]] = []
+        for rg in range(metadata.num_row_groups):
+            row_group = metadata.row_group(rg)
+            stats = {key: row_group.column(column_index[path]).statistics for key, path in paths.items()}
+            if not all(s is not None and s.has_min_max for s in stats.values()):
+                bboxes.append(None)
+                continue
+            bboxes.append((stats['xmin'].min, stats['ymin'].min, stats['xmax'].max, stats['ymax'].max))
+        return bboxes
+
+    def bounds(self) -> Optional[BBox]:
+        """
+        Bounds of all geometries: the `geo` bbox, else the union of the row
+        group covering statistics, else computed one row group at a time
+        from the geometry column. None when there are no geometries.
+        """
+        bbox = self.geo.get('columns', {}).get(self.geometry_column, {}).get('bbox')
+        if bbox and len(bbox) in (4, 6):
+            half = len(bbox) // 2
+            return (bbox[0], bbox[1], bbox[half], bbox[half + 1])
+        if self.row_group_bboxes and all(rg_bbox is not None for rg_bbox in self.row_group_bboxes):
+            boxes = np.array(self.row_group_bboxes, dtype=float)
+            return (boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max())
+
+        total = None
+        for rg in range(self.parquet.metadata.num_row_groups):
+            table = self.parquet.read_row_group(rg, columns=[self.geometry_column])
+            bounds = shapely.bounds(shapely.from_wkb(table[self.geometry_column].to_numpy(zero_copy_only=False)))
+            bounds = bounds[~np.isnan(bounds).any(axis=1)]
+            if not len(bounds):
+                continue
+            rg_bbox = (bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max())
+            total = rg_bbox if total is None else (min(total[0], rg_bbox[0]), min(total[1], rg_bbox[1]),
+                                                   max(total[2], rg_bbox[2]), max(total[3], rg_bbox[3]))
+        return total
+
+    def sample_geometries(self, max_rows: int = 1000, max_row_groups: int = 4) -> np.ndarray:
+        """
+        Non-empty geometries of up to `max_rows` rows, taken from the start
+        of at most `max_row_groups` evenly spaced row groups. Only the first
+        batch of the geometry column of each of those row groups is read.
+        """
+        num_row_groups = self.parquet.metadata.num_row_groups
+        if num_row_groups == 0:
+            return np.array([], dtype=object)
+        chosen = np.unique(np.linspace(0, num_row_groups - 1, min(max_row_groups, num_row_groups)).astype(int))
+        per_group = max(1, max_rows // len(chosen))
+        samples = []
+        for rg in chosen:
+            batches = self.parquet.iter_batches(batch_size=per_group, row_groups=[int(rg)],
+                                                columns=[self.geometry_column])
+            batch = next(batches, None)
+            if batch is None:
+                continue
+            wkb = batch.column(self.geometry_column)
+            geometries = shapely.from_wkb(wkb.to_numpy(zero_copy_only=False))
+            samples.append(geometries[~(shapely.is_missing(geometries) | shapely.is_empty(geometries))])
+        return np.concatenate(samples) if samples else np.array([], dtype=object)
+
+    def candidate_row_groups(self, bbox: Optional[BBox]) -> List[int]:
+        """Row groups whose statistics bbox intersects the query bbox"""
+        if bbox is None:
+            return list(range(len(self.row_group_bboxes)))
+        candidates = []
+        for rg, rg_bbox in enumerate(self.row_group_bboxes):
+            if rg_bbox is None or not (rg_bbox[2] < bbox[0] or rg_bbox[0] > bbox[2]
+                                       or rg_bbox[3] < bbox[1] or rg_bbox[1] > bbox[3]):
+                candidates.append(rg)
+        return candidates
+
+    def _row_mask(self, table: pa.Table, bbox: BBox) -> pa.ChunkedArray:
+        """Per-row bbox intersection, from the covering column if there is one"""
+        if self.covering:
+            def field(key):
+                column_name, child = self.covering[key]
+                return pc.struct_field(table[column_name], child)
+            return pc.and_(
+                pc.and_(pc.less_equal(field('xmin'), bbox[2]), pc.greater_equal(field('xmax'), bbox[0])),
+                pc.and_(pc.less_equal(field('ymin'), bbox[3]), pc.greater_equal(field('ymax'), bbox[1])),
+            )
+        geometries = shapely.from_wkb(table[self.geometry_column].to_numpy(zero_copy_only=False))
+        bounds = shapely.bounds(geometries)
+        mask = ((bounds[:, 0] <= bbox[2]) & (bounds[:, 2] >= bbox[0])
+                & (bounds[:, 1] <= bbox[3]) & (bounds[:, 3] >= bbox[1]))
+        return pa.array(np.nan_to_num(mask, nan=False).astype(bool))
+
+    def iter_tables(self, bbox: Optional[BBox] = None, limit: Optional[int] = None,
+                    properties: Optional[Sequence[str]] = None) -> Iterator[pa.Table]:
+        """
+        Read matching rows one record batch at a time, stopping as soon as
+        `limit` rows were found.
+
+        Args:
+            bbox: Query box in the file's CRS, or None for all rows
+            limit: Maximum number of rows to return
+            properties: Property columns to read (default: all)
+
+        Yields:
+            Tables with the selected property columns and the geometry column
+        """
+        if properties is None:
+            properties = self.property_columns
+        unknown = [p for p in properties if p not in self.property_columns]
+        if unknown:
+            raise KeyError(f"Unknown properties: {', '.join(unknown)}")
+
+        output_columns = list(properties) + [self.geometry_column]
+        read_columns = list(output_columns)
+        if bbox is not None:
+            if self.covering_column:
+                read_columns.append(self.covering_column)
+
+        remaining = limit
+        for rg in self.candidate_row_groups(bbox):
+            # Without a bbox every row counts, so a small limit needs only a small first batch
+            batch_size = BATCH_ROWS if bbox is not None or remaining is None else min(remaining, BATCH_ROWS)
+            for batch in self.parquet.iter_batches(batch_size=batch_size, row_groups=[rg], columns=read_columns):
+                table = pa.Table.from_batches([batch])
+                if bbox is not None:
+                    table = table.filter(self._row_mask(table, bbox))
+                table = table.select(output_columns)
+                if remaining is not None:
+                    table = table.slice(0, remaining)
+                    remaining -= table.num_rows
+                if table.num_rows:
+                    yield table
+                if remaining is not None and remaining <= 0:
+                    return
+
+    def iter_geojson(self, bbox: Optional[BBox] = None, limit: Optional[int] = None,
+                     properties: Optional[Sequence[str]] = None) -> Iterator[bytes]:
+        """Stream a GeoJSON FeatureCollection, one record batch at a time"""
+        yield b'{"type":"FeatureCollection","features":['
+        returned = 0
+        for table in self.iter_tables(bbox, limit, properties):
+            wkb = table[self.geometry_column].to_numpy(zero_copy_only=False)
+            geometries = shapely.to_geojson(shapely.from_wkb(wkb))
+            rows = table.drop([self.geometry_column]).to_pylist()
+            parts = []
+            for geometry, row in zip(geometries, rows):
+                parts.append(
+                    '{"type":"Feature","geometry":' + (geometry or 'null')
+                    + ',"properties":' + json.dumps(row, default=str) + '}'
+                )
+            chunk = ','.join(parts)
+            yield ((',' if returned else '') + chunk).encode('utf-8')
+            returned += len(parts)
+        yield f'],"numberReturned":{returned}}}'.encode('utf-8')
+
+    def iter_arrow(self, bbox: Optional[BBox] = None, limit: Optional[int] = None,
+                   properties: Optional[Sequence[str]] = None) -> Iterator[bytes]:
+        """Stream matching rows as an Arrow IPC stream (geometry stays WKB)"""
+        geo_metadata = {b'geo': json.dumps(self.geo).encode('utf-8')}
+        sink = io.BytesIO()
+        writer = None
+        for table in self.iter_tables(bbox, limit, properties):
+            if writer is None:
+                writer = pa.ipc.new_stream(sink, table.schema.with_metadata(geo_metadata))
+            writer.write_table(table.replace_schema_metadata(geo_metadata))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+        if writer is None:
+            # No matches: still send a valid stream with the schema
+            schema = self.parquet.schema_arrow
+            columns = list(self.property_columns if properties is None else properties)
+            columns.append(self.geometry_column)
+            writer = pa.ipc.new_stream(sink, pa.schema([schema.field(c) for c in columns],
+                                                       metadata=geo_metadata))
+        writer.close()
+        yield sink.getvalue()
+
+
+class GeoParquetDatasetCache:
+    """Parsed GeoParquet footers, keyed by file identity"""
+
+    def __init__(self, max_files: int = 256):
+        self._datasets = SizedLRUCache(max_files, sizeof=lambda _: 1)
+
+    def open(self, path: Path) -> GeoParquetDataset:
+        identity = file_identity(os.stat(path))
+        dataset = self._datasets.get(identity)
+        if dataset is None:
+            dataset = GeoParquetDataset(path, identity)
+            self._datasets.put(identity, dataset)
+        return dataset
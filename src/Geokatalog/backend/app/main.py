@@ -3,16 +3,44 @@ from fastapi import FastAPI, HTTPException, Query, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from typing import Optional, List
+from starlette.concurrency import run_in_threadpool
+from typing import Callable, Dict, Optional, List
 from pathlib import Path
+from shapely.geometry import shape
+import asyncio
+import json
 import logging
 import mimetypes
 import os
-import re
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 
 from app.models.config import settings
 from app.stac.catalog import STACCatalogGenerator
+from app.stac.store import CatalogStore
+from app.stac.snapshot import CatalogSnapshot
+from app.scanner.watcher import CatalogWatcher
+from app.stac.index import parse_datetime_interval
+from app.stac.cql2 import CONFORMANCE_CLASSES as CQL2_CONFORMANCE_CLASSES, CQL2Error, parse_filter
+from app.models.search import SearchRequest
+from app.cache.range_cache import RangeCache
+from app.serving.file_engine import FileServingEngine, RangeFileResponse, MultipartRangeFileResponse
+from app.serving.ranges import parse_range_header, RangeNotSatisfiable
+from app.tiles.pmtiles_source import PMTilesArchive, PMTilesArchivePool
+from app.tiles.cog_tiles import COGTileRenderer, TILE_FORMATS
+from app.cache.disk_cache import DiskCache
+from app.cache.metadata_cache import MetadataCache
+from app.serving.json_response import JSONBodyCache, negotiate_encoding
+from app.serving.pagination import (
+    STREAM_FORMATS, StaleToken, decode_token, encode_token, iter_json_seq, page_positions
+)
+from app.features.geoparquet import GeoParquetDatasetCache
+from app.features.flatgeobuf import FlatGeobufFileCache
+from app.features.copc import COPCFileCache, HAS_LAZRS
+from app.serving.conditional import (
+    evaluate_preconditions, file_etag, http_date, if_range_matches, make_etag
+)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -34,31 +62,80 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Hot byte-range cache for file headers and indexes, filled while scanning
+range_cache = RangeCache(
+    max_bytes=settings.range_cache_max_bytes,
+    max_block_bytes=settings.range_cache_max_block_bytes
+)
+
 # Initialize catalog generator
 # Use localhost for base_url so external clients (like QGIS) can access the data
 # The API binds to 0.0.0.0 for Docker, but external URL should be localhost
+CATALOG_BASE_URL = "http://localhost:8000"  # External-facing URL
+
+# Manifest and extracted metadata of the last scan, so restarts only re-extract changed files
+catalog_store = None
+if settings.catalog_store_path:
+    try:
+        catalog_store = CatalogStore(settings.catalog_store_path, CATALOG_BASE_URL)
+    except Exception as e:
+        logger.warning(f"Catalog store {settings.catalog_store_path} unavailable, scanning from scratch: {e}")
+
+# Extraction results by file identity, so unchanged files are never opened twice
+metadata_cache = None
+if settings.metadata_cache_path:
+    try:
+        metadata_cache = MetadataCache(settings.metadata_cache_path, CATALOG_BASE_URL)
+    except Exception as e:
+        logger.warning(f"Metadata cache {settings.metadata_cache_path} unavailable: {e}")
+
 catalog_generator = STACCatalogGenerator(
     data_directory=settings.data_directory,
-    base_url="http://localhost:8000",  # External-facing URL
+    base_url=CATALOG_BASE_URL,
     title=settings.catalog_title,
-    description=settings.catalog_description
+    description=settings.catalog_description,
+    range_cache=range_cache,
+    store=catalog_store,
+    extraction_workers=settings.extraction_workers or os.cpu_count() or 1,
+    extraction_io_threads=settings.extraction_io_threads,
+    extraction_timeout=settings.extraction_timeout,
+    scan_exclude=settings.scan_exclude,
+    scan_max_depth=settings.scan_max_depth,
+    scan_workers=settings.scan_workers,
+    metadata_cache=metadata_cache
 )
 
+# Optional watcher applying added, modified and deleted files to the live catalog
+catalog_watcher = None
+if settings.catalog_watch != "off":
+    def apply_watched_changes(paths: List[Path]):
+        if catalog_generator.update_files(paths):
+            json_bodies.clear()
+    
+    catalog_watcher = CatalogWatcher(
+        settings.data_directory,
+        on_change=apply_watched_changes,
+        is_relevant=catalog_generator.scanner.includes,
+        mode=settings.catalog_watch,
+        settle_seconds=settings.catalog_watch_settle_seconds,
+        poll_interval=settings.catalog_watch_poll_interval,
+        list_files=lambda: (entry for entries in catalog_generator.scanner.scan_entries().values()
+                            for entry in entries)
+    )
+
 # Track refresh status
 refresh_status = {
     "is_running": False,
     "last_refresh": None,
     "last_duration": None,
     "collections_count": None,
-    "error": None
+    "error": None,
+    "snapshot_loaded": False,
+    "initial_scan_complete": False,
+    "initial_scan_failures": 0,
+    "next_retry": None
 }
 
-# Build initial catalog
-logger.info(f"Scanning data directory: {settings.data_directory}")
-catalog_generator.build_catalog()
-logger.info("Initial catalog build complete")
-refresh_status["last_refresh"] = datetime.now().isoformat()
-
 # Register custom MIME types for geospatial formats
 mimetypes.add_type('application/flatgeobuf', '.fgb')
 mimetypes.add_type('application/geoparquet', '.parquet')
@@ -69,11 +146,14 @@ mimetypes.add_type('application/vnd.laszip+copc', '.copc.laz')
 mimetypes.add_type('image/tiff; application=geotiff', '.tif')
 mimetypes.add_type('image/tiff; application=geotiff', '.tiff')
 
-# Custom file serving endpoint with range request support for COG
-from fastapi import Request, HTTPException
-from fastapi.responses import StreamingResponse
-import os
-import re
+# File serving engine for /data (sendfile / shared mmap / pread)
+file_engine = FileServingEngine(
+    mode=settings.file_serving_mode,
+    chunk_size=settings.file_read_chunk_size,
+    readahead=settings.file_readahead,
+    max_open_maps=settings.file_max_open_maps,
+    range_cache=range_cache
+)
 
 async def serve_file_with_range(request: Request, file_path: str):
     """Serve files with HTTP range request support for COG streaming"""
@@ -88,337 +168,961 @@ async def serve_file_with_range(request: Request, file_path: str):
     except ValueError:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    file_size = full_path.stat().st_size
+    stat_result = full_path.stat()
+    file_size = stat_result.st_size
     range_header = request.headers.get("range")
+    send_header_only = request.method == "HEAD"
     
     # Determine content type
-    import mimetypes
     content_type, _ = mimetypes.guess_type(str(full_path))
     if not content_type:
         content_type = "application/octet-stream"
     
-    # Handle range request
+    # Validators: ETag from size, mtime and inode; Last-Modified from mtime
+    etag = file_etag(stat_result)
+    validator_headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat_result.st_mtime),
+        'Cache-Control': settings.data_cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+    
+    precondition_status = evaluate_preconditions(
+        request.method, request.headers, etag, stat_result.st_mtime
+    )
+    if precondition_status:
+        return Response(status_code=precondition_status, headers=validator_headers)
+    
+    # A Range with a stale If-Range validator gets the full (new) file instead
+    if range_header and not if_range_matches(request.headers, etag, stat_result.st_mtime):
+        range_header = None
+    
+    # Handle range request (RFC 7233: single, multiple, open and suffix ranges)
     if range_header:
-        # Parse range header (e.g., "bytes=0-1023")
-        range_match = re.match(r'bytes=(\d+)-(\d*)', range_header)
-        if range_match:
-            start = int(range_match.group(1))
-            end = int(range_match.group(2)) if range_match.group(2) else file_size - 1
-            end = min(end, file_size - 1)
+        try:
+            ranges = parse_range_header(range_header, file_size)
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=416,
+                headers={
+                    **validator_headers,
+                    'Content-Range': f'bytes */{file_size}',
+                }
+            )
+        
+        if ranges and len(ranges) == 1:
+            start, end = ranges[0]
             content_length = end - start + 1
             
-            def iterfile():
-                with open(full_path, 'rb') as f:
-                    f.seek(start)
-                    remaining = content_length
-                    while remaining > 0:
-                        chunk_size = min(8192, remaining)
-                        chunk = f.read(chunk_size)
-                        if not chunk:
-                            break
-                        remaining -= len(chunk)
-                        yield chunk
-            
             headers = {
+                **validator_headers,
                 'Content-Range': f'bytes {start}-{end}/{file_size}',
-                'Accept-Ranges': 'bytes',
                 'Content-Length': str(content_length),
                 'Content-Type': content_type,
             }
             
-            return StreamingResponse(
-                iterfile(),
+            return RangeFileResponse(
+                file_engine, full_path, stat_result,
+                start=start,
+                length=content_length,
                 status_code=206,
                 headers=headers,
-                media_type=content_type
+                media_type=content_type,
+                send_header_only=send_header_only
+            )
+        
+        if ranges:
+            # Several ranges in one round trip (GDAL /vsicurl/ multi-range reads)
+            return MultipartRangeFileResponse(
+                file_engine, full_path, stat_result,
+                ranges=ranges,
+                content_type=content_type,
+                headers=validator_headers,
+                send_header_only=send_header_only
             )
     
     # Full file response (no range request)
-    def iterfile():
-        with open(full_path, 'rb') as f:
-            while chunk := f.read(8192):
-                yield chunk
-    
     headers = {
-        'Accept-Ranges': 'bytes',
+        **validator_headers,
         'Content-Length': str(file_size),
         'Content-Type': content_type,
     }
     
-    return StreamingResponse(
-        iterfile(),
+    return RangeFileResponse(
+        file_engine, full_path, stat_result,
+        start=0,
+        length=file_size,
         headers=headers,
-        media_type=content_type
+        media_type=content_type,
+        send_header_only=send_header_only
     )
 
 # Register file serving endpoint
-@app.get("/data/{file_path:path}")
+@app.api_route("/data/{file_path:path}", methods=["GET", "HEAD"])
 async def get_data_file(request: Request, file_path: str):
-    """Serve data files with range request support"""
+    """Serve data files with range and conditional request support"""
     return await serve_file_with_range(request, file_path)
 
-logger.info(f"Registered /data endpoint with range request support for COG streaming")
+logger.info(f"Registered /data endpoint with range request support ({settings.file_serving_mode} mode)")
+
+
+def catalog_cache_headers(request: Request, snapshot: CatalogSnapshot,
+                          variant: Optional[str] = None) -> Dict[str, str]:
+    """Validators for STAC JSON responses, derived from the snapshot fingerprint"""
+    return {
+        'ETag': make_etag(snapshot.fingerprint, request.url.path, request.url.query, variant or '',
+                          weak=True),
+        'Last-Modified': http_date(snapshot.built_at),
+        'Cache-Control': settings.catalog_cache_control,
+        'Vary': 'Accept-Encoding',
+    }
+
+
+def catalog_not_modified(request: Request, snapshot: CatalogSnapshot) -> Optional[Response]:
+    """Return a 304/412 response if the client's cached STAC response is still valid"""
+    headers = catalog_cache_headers(request, snapshot)
+    status = evaluate_preconditions(
+        request.method, request.headers, headers['ETag'], snapshot.built_at
+    )
+    if status:
+        return Response(status_code=status, headers=headers)
+    return None
+
+
+# Serialized (and compressed) STAC JSON bodies, keyed by catalog fingerprint and URL
+json_bodies = JSONBodyCache(
+    max_bytes=settings.json_cache_max_bytes,
+    min_compress_size=settings.json_compress_min_size
+)
+
+
+async def catalog_json_response(request: Request, snapshot: CatalogSnapshot, build: Callable[[], Dict],
+                                variant: Optional[str] = None) -> Response:
+    """
+    Build a STAC JSON response from `snapshot`, serializing and compressing it
+    at most once per catalog version, URL, content coding and `variant`
+    (e.g. a POST body).
+    """
+    headers = catalog_cache_headers(request, snapshot, variant)
+    encoding = negotiate_encoding(request.headers.get('accept-encoding'))
+    key = (snapshot.fingerprint, request.url.path, request.url.query, variant)
+    body, applied_encoding = await run_in_threadpool(json_bodies.get_body, key, encoding, build)
+    if applied_encoding:
+        headers['Content-Encoding'] = applied_encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def resolve_page_start(snapshot: CatalogSnapshot, token: Optional[str], offset: int = 0) -> int:
+    """First result position of a page: from the continuation token, else `offset`"""
+    if not token:
+        return offset
+    try:
+        return decode_token(token, snapshot.fingerprint)
+    except StaleToken as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def page_links(request: Request, snapshot: CatalogSnapshot, position: int, limit: Optional[int],
+               matched: int, body: Optional[Dict] = None) -> List[Dict]:
+    """
+    `next` / `prev` links carrying continuation tokens for the current URL,
+    or for POST requests the request body with the token added.
+    """
+    if limit is None:
+        return []
+    links = []
+    for rel, target in zip(('next', 'prev'), page_positions(position, limit, matched)):
+        if target is None:
+            continue
+        token = encode_token(snapshot.fingerprint, target) if target > 0 else None
+        if body is not None:
+            links.append({
+                "rel": rel,
+                "href": request.url.path,
+                "type": "application/geo+json",
+                "method": "POST",
+                "body": {**body, "token": token} if token else body,
+                "merge": False
+            })
+            continue
+        url = request.url.remove_query_params(['token', 'offset'])
+        if token:
+            url = url.include_query_params(token=token)
+        links.append({
+            "rel": rel,
+            "href": f"{url.path}?{url.query}" if url.query else url.path,
+            "type": "application/geo+json"
+        })
+    return links
+
+
+def validate_output_format(f: str):
+    """Reject unknown `f` values for the item list endpoints"""
+    if f != "json" and f not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported output format: {f}")
+
+
+def stream_items(request: Request, snapshot: CatalogSnapshot, items: List, f: str,
+                 links: List[Dict]) -> StreamingResponse:
+    """Stream items one JSON record at a time; paging links go in the Link header"""
+    media_type, prefix = STREAM_FORMATS[f]
+    headers = catalog_cache_headers(request, snapshot)
+    if links:
+        headers['Link'] = ', '.join(f'<{link["href"]}>; rel="{link["rel"]}"' for link in links)
+    return StreamingResponse(iter_json_seq((item.to_dict() for item in items), prefix),
+                             media_type=media_type, headers=headers)
 
 
 @app.get("/")
-async def get_root_catalog():
+async def get_root_catalog(request: Request):
     """Get the root STAC catalog - STAC API compliant"""
-    catalog = catalog_generator.get_catalog()
-    if not catalog:
-        raise HTTPException(status_code=404, detail="Catalog not found")
-    
-    # Convert to dict
-    catalog_dict = catalog.to_dict()
-    
-    # Filter links - keep only self and root, exclude pystac-generated child links
-    filtered_links = [
-        link for link in catalog_dict.get("links", [])
-        if link.get("rel") not in ["child", "item"]
-    ]
-    
-    # Add conformance classes for QGIS compatibility
-    response = {
-        "stac_version": "1.0.0",
-        "type": "Catalog",
-        "id": catalog_dict.get("id"),
-        "title": catalog_dict.get("title"),
-        "description": catalog_dict.get("description"),
-        "conformsTo": [
-            "https://api.stacspec.org/v1.0.0/core",
-            "https://api.stacspec.org/v1.0.0/collections",
-            "https://api.stacspec.org/v1.0.0/item-search",
-            "http://www.opengis.net/spec/ogcapi-features-1/1.0/conf/core",
-            "http://www.opengis.net/spec/ogcapi-features-1/1.0/conf/geojson"
-        ],
-        "links": filtered_links
-    }
-    
-    # Add service info link
-    response["links"].append({
-        "rel": "service-desc",
-        "href": f"{catalog_generator.base_url}/api",
-        "type": "application/vnd.oai.openapi+json;version=3.0",
-        "title": "OpenAPI service description"
-    })
+    snapshot = catalog_generator.snapshot
+    not_modified = catalog_not_modified(request, snapshot)
+    if not_modified:
+        return not_modified
     
-    # Add data link for direct file access
-    response["links"].append({
-        "rel": "data",
-        "href": f"{catalog_generator.base_url}/data/",
-        "type": "text/html",
-        "title": "Direct file access"
-    })
-    
-    # Add our custom collection links (STAC API format)
-    collections = catalog_generator.get_collections()
-    for collection in collections:
+    def build():
+        catalog = snapshot.get_catalog()
+        if not catalog:
+            raise HTTPException(status_code=404, detail="Catalog not found")
+        
+        # Convert to dict
+        catalog_dict = catalog.to_dict()
+        
+        # Filter links - keep only self and root, exclude pystac-generated child links
+        filtered_links = [
+            link for link in catalog_dict.get("links", [])
+            if link.get("rel") not in ["child", "item"]
+        ]
+        
+        # Add conformance classes for QGIS compatibility
+        response = {
+            "stac_version": "1.0.0",
+            "type": "Catalog",
+            "id": catalog_dict.get("id"),
+            "title": catalog_dict.get("title"),
+            "description": catalog_dict.get("description"),
+            "conformsTo": [
+                "https://api.stacspec.org/v1.0.0/core",
+                "https://api.stacspec.org/v1.0.0/collections",
+                "https://api.stacspec.org/v1.0.0/item-search",
+                "http://www.opengis.net/spec/ogcapi-features-1/1.0/conf/core",
+                "http://www.opengis.net/spec/ogcapi-features-1/1.0/conf/geojson",
+                *CQL2_CONFORMANCE_CLASSES
+            ],
+            "links": filtered_links
+        }
+        
+        # Add service info link
         response["links"].append({
-            "rel": "child",
-            "href": f"{catalog_generator.base_url}/collections/{collection.id}",
-            "type": "application/json",
-            "title": collection.title
+            "rel": "service-desc",
+            "href": f"{catalog_generator.base_url}/api",
+            "type": "application/vnd.oai.openapi+json;version=3.0",
+            "title": "OpenAPI service description"
+        })
+        
+        # Add queryables link for the Filter extension
+        response["links"].append({
+            "rel": "http://www.opengis.net/def/rel/ogc/1.0/queryables",
+            "href": f"{catalog_generator.base_url}/queryables",
+            "type": "application/schema+json",
+            "title": "Queryables"
         })
+        
+        # Add data link for direct file access
+        response["links"].append({
+            "rel": "data",
+            "href": f"{catalog_generator.base_url}/data/",
+            "type": "text/html",
+            "title": "Direct file access"
+        })
+        
+        # Add our custom collection links (STAC API format)
+        collections = snapshot.get_collections()
+        for collection in collections:
+            response["links"].append({
+                "rel": "child",
+                "href": f"{catalog_generator.base_url}/collections/{collection.id}",
+                "type": "application/json",
+                "title": collection.title
+            })
+        
+        return response
     
-    return JSONResponse(content=response)
+    return await catalog_json_response(request, snapshot, build)
 
 
 @app.get("/collections")
-async def get_collections():
+async def get_collections(request: Request):
     """Get all STAC collections"""
-    collections = catalog_generator.get_collections()
+    snapshot = catalog_generator.snapshot
+    not_modified = catalog_not_modified(request, snapshot)
+    if not_modified:
+        return not_modified
     
-    collections_list = []
-    for collection in collections:
-        col_dict = collection.to_dict()
-        collections_list.append(col_dict)
+    def build():
+        collections = snapshot.get_collections()
+        
+        collections_list = []
+        for collection in collections:
+            col_dict = collection.to_dict()
+            collections_list.append(col_dict)
+        
+        return {
+            "collections": collections_list,
+            "links": [
+                {
+                    "rel": "root",
+                    "href": "/",
+                    "type": "application/json"
+                },
+                {
+                    "rel": "self",
+                    "href": "/collections",
+                    "type": "application/json"
+                }
+            ]
+        }
     
-    return JSONResponse(content={
-        "collections": collections_list,
-        "links": [
-            {
-                "rel": "root",
-                "href": "/",
-                "type": "application/json"
-            },
-            {
-                "rel": "self",
-                "href": "/collections",
-                "type": "application/json"
-            }
-        ]
-    })
+    return await catalog_json_response(request, snapshot, build)
 
 
 @app.get("/collections/{collection_id}")
-async def get_collection(collection_id: str):
+async def get_collection(request: Request, collection_id: str):
     """Get a specific STAC collection"""
-    collection = catalog_generator.get_collection(collection_id)
-    
-    if not collection:
-        raise HTTPException(status_code=404, detail=f"Collection {collection_id} not found")
-    
-    collection_dict = collection.to_dict()
-    
-    # Ensure links use correct URLs (not pystac defaults)
-    # Filter and update links to use STAC API format
-    filtered_links = []
-    for link in collection_dict.get("links", []):
-        rel = link.get("rel")
-        if rel == "self":
-            link["href"] = f"{catalog_generator.base_url}/collections/{collection_id}"
-        elif rel == "items":
-            link["href"] = f"{catalog_generator.base_url}/collections/{collection_id}/items"
-        elif rel == "root":
-            link["href"] = f"{catalog_generator.base_url}/"
-        elif rel == "parent":
-            link["href"] = f"{catalog_generator.base_url}/"
-        # Skip pystac-generated child/item links
-        if rel not in ["child", "item"]:
-            filtered_links.append(link)
-    
-    collection_dict["links"] = filtered_links
-    return JSONResponse(content=collection_dict)
+    snapshot = catalog_generator.snapshot
+    not_modified = catalog_not_modified(request, snapshot)
+    if not_modified:
+        return not_modified
+    
+    def build():
+        collection = snapshot.get_collection(collection_id)
+        
+        if not collection:
+            raise HTTPException(status_code=404, detail=f"Collection {collection_id} not found")
+        
+        collection_dict = collection.to_dict()
+        
+        # Ensure links use correct URLs (not pystac defaults)
+        # Filter and update links to use STAC API format
+        filtered_links = []
+        for link in collection_dict.get("links", []):
+            rel = link.get("rel")
+            if rel == "self":
+                link["href"] = f"{catalog_generator.base_url}/collections/{collection_id}"
+            elif rel == "items":
+                link["href"] = f"{catalog_generator.base_url}/collections/{collection_id}/items"
+            elif rel == "root":
+                link["href"] = f"{catalog_generator.base_url}/"
+            elif rel == "parent":
+                link["href"] = f"{catalog_generator.base_url}/"
+            # Skip pystac-generated child/item links
+            if rel not in ["child", "item"]:
+                filtered_links.append(link)
+        
+        collection_dict["links"] = filtered_links
+        return collection_dict
+    
+    return await catalog_json_response(request, snapshot, build)
 
 
 @app.get("/collections/{collection_id}/items")
 async def get_collection_items(
+    request: Request,
     collection_id: str,
-    limit: int = Query(default=100, ge=1, le=1000),
-    offset: int = Query(default=0, ge=0)
+    limit: Optional[int] = Query(default=None, ge=1, le=1000,
+                                 description="Page size (default 100; streams are unlimited unless given)"),
+    offset: int = Query(default=0, ge=0),
+    token: Optional[str] = Query(None, description="Continuation token from a next/prev link"),
+    f: str = Query(default="json", description="Output format: json, ndjson or geojsonseq")
 ):
     """Get items from a collection with pagination"""
-    collection = catalog_generator.get_collection(collection_id)
+    snapshot = catalog_generator.snapshot
+    validate_output_format(f)
+    not_modified = catalog_not_modified(request, snapshot)
+    if not_modified:
+        return not_modified
     
-    if not collection:
-        raise HTTPException(status_code=404, detail=f"Collection {collection_id} not found")
+    position = resolve_page_start(snapshot, token, offset)
+    if f in STREAM_FORMATS:
+        if not snapshot.get_collection(collection_id):
+            raise HTTPException(status_code=404, detail=f"Collection {collection_id} not found")
+        items = snapshot.get_items(collection_id, limit=limit, offset=position)
+        links = page_links(request, snapshot, position, limit, snapshot.count_items(collection_id))
+        return stream_items(request, snapshot, items, f, links)
+    page_size = limit or 100
     
-    items = catalog_generator.get_items(collection_id, limit=limit, offset=offset)
-    
-    items_list = []
-    for item in items:
-        item_dict = item.to_dict()
-        items_list.append(item_dict)
+    def build():
+        collection = snapshot.get_collection(collection_id)
+        
+        if not collection:
+            raise HTTPException(status_code=404, detail=f"Collection {collection_id} not found")
+        
+        items = snapshot.get_items(collection_id, limit=page_size, offset=position)
+        matched = snapshot.count_items(collection_id)
+        
+        items_list = []
+        for item in items:
+            item_dict = item.to_dict()
+            items_list.append(item_dict)
+        
+        return {
+            "type": "FeatureCollection",
+            "features": items_list,
+            "numberMatched": matched,
+            "numberReturned": len(items_list),
+            "links": [
+                {
+                    "rel": "root",
+                    "href": "/",
+                    "type": "application/json"
+                },
+                {
+                    "rel": "self",
+                    "href": f"/collections/{collection_id}/items",
+                    "type": "application/json"
+                },
+                {
+                    "rel": "collection",
+                    "href": f"/collections/{collection_id}",
+                    "type": "application/json"
+                },
+                *page_links(request, snapshot, position, page_size, matched)
+            ]
+        }
     
-    return JSONResponse(content={
-        "type": "FeatureCollection",
-        "features": items_list,
-        "links": [
-            {
-                "rel": "root",
-                "href": "/",
-                "type": "application/json"
-            },
-            {
-                "rel": "self",
-                "href": f"/collections/{collection_id}/items",
-                "type": "application/json"
-            },
-            {
-                "rel": "collection",
-                "href": f"/collections/{collection_id}",
-                "type": "application/json"
-            }
-        ]
-    })
+    return await catalog_json_response(request, snapshot, build)
 
 
 @app.get("/collections/{collection_id}/items/{item_id}")
-async def get_item(collection_id: str, item_id: str):
+async def get_item(request: Request, collection_id: str, item_id: str):
     """Get a specific item from a collection - Enhanced for QGIS"""
-    item = catalog_generator.get_item(collection_id, item_id)
+    snapshot = catalog_generator.snapshot
+    not_modified = catalog_not_modified(request, snapshot)
+    if not_modified:
+        return not_modified
     
-    if not item:
-        raise HTTPException(
-            status_code=404, 
-            detail=f"Item {item_id} not found in collection {collection_id}"
-        )
+    def build():
+        item = snapshot.get_item(collection_id, item_id)
+        
+        if not item:
+            raise HTTPException(
+                status_code=404, 
+                detail=f"Item {item_id} not found in collection {collection_id}"
+            )
+        
+        item_dict = item.to_dict()
+        
+        # Enhance links for QGIS
+        if "links" not in item_dict:
+            item_dict["links"] = []
+        
+        # Add collection link for context
+        item_dict["links"].append({
+            "rel": "collection",
+            "href": f"{catalog_generator.base_url}/collections/{collection_id}",
+            "type": "application/json",
+            "title": f"{collection_id} collection"
+        })
+        
+        return item_dict
+    
+    return await catalog_json_response(request, snapshot, build)
+
+
+def parse_search_filter(value, filter_lang: Optional[str]) -> Optional[Dict]:
+    """Normalize a `filter` parameter to CQL2-JSON, 400 when it is malformed"""
+    if value is None or value == "":
+        return None
+    try:
+        return parse_filter(value, filter_lang)
+    except CQL2Error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filter: {e}")
+
+
+async def run_search(request: Request, snapshot: CatalogSnapshot, bbox_list: Optional[List[float]],
+                     intersects_geometry: Optional[Dict], datetime_range: Optional[str],
+                     collections_list: Optional[List[str]],
+                     limit: Optional[int], token: Optional[str], cql2: Optional[Dict],
+                     f: str = "json", body: Optional[Dict] = None) -> Response:
+    """Validate shared /search parameters and answer one page (or a stream) of results"""
+    if bbox_list is not None and len(bbox_list) not in (4, 6):
+        raise HTTPException(status_code=400, detail="Invalid bbox format: Bbox must have 4 or 6 values")
+    
+    if intersects_geometry is not None:
+        if bbox_list:
+            raise HTTPException(status_code=400, detail="Only one of bbox and intersects may be given")
+        try:
+            shape(intersects_geometry)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid intersects geometry: {e}")
     
-    item_dict = item.to_dict()
+    # Validate datetime
+    if datetime_range:
+        try:
+            parse_datetime_interval(datetime_range)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid datetime: {e}")
     
-    # Enhance links for QGIS
-    if "links" not in item_dict:
-        item_dict["links"] = []
+    def search(page_limit: Optional[int], position: int):
+        try:
+            return snapshot.search_page(
+                bbox=bbox_list,
+                datetime_range=datetime_range,
+                collections=collections_list,
+                limit=page_limit,
+                intersects=intersects_geometry,
+                offset=position,
+                filter=cql2
+            )
+        except CQL2Error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid filter: {e}")
     
-    # Add collection link for context
-    item_dict["links"].append({
-        "rel": "collection",
-        "href": f"{catalog_generator.base_url}/collections/{collection_id}",
-        "type": "application/json",
-        "title": f"{collection_id} collection"
-    })
+    position = resolve_page_start(snapshot, token)
+    if f in STREAM_FORMATS:
+        items, matched = await run_in_threadpool(search, limit, position)
+        return stream_items(request, snapshot, items, f, page_links(request, snapshot, position, limit, matched))
+    page_size = limit or 100
     
-    return JSONResponse(content=item_dict)
+    def build():
+        # Search items
+        items, matched = search(page_size, position)
+        
+        items_list = []
+        for item in items:
+            item_dict = item.to_dict()
+            items_list.append(item_dict)
+        
+        return {
+            "type": "FeatureCollection",
+            "features": items_list,
+            "links": [
+                {
+                    "rel": "root",
+                    "href": "/",
+                    "type": "application/json"
+                },
+                {
+                    "rel": "self",
+                    "href": "/search",
+                    "type": "application/json"
+                },
+                *page_links(request, snapshot, position, page_size, matched, body)
+            ],
+            "context": {
+                "returned": len(items_list),
+                "limit": page_size,
+                "matched": matched
+            }
+        }
+    
+    variant = None if body is None else json.dumps([body, token], sort_keys=True, default=str)
+    return await catalog_json_response(request, snapshot, build, variant)
 
 
 @app.get("/search")
 async def search_items(
-    bbox: Optional[str] = Query(None, description="Bounding box: minx,miny,maxx,maxy"),
-    datetime: Optional[str] = Query(None, description="Datetime range"),
+    request: Request,
+    bbox: Optional[str] = Query(None, description="Bounding box: minx,miny,maxx,maxy or minx,miny,minz,maxx,maxy,maxz"),
+    intersects: Optional[str] = Query(None, description="GeoJSON geometry the item footprints must intersect"),
+    datetime: Optional[str] = Query(None, description="RFC 3339 instant or interval (start/end, '..' for an open end)"),
     collections: Optional[str] = Query(None, description="Comma-separated collection IDs"),
-    limit: int = Query(default=100, ge=1, le=1000)
+    limit: Optional[int] = Query(default=None, ge=1, le=1000,
+                                 description="Page size (default 100; streams are unlimited unless given)"),
+    token: Optional[str] = Query(None, description="Continuation token from a next/prev link"),
+    filter: Optional[str] = Query(None, description="CQL2 filter on item properties"),
+    filter_lang: Optional[str] = Query(None, alias="filter-lang", description="cql2-text (default) or cql2-json"),
+    f: str = Query(default="json", description="Output format: json, ndjson or geojsonseq")
 ):
     """Search for items across collections"""
+    snapshot = catalog_generator.snapshot
+    validate_output_format(f)
+    not_modified = catalog_not_modified(request, snapshot)
+    if not_modified:
+        return not_modified
     
     # Parse bbox
     bbox_list = None
     if bbox:
         try:
             bbox_list = [float(x) for x in bbox.split(',')]
-            if len(bbox_list) != 4:
-                raise ValueError("Bbox must have 4 values")
         except ValueError as e:
             raise HTTPException(status_code=400, detail=f"Invalid bbox format: {e}")
     
+    # Parse intersects geometry
+    intersects_geometry = None
+    if intersects:
+        try:
+            intersects_geometry = json.loads(intersects)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid intersects geometry: {e}")
+    
     # Parse collections
     collections_list = None
     if collections:
         collections_list = [c.strip() for c in collections.split(',')]
     
-    # Search items
-    items = catalog_generator.search_items(
-        bbox=bbox_list,
-        datetime_range=datetime,
-        collections=collections_list,
-        limit=limit
-    )
+    cql2 = parse_search_filter(filter, filter_lang or "cql2-text")
+    return await run_search(request, snapshot, bbox_list, intersects_geometry, datetime, collections_list,
+                            limit, token, cql2, f)
+
+
+@app.post("/search")
+async def post_search_items(request: Request, search: SearchRequest):
+    """Search for items across collections, with parameters and CQL2-JSON filters in the body"""
+    snapshot = catalog_generator.snapshot
+    cql2 = parse_search_filter(search.filter, search.filter_lang)
+    body = search.model_dump(by_alias=True, exclude_none=True, exclude={'token'})
+    return await run_search(request, snapshot, search.bbox, search.intersects, search.datetime,
+                            search.collections, search.limit, search.token, cql2, body=body)
+
+
+@app.get("/queryables")
+async def get_queryables(request: Request):
+    """Properties that can be used in /search filters, as JSON Schema"""
+    snapshot = catalog_generator.snapshot
+    not_modified = catalog_not_modified(request, snapshot)
+    if not_modified:
+        return not_modified
     
-    items_list = []
-    for item in items:
-        item_dict = item.to_dict()
-        items_list.append(item_dict)
+    def build():
+        return queryables_schema("/queryables", snapshot.get_queryables())
     
-    return JSONResponse(content={
-        "type": "FeatureCollection",
-        "features": items_list,
-        "links": [
-            {
-                "rel": "root",
-                "href": "/",
-                "type": "application/json"
-            },
-            {
-                "rel": "self",
-                "href": "/search",
-                "type": "application/json"
-            }
+    return await catalog_json_response(request, snapshot, build)
+
+
+@app.get("/collections/{collection_id}/queryables")
+async def get_collection_queryables(request: Request, collection_id: str):
+    """Properties of one collection's items that can be used in filters"""
+    snapshot = catalog_generator.snapshot
+    not_modified = catalog_not_modified(request, snapshot)
+    if not_modified:
+        return not_modified
+    
+    def build():
+        if not snapshot.get_collection(collection_id):
+            raise HTTPException(status_code=404, detail=f"Collection {collection_id} not found")
+        return queryables_schema(f"/collections/{collection_id}/queryables",
+                                 snapshot.get_queryables(collection_id))
+    
+    return await catalog_json_response(request, snapshot, build)
+
+
+def queryables_schema(path: str, properties: Dict) -> Dict:
+    """Wrap queryable properties in a JSON Schema document"""
+    return {
+        "$schema": "https://json-schema.org/draft/2019-09/schema",
+        "$id": f"{catalog_generator.base_url}{path}",
+        "type": "object",
+        "title": "Queryables",
+        "properties": properties,
+        "additionalProperties": True
+    }
+
+
+# Open PMTiles archives for server-side tile lookups
+pmtiles_pool = PMTilesArchivePool(
+    max_open=settings.pmtiles_max_open_archives,
+    directory_cache_entries=settings.pmtiles_directory_cache_entries
+)
+
+
+def get_pmtiles_archive(item_id: str) -> PMTilesArchive:
+    """Open (or reuse) the PMTiles archive behind an item"""
+    file_path = catalog_generator.get_item_path('pmtiles', item_id)
+    if not file_path or not file_path.is_file():
+        raise HTTPException(status_code=404, detail=f"PMTiles item {item_id} not found")
+    try:
+        return pmtiles_pool.get(file_path)
+    except Exception as e:
+        logger.error(f"Error opening PMTiles archive {file_path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Could not open PMTiles item {item_id}")
+
+
+@app.get("/tiles/{item_id}/tilejson.json")
+async def get_pmtiles_tilejson(item_id: str):
+    """TileJSON for a PMTiles item, pointing at the /tiles endpoint"""
+    archive = await run_in_threadpool(get_pmtiles_archive, item_id)
+    header = archive.header
+    metadata = await run_in_threadpool(archive.metadata)
+    
+    tilejson = {
+        "tilejson": "3.0.0",
+        "name": item_id,
+        "tiles": [f"{catalog_generator.base_url}/tiles/{item_id}/{{z}}/{{x}}/{{y}}"],
+        "minzoom": header["min_zoom"],
+        "maxzoom": header["max_zoom"],
+        "bounds": [
+            header["min_lon_e7"] / 1e7, header["min_lat_e7"] / 1e7,
+            header["max_lon_e7"] / 1e7, header["max_lat_e7"] / 1e7
         ],
-        "context": {
-            "returned": len(items_list),
-            "limit": limit
-        }
-    })
+        "center": [header["center_lon_e7"] / 1e7, header["center_lat_e7"] / 1e7, header["center_zoom"]],
+    }
+    for key in ("vector_layers", "attribution", "description"):
+        if key in metadata:
+            tilejson[key] = metadata[key]
+    
+    return JSONResponse(content=tilejson)
+
+
+@app.get("/tiles/{item_id}/{z}/{x}/{y}")
+async def get_pmtiles_tile(request: Request, item_id: str, z: int, x: int, y: str):
+    """Serve one XYZ tile from a PMTiles item, passed through still compressed"""
+    # Accept template suffixes such as {y}.mvt or {y}.png
+    try:
+        y_index = int(y.split('.', 1)[0])
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid tile row: {y}")
+    
+    archive = await run_in_threadpool(get_pmtiles_archive, item_id)
+    header = archive.header
+    if (z < header["min_zoom"] or z > header["max_zoom"]
+            or not (0 <= x < 2 ** z) or not (0 <= y_index < 2 ** z)):
+        raise HTTPException(status_code=404, detail=f"Tile {z}/{x}/{y_index} outside archive")
+    
+    result = await run_in_threadpool(archive.get_tile, z, x, y_index)
+    if result is None:
+        # Valid address without data (e.g. empty ocean tile)
+        return Response(status_code=204)
+    tile_data, tile_offset = result
+    
+    headers = {
+        'ETag': make_etag(*archive.identity, tile_offset),
+        'Cache-Control': settings.data_cache_control,
+    }
+    precondition_status = evaluate_preconditions(request.method, request.headers, headers['ETag'])
+    if precondition_status:
+        return Response(status_code=precondition_status, headers=headers)
+    
+    # Tiles are stored compressed; hand them over as-is with the matching encoding
+    if archive.content_encoding:
+        headers['Content-Encoding'] = archive.content_encoding
+    
+    return Response(content=tile_data, media_type=archive.media_type, headers=headers)
+
+
+# Dynamic tile rendering for COG items (thread pool + pooled dataset handles)
+cog_renderer = COGTileRenderer(
+    tile_size=settings.cog_tile_size,
+    workers=settings.cog_render_workers,
+    max_open_files=settings.cog_max_open_files,
+    handles_per_file=settings.cog_handles_per_file,
+    memory_cache_bytes=settings.tile_memory_cache_bytes,
+    disk_cache=DiskCache(settings.tile_disk_cache_directory, settings.tile_disk_cache_bytes)
+    if settings.tile_disk_cache_directory else None
+)
+
+
+@app.get("/cog/{item_id}/tiles/{z}/{x}/{y}.{fmt}")
+async def get_cog_tile(request: Request, item_id: str, z: int, x: int, y: int, fmt: str):
+    """Render an XYZ tile (png or webp) from a COG item"""
+    if fmt not in TILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported tile format: {fmt}")
+    if z < 0 or z > 30 or not (0 <= x < 2 ** z) or not (0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail=f"Invalid tile {z}/{x}/{y}")
+    
+    file_path = catalog_generator.get_item_path('cog', item_id)
+    if not file_path or not file_path.is_file():
+        raise HTTPException(status_code=404, detail=f"COG item {item_id} not found")
+    
+    stat_result = file_path.stat()
+    headers = {
+        'ETag': make_etag(stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino,
+                          z, x, y, settings.cog_tile_size, fmt),
+        'Cache-Control': settings.data_cache_control,
+    }
+    precondition_status = evaluate_preconditions(request.method, request.headers, headers['ETag'])
+    if precondition_status:
+        return Response(status_code=precondition_status, headers=headers)
+    
+    try:
+        loop = asyncio.get_running_loop()
+        tile = await loop.run_in_executor(
+            cog_renderer.executor, cog_renderer.get_tile, file_path, z, x, y, fmt
+        )
+    except Exception as e:
+        logger.error(f"Error rendering tile {z}/{x}/{y} for {item_id}: {e}")
+        raise HTTPException(status_code=500, detail="Tile rendering failed")
+    
+    if tile is None:
+        return Response(status_code=204, headers=headers)
+    
+    return Response(content=tile, media_type=TILE_FORMATS[fmt][1], headers=headers)
+
+
+# Parsed GeoParquet footers for feature queries
+geoparquet_datasets = GeoParquetDatasetCache()
+
+
+@app.get("/collections/geoparquet/items/{item_id}/features")
+async def get_geoparquet_features(
+    item_id: str,
+    bbox: Optional[str] = Query(None, description="Bounding box in the file's CRS: minx,miny,maxx,maxy"),
+    limit: Optional[int] = Query(default=None, ge=1, description="Maximum number of features"),
+    properties: Optional[str] = Query(None, description="Comma-separated property columns to return"),
+    f: str = Query(default="geojson", description="Output format: geojson or arrow")
+):
+    """
+    Query the features of one GeoParquet item.
+    
+    Row groups whose `bbox` covering column statistics do not intersect the
+    query box are skipped without being read.
+    """
+    if f not in ("geojson", "arrow"):
+        raise HTTPException(status_code=400, detail=f"Unsupported output format: {f}")
+    
+    query_bbox = None
+    if bbox:
+        try:
+            query_bbox = tuple(float(x) for x in bbox.split(','))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid bbox format")
+        if len(query_bbox) != 4:
+            raise HTTPException(status_code=400, detail="Invalid bbox format")
+    
+    file_path = catalog_generator.get_item_path('geoparquet', item_id)
+    if not file_path or not file_path.is_file():
+        raise HTTPException(status_code=404, detail=f"GeoParquet item {item_id} not found")
+    
+    try:
+        dataset = await run_in_threadpool(geoparquet_datasets.open, file_path)
+    except Exception as e:
+        logger.error(f"Error opening GeoParquet file {file_path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Could not open GeoParquet item {item_id}")
+    
+    columns = None
+    if properties is not None:
+        columns = [p.strip() for p in properties.split(',') if p.strip()]
+        unknown = [p for p in columns if p not in dataset.property_columns]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown properties: {', '.join(unknown)}")
+    
+    if f == "arrow":
+        return StreamingResponse(dataset.iter_arrow(query_bbox, limit, columns),
+                                 media_type="application/vnd.apache.arrow.stream")
+    return StreamingResponse(dataset.iter_geojson(query_bbox, limit, columns),
+                             media_type="application/geo+json")
+
+
+# Parsed FlatGeobuf headers and R-tree nodes for feature queries
+flatgeobuf_files = FlatGeobufFileCache(node_cache_bytes=settings.flatgeobuf_node_cache_bytes)
+
+
+@app.get("/collections/flatgeobuf/items/{item_id}/features")
+async def get_flatgeobuf_features(
+    item_id: str,
+    bbox: Optional[str] = Query(None, description="Bounding box in the file's CRS: minx,miny,maxx,maxy"),
+    limit: Optional[int] = Query(default=None, ge=1, description="Maximum number of features"),
+    f: str = Query(default="geojson", description="Output format: geojson or fgb")
+):
+    """
+    Query the features of one FlatGeobuf item.
+    
+    The packed Hilbert R-tree is searched from the root and only the byte
+    ranges of matching features are read.
+    """
+    if f not in ("geojson", "fgb"):
+        raise HTTPException(status_code=400, detail=f"Unsupported output format: {f}")
+    
+    query_bbox = None
+    if bbox:
+        try:
+            query_bbox = tuple(float(x) for x in bbox.split(','))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid bbox format")
+        if len(query_bbox) != 4:
+            raise HTTPException(status_code=400, detail="Invalid bbox format")
+    
+    file_path = catalog_generator.get_item_path('flatgeobuf', item_id)
+    if not file_path or not file_path.is_file():
+        raise HTTPException(status_code=404, detail=f"FlatGeobuf item {item_id} not found")
+    
+    try:
+        fgb = await run_in_threadpool(flatgeobuf_files.open, file_path)
+    except Exception as e:
+        logger.error(f"Error opening FlatGeobuf file {file_path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Could not open FlatGeobuf item {item_id}")
+    
+    if f == "fgb":
+        return StreamingResponse(fgb.iter_flatgeobuf(query_bbox, limit), media_type="application/flatgeobuf")
+    return StreamingResponse(fgb.iter_geojson(query_bbox, limit), media_type="application/geo+json")
+
+
+# Parsed COPC headers and hierarchy pages for point queries
+copc_files = COPCFileCache(hierarchy_cache_entries=settings.copc_hierarchy_cache_entries)
+
+
+@app.get("/collections/copc/items/{item_id}/points")
+async def get_copc_points(
+    item_id: str,
+    bbox: Optional[str] = Query(None, description="Bounding box in the file's CRS: minx,miny,maxx,maxy"),
+    max_depth: Optional[int] = Query(default=None, ge=0, description="Deepest octree level to read"),
+    max_points: Optional[int] = Query(default=None, ge=1, description="Point budget; whole levels are dropped to stay below it"),
+    f: str = Query(default="arrow", description="Output format: arrow or laz")
+):
+    """
+    Query the points of one COPC item by bbox and level of detail.
+    
+    Only the octree nodes that intersect the bbox and lie above `max_depth`
+    are decompressed. The deepest level returned is sent as `X-Octree-Depth`.
+    """
+    if not HAS_LAZRS:
+        raise HTTPException(status_code=501, detail="COPC point queries require the lazrs package")
+    if f not in ("arrow", "laz"):
+        raise HTTPException(status_code=400, detail=f"Unsupported output format: {f}")
+    
+    query_bbox = None
+    if bbox:
+        try:
+            query_bbox = tuple(float(x) for x in bbox.split(','))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid bbox format")
+        if len(query_bbox) != 4:
+            raise HTTPException(status_code=400, detail="Invalid bbox format")
+    
+    file_path = catalog_generator.get_item_path('copc', item_id)
+    if not file_path or not file_path.is_file():
+        raise HTTPException(status_code=404, detail=f"COPC item {item_id} not found")
+    
+    point_budget = min(max_points or settings.copc_max_points, settings.copc_max_points)
+    try:
+        copc = await run_in_threadpool(copc_files.open, file_path)
+        nodes, depth = await run_in_threadpool(copc.select, query_bbox, max_depth, point_budget)
+    except Exception as e:
+        logger.error(f"Error reading COPC hierarchy of {file_path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Could not read COPC item {item_id}")
+    
+    headers = {'X-Octree-Depth': str(depth)}
+    if f == "laz":
+        laz = await run_in_threadpool(copc.to_laz, nodes, query_bbox)
+        return Response(content=laz, media_type="application/vnd.laszip", headers=headers)
+    return StreamingResponse(copc.iter_arrow(nodes, query_bbox),
+                             media_type="application/vnd.apache.arrow.stream", headers=headers)
 
 
-def refresh_catalog_background():
-    """Background task to refresh the catalog"""
+def run_catalog_refresh(initial: bool = False, full: bool = False) -> bool:
+    """
+    Refresh the catalog. Only files that changed since the last scan (or the
+    stored catalog) are extracted unless `full` is set; the initial scan also
+    publishes progressively. The caller owns `is_running`.
+    
+    Returns:
+        True if the refresh completed
+    """
     global refresh_status
     try:
-        refresh_status["is_running"] = True
         refresh_status["error"] = None
         start_time = datetime.now()
         
-        logger.info("Starting background catalog refresh...")
-        catalog_generator.refresh_catalog()
+        if initial:
+            logger.info(f"Scanning data directory: {settings.data_directory}")
+            catalog_generator.build_catalog(publish_interval=settings.catalog_publish_interval)
+        else:
+            logger.info("Starting background catalog refresh...")
+            catalog_generator.refresh_catalog(full=full)
+        json_bodies.clear()
         
         # Get updated collection count
         collections = catalog_generator.get_collections()
@@ -429,25 +1133,74 @@ def refresh_catalog_background():
         refresh_status["last_refresh"] = end_time.isoformat()
         refresh_status["last_duration"] = duration
         refresh_status["collections_count"] = len(collections)
+        refresh_status["initial_scan_complete"] = True
         logger.info(f"Catalog refresh complete. Took {duration:.2f} seconds. Found {len(collections)} collections.")
+        return True
     except Exception as e:
         logger.error(f"Error during catalog refresh: {e}")
         refresh_status["error"] = str(e)
+        return False
+
+
+def refresh_catalog_background(initial: bool = False, full: bool = False):
+    """Background task to refresh the catalog (see run_catalog_refresh)"""
+    try:
+        refresh_status["is_running"] = True
+        run_catalog_refresh(initial=initial, full=full)
+    finally:
+        refresh_status["is_running"] = False
+
+
+def initial_catalog_scan():
+    """
+    Publish the stored catalog, then scan the data directory. A failed scan
+    is retried with exponential backoff until it completes; meanwhile
+    /health/ready reports the error and the next attempt.
+    
+    `is_running` stays set across the retries, so POST /refresh cannot start
+    a second scan while this one waits to try again.
+    """
+    refresh_status["is_running"] = True
+    try:
+        start_time = datetime.now()
+        try:
+            if catalog_generator.load_snapshot():
+                refresh_status["snapshot_loaded"] = True
+                json_bodies.clear()
+                logger.info(f"Loaded stored catalog with {len(catalog_generator.manifest)} files "
+                            f"in {(datetime.now() - start_time).total_seconds():.2f} seconds")
+        except Exception as e:
+            logger.error(f"Could not publish the stored catalog: {e}")
+        
+        delay = settings.initial_scan_retry_seconds
+        while not run_catalog_refresh(initial=True):
+            refresh_status["initial_scan_failures"] += 1
+            refresh_status["next_retry"] = (datetime.now() + timedelta(seconds=delay)).isoformat()
+            logger.warning(f"Initial catalog scan failed, retrying in {delay:g} seconds")
+            time.sleep(delay)
+            refresh_status["next_retry"] = None
+            delay = min(delay * 2, settings.initial_scan_retry_max_seconds)
     finally:
         refresh_status["is_running"] = False
 
+
 @app.post("/refresh")
-async def refresh_catalog(background_tasks: BackgroundTasks):
+async def refresh_catalog(
+    background_tasks: BackgroundTasks,
+    full: bool = Query(default=False, description="Re-extract every file instead of only changed ones")
+):
     """Refresh the STAC catalog by re-scanning the data directory (async)"""
     if refresh_status["is_running"]:
         return JSONResponse(content={
             "status": "running",
             "message": "Catalog refresh already in progress",
-            "is_running": True
+            "is_running": True,
+            "next_retry": refresh_status["next_retry"]
         })
     
     # Start refresh in background
-    background_tasks.add_task(refresh_catalog_background)
+    refresh_status["is_running"] = True
+    background_tasks.add_task(refresh_catalog_background, full=full)
     
     return JSONResponse(content={
         "status": "started",
@@ -463,7 +1216,47 @@ async def get_refresh_status():
         "last_refresh": refresh_status["last_refresh"],
         "last_duration_seconds": refresh_status["last_duration"],
         "collections_count": refresh_status.get("collections_count"),
-        "error": refresh_status["error"]
+        "error": refresh_status["error"],
+        "initial_scan_complete": refresh_status["initial_scan_complete"],
+        "next_retry": refresh_status["next_retry"],
+        "catalog_version": catalog_generator.version,
+        "progress": catalog_generator.scan_progress,
+        "watcher": catalog_watcher.stats() if catalog_watcher else None
+    })
+
+
+@app.on_event("startup")
+async def start_initial_scan():
+    """
+    Load the stored catalog and scan the data directory in a background
+    thread so the API serves requests at once
+    """
+    # Watch before scanning so no change falls between the scan and the watcher;
+    # changes wait for the scan to finish
+    if catalog_watcher:
+        catalog_watcher.start()
+    refresh_status["is_running"] = True
+    threading.Thread(target=initial_catalog_scan, name="initial-catalog-scan", daemon=True).start()
+
+
+@app.on_event("shutdown")
+async def stop_catalog_watcher():
+    if catalog_watcher:
+        catalog_watcher.stop()
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Hit/miss counters and memory use of the server-side caches"""
+    return JSONResponse(content={
+        "range_cache": range_cache.stats(),
+        "pmtiles": pmtiles_pool.stats(),
+        "cog_tiles": cog_renderer.stats(),
+        "flatgeobuf": flatgeobuf_files.stats(),
+        "copc": copc_files.stats(),
+        "json_bodies": json_bodies.stats(),
+        "catalog_store": catalog_store.stats() if catalog_store else None,
+        "metadata_cache": metadata_cache.stats() if metadata_cache else None
     })
 
 
@@ -477,6 +1270,40 @@ async def health_check():
     })
 
 
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: the process is up and answering, whatever the catalog state"""
+    return JSONResponse(content={"status": "alive"})
+
+
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Readiness: 200 once a complete catalog is published (the stored one or
+    the first full scan), 503 while the stored catalog is loading or a cold
+    start is still scanning. After a failed scan the body has the error and
+    when the scan is retried.
+    """
+    ready = refresh_status["snapshot_loaded"] or refresh_status["initial_scan_complete"]
+    snapshot = catalog_generator.snapshot
+    if ready:
+        status = "ready"
+    else:
+        status = "retrying" if refresh_status["next_retry"] else "starting"
+    return JSONResponse(status_code=200 if ready else 503, content={
+        "status": status,
+        "snapshot_loaded": refresh_status["snapshot_loaded"],
+        "initial_scan_complete": refresh_status["initial_scan_complete"],
+        "scanning": refresh_status["is_running"],
+        "error": refresh_status["error"],
+        "failed_scans": refresh_status["initial_scan_failures"],
+        "next_retry": refresh_status["next_retry"],
+        "catalog_version": snapshot.version,
+        "items": len(snapshot.search_entries),
+        "progress": catalog_generator.scan_progress
+    })
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host=settings.api_host, port=settings.api_port)
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from pathlib import Path
+from typing import List, Optional
 import os
 
 
@@ -11,6 +12,74 @@ class Settings(BaseSettings):
     api_host: str = "0.0.0.0"
     api_port: int = 8000
     
+    # File serving (/data): auto, sendfile, mmap or read
+    file_serving_mode: str = "auto"
+    file_read_chunk_size: int = 1024 * 1024
+    file_readahead: bool = True
+    file_max_open_maps: int = 128
+    
+    # In-memory cache of hot header/index byte ranges
+    range_cache_max_bytes: int = 256 * 1024 * 1024
+    range_cache_max_block_bytes: int = 8 * 1024 * 1024
+    
+    # Server-side PMTiles tiles (/tiles)
+    pmtiles_max_open_archives: int = 64
+    pmtiles_directory_cache_entries: int = 500_000
+    
+    # Dynamic COG tiles (/cog/{item}/tiles)
+    cog_tile_size: int = 256
+    cog_render_workers: int = 4
+    cog_max_open_files: int = 32
+    cog_handles_per_file: int = 4
+    tile_memory_cache_bytes: int = 64 * 1024 * 1024
+    tile_disk_cache_directory: Optional[Path] = Path("./cache/tiles")
+    tile_disk_cache_bytes: int = 1024 * 1024 * 1024
+    
+    # FlatGeobuf feature queries: parsed R-tree node blocks shared by all files
+    flatgeobuf_node_cache_bytes: int = 64 * 1024 * 1024
+    
+    # COPC point queries: hierarchy page cache (entries) and points per response
+    copc_hierarchy_cache_entries: int = 1_000_000
+    copc_max_points: int = 5_000_000
+    
+    # Serialized/compressed STAC JSON bodies (gzip always; br/zstd when installed)
+    json_cache_max_bytes: int = 64 * 1024 * 1024
+    json_compress_min_size: int = 1024
+    
+    # Data directory scan: exclude globs (as in .stacignore files, JSON list), maximum
+    # directory depth below the data directory (0 = top level only) and directories listed at once
+    scan_exclude: List[str] = []
+    scan_max_depth: Optional[int] = None
+    scan_workers: int = 8
+    
+    # Persistent catalog state (manifest and extracted metadata); None disables it
+    catalog_store_path: Optional[Path] = Path("./cache/catalog.sqlite")
+    # Extracted metadata by file identity and extractor version, kept across rebuilds
+    # and store resets; None disables it
+    metadata_cache_path: Optional[Path] = Path("./cache/metadata.sqlite")
+    # Seconds between publishing partial results while the initial scan runs
+    catalog_publish_interval: float = 5.0
+    # Seconds before a failed initial scan is retried; doubled after each failure up to the maximum
+    initial_scan_retry_seconds: float = 5.0
+    initial_scan_retry_max_seconds: float = 300.0
+    # Parallel metadata extraction: processes for formats that decode data (GeoParquet,
+    # COPC; 0 = one per CPU, 1 = extract serially in the scanning thread) and threads
+    # for header-only formats (COG, FlatGeobuf, PMTiles)
+    extraction_workers: int = 0
+    extraction_io_threads: int = 8
+    # Seconds before one file's extraction is abandoned and the file counted as failed
+    extraction_timeout: float = 300.0
+    # Apply file changes to the live catalog: off, auto (inotify, else polling), events or poll.
+    # Use poll on network mounts, which do not deliver filesystem events.
+    catalog_watch: str = "off"
+    # Seconds a changed file must keep its size and mtime before it is extracted
+    catalog_watch_settle_seconds: float = 2.0
+    catalog_watch_poll_interval: float = 5.0
+    
+    # Cache-Control for data files and STAC JSON (both carry ETag/Last-Modified)
+    data_cache_control: str = "public, max-age=300"
+    catalog_cache_control: str = "public, no-cache"
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -0,0 +1,16 @@
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Any, Dict, List, Optional, Union
+
+
+class SearchRequest(BaseModel):
+    """Body of POST /search (STAC API Item Search with the Filter extension)"""
+    model_config = ConfigDict(populate_by_name=True)
+
+    bbox: Optional[List[float]] = None
+    intersects: Optional[Dict[str, Any]] = None
+    datetime: Optional[str] = None
+    collections: Optional[List[str]] = None
+    limit: Optional[int] = Field(default=None, ge=1, le=1000)
+    token: Optional[str] = None
+    filter: Optional[Union[Dict[str, Any], str]] = None
+    filter_lang: Optional[str] = Field(default=None, alias="filter-lang")
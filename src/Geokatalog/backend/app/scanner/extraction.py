@@ -0,0 +1,254 @@
+"""Parallel metadata extraction with per-file timeouts and crash isolation"""
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.cache.metadata_cache import MetadataCache
+from app.scanner.file_scanner import FileScanner
+
+logger = logging.getLogger(__name__)
+
+# Formats whose extraction reads the data itself (sampled geometries for the outline,
+# all points) and is CPU bound; the others only read headers and mostly wait on I/O
+PROCESS_FORMATS = frozenset({'geoparquet', 'copc'})
+
+# Scanner of a worker process, created once by the pool initializer
+_worker_scanner: Optional[FileScanner] = None
+
+
+def _init_worker(data_directory: str, base_url: str):
+    global _worker_scanner
+    _worker_scanner = FileScanner(Path(data_directory), base_url)
+
+
+def _extract_in_worker(path: Path) -> Optional[Dict]:
+    return _worker_scanner.extract_metadata(path)
+
+
+class ExtractionResult(NamedTuple):
+    path: Path
+    # None when the file could not be read
+    metadata: Optional[Dict]
+    # Set when the extraction itself failed: timeout, crashed worker or exception
+    error: Optional[str] = None
+    # Served from the metadata cache without opening the file
+    cached: bool = False
+
+
+class _Lane:
+    """One executor with at most `capacity` files in flight, so each file's deadline starts when it runs"""
+
+    def __init__(self, capacity: int, create_executor: Callable[[], Executor],
+                 call: Callable[[Path], Optional[Dict]], processes: bool):
+        self.capacity = capacity
+        self.create_executor = create_executor
+        self.call = call
+        self.processes = processes
+        self.executor: Optional[Executor] = None
+        self.queue: Deque[Path] = deque()
+        # Files in flight when a worker process died; they run one at a time to find the culprit
+        self.suspects: Deque[Path] = deque()
+        # Future -> file, deadline and whether it runs alone as a suspect
+        self.in_flight: Dict[Future, Tuple[Path, float, bool]] = {}
+
+    @property
+    def busy(self) -> bool:
+        return bool(self.queue or self.suspects or self.in_flight)
+
+    def fill(self, timeout: float):
+        while self.suspects and not self.in_flight:
+            self._submit(self.suspects.popleft(), timeout, True)
+        while self.queue and not self.suspects and len(self.in_flight) < self.capacity:
+            self._submit(self.queue.popleft(), timeout, False)
+
+    def _submit(self, path: Path, timeout: float, isolated: bool):
+        if self.executor is None:
+            self.executor = self.create_executor()
+        future = self.executor.submit(self.call, path)
+        self.in_flight[future] = (path, time.monotonic() + timeout, isolated)
+
+    def requeue_in_flight(self, into: Deque[Path]):
+        """Put the files in flight back in front of `into`, keeping their order"""
+        into.extendleft(reversed([path for path, _, _ in self.in_flight.values()]))
+        self.in_flight.clear()
+
+    def reset(self):
+        """
+        Drop the executor. Worker processes are terminated, which is the only
+        way to stop a hung extraction; a hung thread is left behind and the
+        lane continues on a new pool.
+        """
+        executor, self.executor = self.executor, None
+        if executor is None:
+            return
+        processes = list((getattr(executor, '_processes', None) or {}).values()) if self.processes else []
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def close(self):
+        if self.in_flight or not self.processes:
+            self.in_flight.clear()
+            self.reset()
+        elif self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+class ParallelExtractor:
+    """
+    Extracts metadata of many files in parallel.
+
+    Formats that read the data (PROCESS_FORMATS) run in a pool of up to
+    `workers` processes, header-only formats in `io_threads` threads. A file
+    taking longer than `timeout` seconds is reported as failed and its worker
+    process is killed; a file that crashes a worker process (e.g. a segfault
+    in a native library) is found by re-running the files that were in
+    flight one at a time, and only that file fails. With `workers` 1 files
+    are extracted one by one in the calling thread, without timeouts.
+
+    A pool lives for one call of `extract`, so idle scans hold no processes.
+
+    With a `cache`, files whose identity and extractor version have a cache
+    entry are answered from it first; extracted metadata is stored under the
+    file version stat'ed before the extraction started, so a file modified
+    meanwhile is not cached as its newer version.
+    """
+
+    def __init__(self, scanner: FileScanner, workers: int = 1, io_threads: int = 8, timeout: float = 300.0,
+                 cache: Optional[MetadataCache] = None):
+        self.scanner = scanner
+        self.workers = workers
+        self.io_threads = io_threads
+        self.timeout = timeout
+        self.cache = cache
+
+    def extract(self, paths: Iterable[Path], use_cache: bool = True) -> Iterator[ExtractionResult]:
+        """
+        Extract every file, yielding results in completion order. Without
+        `use_cache` every file is extracted and the cache is only written.
+        """
+        if self.cache is None:
+            yield from self._extract(list(paths))
+            return
+        versions: Dict[str, Tuple[os.stat_result, str]] = {}
+        misses: List[Path] = []
+        for path in paths:
+            file_type = self.scanner.get_file_type(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                misses.append(path)
+                continue
+            versions[str(path)] = (st, file_type)
+            metadata = self._cache_get(path, st, file_type) if use_cache else None
+            if metadata is None:
+                misses.append(path)
+            else:
+                yield ExtractionResult(path, metadata, cached=True)
+        for result in self._extract(misses):
+            version = versions.get(str(result.path))
+            if result.metadata and version is not None:
+                st, file_type = version
+                try:
+                    self.cache.put(result.path, st, file_type, self.scanner.EXTRACTOR_VERSIONS[file_type],
+                                   result.metadata)
+                except Exception as e:
+                    logger.warning(f"Could not cache metadata of {result.path}: {e}")
+            yield result
+
+    def _cache_get(self, path: Path, st: os.stat_result, file_type: str) -> Optional[Dict]:
+        try:
+            return self.cache.get(path, st, file_type, self.scanner.EXTRACTOR_VERSIONS[file_type])
+        except Exception as e:
+            logger.warning(f"Metadata cache lookup failed for {path}: {e}")
+            return None
+
+    def _extract(self, paths: List[Path]) -> Iterator[ExtractionResult]:
+        if self.workers <= 1:
+            for path in paths:
+                yield ExtractionResult(path, self.scanner.extract_metadata(path))
+            return
+
+        heavy = [path for path in paths if self.scanner.get_file_type(path) in PROCESS_FORMATS]
+        process_lane = _Lane(
+            min(self.workers, max(1, len(heavy))),
+            lambda: ProcessPoolExecutor(
+                max_workers=min(self.workers, max(1, len(heavy))),
+                # Forking a process that runs threads (server, watcher, GDAL) is unsafe
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(str(self.scanner.data_directory), self.scanner.base_url)
+            ),
+            _extract_in_worker, processes=True
+        )
+        thread_lane = _Lane(
+            max(1, self.io_threads),
+            lambda: ThreadPoolExecutor(max_workers=max(1, self.io_threads), thread_name_prefix="extract"),
+            self.scanner.extract_metadata, processes=False
+        )
+        heavy_set = set(heavy)
+        for path in paths:
+            (process_lane if path in heavy_set else thread_lane).queue.append(path)
+        lanes: List[_Lane] = [process_lane, thread_lane]
+
+        try:
+            while any(lane.busy for lane in lanes):
+                for lane in lanes:
+                    lane.fill(self.timeout)
+                owners = {future: lane for lane in lanes for future in lane.in_flight}
+                next_deadline = min(deadline for lane in lanes for _, deadline, _ in lane.in_flight.values())
+                done, _ = wait(owners, timeout=max(0.0, next_deadline - time.monotonic()),
+                               return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    lane = owners[future]
+                    if future not in lane.in_flight:
+                        # Discarded when its pool broke or was reset
+                        continue
+                    path, _, isolated = lane.in_flight.pop(future)
+                    try:
+                        metadata = future.result()
+                    except BrokenProcessPool:
+                        if isolated:
+                            lane.reset()
+                            logger.error(f"Extracting {path} crashed the worker process")
+                            yield ExtractionResult(path, None, "worker process crashed")
+                        else:
+                            # Any of the files in flight may have killed the worker
+                            lane.suspects.append(path)
+                            lane.suspects.extend(other for other, _, _ in lane.in_flight.values())
+                            lane.in_flight.clear()
+                            lane.reset()
+                        continue
+                    except Exception as e:
+                        logger.error(f"Error extracting metadata from {path}: {e}")
+                        yield ExtractionResult(path, None, str(e))
+                        continue
+                    if lane.processes and metadata:
+                        # The worker has no range cache; warm this process's
+                        self.scanner.prefetch_ranges(path)
+                    yield ExtractionResult(path, metadata)
+
+                now = time.monotonic()
+                for lane in lanes:
+                    for future, (path, deadline, _) in list(lane.in_flight.items()):
+                        if future not in lane.in_flight or deadline > now or future.done():
+                            continue
+                        del lane.in_flight[future]
+                        logger.error(f"Extracting {path} timed out after {self.timeout:g} s")
+                        if lane.processes:
+                            # Killing the hung worker takes its pool with it; rerun the others
+                            lane.requeue_in_flight(lane.queue)
+                        lane.reset()
+                        yield ExtractionResult(path, None, "timed out")
+        finally:
+            for lane in lanes:
+                lane.close()
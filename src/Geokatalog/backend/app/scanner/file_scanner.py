@@ -1,22 +1,39 @@
 """File scanner for detecting and extracting metadata from geospatial files"""
 import os
+from collections import Counter
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 from datetime import datetime
 import logging
 
 import rasterio
-import geopandas as gpd
-import pyarrow.parquet as pq
-import fiona
 from pmtiles.reader import Reader as PMTilesReader
 from pmtiles.reader import MmapSource
 import laspy
+import numpy as np
+import shapely
 from shapely.geometry import box, mapping
 import json
 
+from app.cache.lru import SizedLRUCache
+from app.cache.range_cache import RangeCache, file_identity
+from app.features.flatgeobuf import GEOMETRY_TYPES, NODE_ITEM_BYTES, FlatGeobufFile
+from app.features.geoparquet import GeoParquetDataset
+from app.scanner.walker import DirectoryWalker, WalkEntry
+
 logger = logging.getLogger(__name__)
 
+# GeoParquet CRS when the `geo` metadata has none (longitude/latitude WGS 84)
+OGC_CRS84 = {'name': 'WGS 84 (CRS84)', 'id': {'authority': 'OGC', 'code': 'CRS84'}}
+
+# FlatGeobuf ColumnType -> fiona field type
+FLATGEOBUF_COLUMN_TYPES = {
+    0: 'int', 1: 'int', 2: 'bool', 3: 'int', 4: 'int', 5: 'int', 6: 'int', 7: 'int', 8: 'int',
+    9: 'float', 10: 'float', 11: 'str', 12: 'str', 13: 'datetime', 14: 'bytes',
+}
+# Most R-tree node boxes read for a FlatGeobuf footprint (40 bytes each)
+FOOTPRINT_MAX_NODES = 256
+
 # PDAL is optional - only needed for advanced COPC features
 try:
     import pdal
@@ -37,9 +54,30 @@ class FileScanner:
         'copc': ['.copc.laz', '.laz']
     }
     
-    def __init__(self, data_directory: Path, base_url: str = "http://localhost:8000"):
+    # Lower-case extension -> file type; '.copc.laz' is checked first
+    EXTENSION_TYPES = {
+        ext: file_type for file_type, extensions in SUPPORTED_EXTENSIONS.items()
+        for ext in extensions if ext.count('.') == 1
+    }
+    
+    # Bump a format's version when its extractor produces different metadata,
+    # so cached and stored results of that format are extracted again
+    EXTRACTOR_VERSIONS = {
+        'cog': 1,
+        'geoparquet': 2,
+        'flatgeobuf': 2,
+        'pmtiles': 1,
+        'copc': 1
+    }
+    
+    def __init__(self, data_directory: Path, base_url: str = "http://localhost:8000",
+                 range_cache: Optional[RangeCache] = None, exclude: Sequence[str] = (),
+                 max_depth: Optional[int] = None, walk_workers: int = 8):
         self.data_directory = Path(data_directory)
         self.base_url = base_url
+        self.range_cache = range_cache
+        self.walker = DirectoryWalker(self.data_directory, self.get_file_type, exclude=exclude,
+                                      max_depth=max_depth, workers=walk_workers)
         if not self.data_directory.exists():
             logger.warning(f"Data directory {self.data_directory} does not exist")
     
@@ -141,76 +179,40 @@ class FileScanner:
             logger.warning(f"Could not format CRS info: {e}")
             return {'type': 'name', 'properties': {'name': str(crs)[:100]}}
     
-    def _get_data_outline(self, src, bbox: List[float]) -> Dict:
-        """Get convex hull outline of actual data for better visualization"""
-        try:
-            from shapely.ops import unary_union
-            from shapely.geometry import shape
-            
-            # Sample features to create outline (limit to avoid performance issues)
-            sample_size = min(1000, len(src))
-            step = max(1, len(src) // sample_size)
-            
-            geometries = []
-            for i, feature in enumerate(src):
-                if i % step == 0:
-                    try:
-                        geom = shape(feature['geometry'])
-                        if geom.is_valid:
-                            geometries.append(geom)
-                    except:
-                        continue
-                
-                if len(geometries) >= sample_size:
-                    break
-            
-            if geometries:
-                # Create convex hull of all sampled geometries
-                combined = unary_union(geometries)
-                convex_hull = combined.convex_hull
-                
-                # Simplify to reduce complexity
-                simplified = convex_hull.simplify(tolerance=0.01, preserve_topology=True)
-                
-                return mapping(simplified)
-            else:
-                # Fallback to bounding box
-                return mapping(box(*bbox))
-                
-        except Exception as e:
-            logger.warning(f"Could not create convex hull, using bbox: {e}")
-            return mapping(box(*bbox))
-    
-    def scan_directory(self) -> Dict[str, List[Path]]:
-        """Scan directory for supported geospatial files"""
-        files_by_type = {fmt: [] for fmt in self.SUPPORTED_EXTENSIONS.keys()}
+    def scan_entries(self, start: Optional[Path] = None) -> Dict[str, List[WalkEntry]]:
+        """Supported files below `start` (default the data directory) by type, with their stat results"""
+        entries_by_type = {fmt: [] for fmt in self.SUPPORTED_EXTENSIONS.keys()}
         
         if not self.data_directory.exists():
-            return files_by_type
-        
-        for root, _, files in os.walk(self.data_directory):
-            for file in files:
-                file_path = Path(root) / file
-                file_type = self._get_file_type(file_path)
-                if file_type:
-                    files_by_type[file_type].append(file_path)
+            return entries_by_type
         
-        return files_by_type
+        for file_type, entry in self.walker.walk(start):
+            entries_by_type[file_type].append(entry)
+        # Directories are listed concurrently; keep the result independent of that
+        for entries in entries_by_type.values():
+            entries.sort(key=lambda entry: entry.path)
+        return entries_by_type
     
-    def _get_file_type(self, file_path: Path) -> Optional[str]:
-        """Determine file type from extension"""
-        file_str = str(file_path).lower()
+    def scan_directory(self) -> Dict[str, List[Path]]:
+        """Scan directory for supported geospatial files"""
+        return {
+            file_type: [entry.path for entry in entries]
+            for file_type, entries in self.scan_entries().items()
+        }
+    
+    def includes(self, file_path: Path) -> bool:
+        """Whether a scan would list this path: a supported file not excluded by ignore rules"""
+        return self.walker.includes(file_path)
+    
+    def get_file_type(self, file_path) -> Optional[str]:
+        """Determine file type from extension (of a path or a file name)"""
+        name = os.path.basename(file_path).lower()
         
         # Check for COPC first (more specific)
-        if file_str.endswith('.copc.laz'):
+        if name.endswith('.copc.laz'):
             return 'copc'
         
-        for file_type, extensions in self.SUPPORTED_EXTENSIONS.items():
-            for ext in extensions:
-                if file_str.endswith(ext):
-                    return file_type
-        
-        return None
+        return self.EXTENSION_TYPES.get(os.path.splitext(name)[1])
     
     def extract_cog_metadata(self, file_path: Path) -> Optional[Dict]:
         """Extract metadata from Cloud Optimized GeoTIFF"""
@@ -266,78 +268,77 @@ class FileScanner:
             return None
     
     def extract_geoparquet_metadata(self, file_path: Path) -> Optional[Dict]:
-        """Extract metadata from GeoParquet file"""
+        """
+        Extract metadata from the GeoParquet footer and `geo` metadata.
+        
+        Bounds, CRS, geometry types, schema and row count come from the
+        footer; only the footprint reads data, the geometry column of a few
+        row groups, so memory use does not grow with the file.
+        """
         try:
-            # Read with geopandas to get geometry info
-            gdf = gpd.read_parquet(file_path)
-            
-            if gdf.empty:
+            dataset = GeoParquetDataset(file_path, file_identity(os.stat(file_path)))
+            parquet_metadata = dataset.parquet.metadata
+            if parquet_metadata.num_rows == 0:
                 return None
             
-            bounds = gdf.total_bounds
+            bounds = dataset.bounds()
+            if bounds is None:
+                return None
             bbox = [float(bounds[0]), float(bounds[1]), float(bounds[2]), float(bounds[3])]
             
-            # Create convex hull for better visual representation
+            # Convex hull of sampled geometries for better visual representation
+            geometries = np.array([], dtype=object)
             try:
-                # Sample geometries for convex hull (to avoid performance issues)
-                sample_size = min(1000, len(gdf))
-                if len(gdf) > sample_size:
-                    sampled = gdf.sample(n=sample_size)
+                geometries = dataset.sample_geometries()
+                footprint = list(geometries)
+                # Row groups that were not sampled still bound the hull through their covering bbox
+                footprint.extend(box(*rg_bbox) for rg_bbox in dataset.row_group_bboxes if rg_bbox is not None)
+                if footprint:
+                    convex_hull = shapely.convex_hull(shapely.geometrycollections(footprint))
+                    simplified = convex_hull.simplify(tolerance=0.01, preserve_topology=True)
+                    geometry = mapping(simplified)
                 else:
-                    sampled = gdf
-                
-                from shapely.ops import unary_union
-                combined = unary_union(sampled.geometry)
-                convex_hull = combined.convex_hull
-                simplified = convex_hull.simplify(tolerance=0.01, preserve_topology=True)
-                geometry = mapping(simplified)
+                    geometry = mapping(box(*bbox))
             except Exception as e:
                 logger.warning(f"Could not create convex hull for {file_path}, using bbox: {e}")
                 geometry = mapping(box(*bbox))
             
-            # Get CRS from GeoParquet - try to parse PROJ JSON from metadata
-            crs_info = None
-            if gdf.crs:
-                # gdf.crs is a pyproj.CRS object
-                try:
-                    # Try to get PROJ JSON dict from pyproj CRS
-                    crs_dict = gdf.crs.to_json_dict() if hasattr(gdf.crs, 'to_json_dict') else None
-                    if crs_dict:
-                        crs_info = self._format_crs_info(crs_dict)
-                    else:
-                        # Fallback to string representation
-                        crs_info = self._format_crs_info(gdf.crs)
-                except Exception as e:
-                    logger.warning(f"Could not parse CRS for {file_path}, using string: {e}")
-                    crs_info = self._format_crs_info(str(gdf.crs))
+            # A missing crs means OGC:CRS84; an explicit null an unknown CRS
+            column_meta = dataset.geo.get('columns', {}).get(dataset.geometry_column, {})
+            crs = column_meta.get('crs', OGC_CRS84)
+            crs_info = self._format_crs_info(crs) if crs else None
             
-            # Get column info with types (exclude geometry column)
+            # Get column info with types (exclude geometry column), named like pandas dtypes
             columns_info = []
-            geom_col_name = gdf.geometry.name
-            for col in gdf.columns:
-                if col != geom_col_name:
-                    columns_info.append({
-                        'name': col,
-                        'type': str(gdf[col].dtype)
-                    })
-            
-            # Get geometry type
-            geom_type = 'Unknown'
-            if not gdf.empty:
+            for field in dataset.parquet.schema_arrow:
+                if field.name == dataset.geometry_column:
+                    continue
                 try:
-                    geom_type = gdf.geometry.geom_type.mode()[0]
-                except:
-                    geom_type = str(gdf.geometry.iloc[0].geom_type) if len(gdf) > 0 else 'Unknown'
+                    column_type = str(np.dtype(field.type.to_pandas_dtype()))
+                except (NotImplementedError, TypeError):
+                    column_type = str(field.type)
+                columns_info.append({'name': field.name, 'type': column_type})
+            
+            # Declared geometry types; an empty list means they are not known
+            geometry_types = column_meta.get('geometry_types') or []
+            if geometry_types:
+                geom_type = geometry_types[0].replace(' Z', '')
+            elif len(geometries):
+                # Most common type among the sampled geometries
+                geom_type = Counter(g.geom_type for g in geometries).most_common(1)[0][0]
+            else:
+                geom_type = 'Unknown'
             
             metadata = {
                 'bbox': bbox,
                 'geometry': geometry,
                 'properties': {
                     'datetime': datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat() + 'Z',
-                    'feature_count': len(gdf),
+                    'feature_count': parquet_metadata.num_rows,
                     'crs': crs_info,
                     'columns': columns_info,
-                    'geometry_type': geom_type
+                    'geometry_type': geom_type,
+                    'geometry_types': geometry_types
                 },
                 'assets': {
                     'data': {
@@ -356,39 +357,84 @@ class FileScanner:
             return None
     
     def extract_flatgeobuf_metadata(self, file_path: Path) -> Optional[Dict]:
-        """Extract metadata from FlatGeobuf file"""
+        """
+        Extract metadata from the FlatGeobuf header and R-tree index.
+        
+        Bounds, feature count, CRS and schema come from the header and the
+        footprint from the node boxes of an upper index level, so a few KB
+        are read however large the file is. Only files whose header lacks
+        the envelope or feature count are read in full.
+        """
         try:
-            with fiona.open(file_path) as src:
-                bounds = src.bounds
-                bbox = [bounds[0], bounds[1], bounds[2], bounds[3]]
-                
-                # Create convex hull for better visual representation of data extent
-                geometry = self._get_data_outline(src, bbox)
-                
-                # Format CRS information better
-                crs_info = self._format_crs_info(src.crs) if src.crs else None
-                
-                metadata = {
-                    'bbox': bbox,
-                    'geometry': geometry,
-                    'properties': {
-                        'datetime': datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat() + 'Z',
-                        'feature_count': len(src),
-                        'crs': crs_info,
-                        'schema': dict(src.schema),
-                    },
-                    'assets': {
-                        'data': {
-                            'href': self._get_file_url(file_path),
-                            'type': 'application/flatgeobuf',
-                            'roles': ['data', 'visual'],
-                            'title': file_path.name,
-                            'file:size': os.path.getsize(file_path)
-                        }
+            identity = file_identity(os.stat(file_path))
+            fgb = FlatGeobufFile(file_path, identity,
+                                 SizedLRUCache(FOOTPRINT_MAX_NODES * NODE_ITEM_BYTES, sizeof=lambda nodes: nodes.nbytes))
+            header = fgb.header
+            
+            feature_count = header.features_count
+            envelope = header.envelope if header.envelope and len(header.envelope) in (4, 6) else None
+            if envelope is None or not (feature_count or header.has_index):
+                # Written as a stream: the header does not know its features
+                feature_count, envelope = fgb.scan_extent()
+            if envelope is None:
+                return None
+            half = len(envelope) // 2
+            bbox = [float(envelope[0]), float(envelope[1]), float(envelope[half]), float(envelope[half + 1])]
+            
+            # Convex hull of upper R-tree level boxes for better visual representation of data extent
+            geometry = mapping(box(*bbox))
+            if header.has_index:
+                try:
+                    with open(file_path, 'rb') as f:
+                        nodes = fgb.level_nodes(f, FOOTPRINT_MAX_NODES)
+                    if len(nodes):
+                        boxes = shapely.box(nodes['min_x'], nodes['min_y'], nodes['max_x'], nodes['max_y'])
+                        convex_hull = shapely.convex_hull(shapely.geometrycollections(boxes))
+                        geometry = mapping(convex_hull.simplify(tolerance=0.01, preserve_topology=True))
+                except Exception as e:
+                    logger.warning(f"Could not create convex hull for {file_path}, using bbox: {e}")
+            
+            # Format CRS information better
+            crs_info = None
+            crs = header.crs
+            if crs:
+                if crs['org'] and crs['code']:
+                    crs_info = self._format_crs_info(f"{crs['org']}:{crs['code']}")
+                elif crs['code_string'] or crs['wkt'] or crs['name']:
+                    crs_info = self._format_crs_info(crs['code_string'] or crs['wkt'] or crs['name'])
+            
+            # Schema as fiona reports it
+            geometry_type = GEOMETRY_TYPES.get(header.geometry_type, 'Unknown')
+            if header.has_z and geometry_type != 'Unknown':
+                geometry_type = f"3D {geometry_type}"
+            schema = {
+                'properties': {
+                    column['name']: FLATGEOBUF_COLUMN_TYPES.get(column['type'], 'str') for column in header.columns
+                },
+                'geometry': geometry_type
+            }
+            
+            metadata = {
+                'bbox': bbox,
+                'geometry': geometry,
+                'properties': {
+                    'datetime': datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat() + 'Z',
+                    'feature_count': feature_count,
+                    'crs': crs_info,
+                    'schema': schema,
+                },
+                'assets': {
+                    'data': {
+                        'href': self._get_file_url(file_path),
+                        'type': 'application/flatgeobuf',
+                        'roles': ['data', 'visual'],
+                        'title': file_path.name,
+                        'file:size': os.path.getsize(file_path)
                     }
                 }
-                
-                return metadata
+            }
+            
+            return metadata
         except Exception as e:
             logger.error(f"Error extracting FlatGeobuf metadata from {file_path}: {e}")
             return None
@@ -407,17 +453,18 @@ class FileScanner:
                     return None
                 
                 # Parse header manually (simplified - just get bounds and zoom)
-                # PMTiles v3 header format
-                version = struct.unpack('<H', header_bytes[0:2])[0]
+                # PMTiles v3 header format: 7 byte magic "PMTiles" followed by the version byte
+                if header_bytes[0:7] != b'PMTiles':
+                    logger.warning(f"Not a PMTiles file: {file_path}")
+                    return None
+                version = header_bytes[7]
                 if version != 3:
                     logger.warning(f"Unsupported PMTiles version {version}: {file_path}")
                     return None
                 
+                # Field offsets from the PMTiles v3 spec
                 # Extract bounds (E7 format - degrees * 10^7)
-                min_lon_e7 = struct.unpack('<i', header_bytes[84:88])[0]
-                min_lat_e7 = struct.unpack('<i', header_bytes[88:92])[0]
-                max_lon_e7 = struct.unpack('<i', header_bytes[92:96])[0]
-                max_lat_e7 = struct.unpack('<i', header_bytes[96:100])[0]
+                min_lon_e7, min_lat_e7, max_lon_e7, max_lat_e7 = struct.unpack('<iiii', header_bytes[102:118])
                 
                 # Convert E7 to decimal degrees
                 min_lon = min_lon_e7 / 10000000.0
@@ -426,17 +473,17 @@ class FileScanner:
                 max_lat = max_lat_e7 / 10000000.0
                 
                 # Extract zoom levels
-                min_zoom = header_bytes[18]
-                max_zoom = header_bytes[19]
-                center_zoom = header_bytes[20]
+                min_zoom = header_bytes[100]
+                max_zoom = header_bytes[101]
+                center_zoom = header_bytes[118]
                 
                 # Extract tile type
-                tile_type_byte = header_bytes[21]
-                type_map = {0: 'unknown', 1: 'mvt', 2: 'png', 3: 'jpeg', 4: 'webp'}
+                tile_type_byte = header_bytes[99]
+                type_map = {0: 'unknown', 1: 'mvt', 2: 'png', 3: 'jpeg', 4: 'webp', 5: 'avif'}
                 tile_type = type_map.get(tile_type_byte, 'unknown')
                 
                 # Extract compression type
-                tile_compression_byte = header_bytes[23]
+                tile_compression_byte = header_bytes[98]
             
             # Create bbox and geometry
             bbox = [float(min_lon), float(min_lat), float(max_lon), float(max_lat)]
@@ -451,7 +498,7 @@ class FileScanner:
                     'min_zoom': int(min_zoom),
                     'max_zoom': int(max_zoom),
                     'center_zoom': int(center_zoom),
-                    'tile_compression': int(tile_compression_byte),  # 0=unknown, 1=none, 2=gzip
+                    'tile_compression': int(tile_compression_byte),  # 0=unknown, 1=none, 2=gzip, 3=brotli, 4=zstd
                 },
                 'assets': {
                     'data': {
@@ -512,18 +559,27 @@ class FileScanner:
     
     def extract_metadata(self, file_path: Path) -> Optional[Dict]:
         """Extract metadata from a file based on its type"""
-        file_type = self._get_file_type(file_path)
+        file_type = self.get_file_type(file_path)
         
+        metadata = None
         if file_type == 'cog':
-            return self.extract_cog_metadata(file_path)
+            metadata = self.extract_cog_metadata(file_path)
         elif file_type == 'geoparquet':
-            return self.extract_geoparquet_metadata(file_path)
+            metadata = self.extract_geoparquet_metadata(file_path)
         elif file_type == 'flatgeobuf':
-            return self.extract_flatgeobuf_metadata(file_path)
+            metadata = self.extract_flatgeobuf_metadata(file_path)
         elif file_type == 'pmtiles':
-            return self.extract_pmtiles_metadata(file_path)
+            metadata = self.extract_pmtiles_metadata(file_path)
         elif file_type == 'copc':
-            return self.extract_copc_metadata(file_path)
+            metadata = self.extract_copc_metadata(file_path)
         
-        return None
+        if metadata:
+            self.prefetch_ranges(file_path)
+        
+        return metadata
+    
+    def prefetch_ranges(self, file_path: Path):
+        """Warm the hot-range cache with the blocks every client reads first"""
+        if self.range_cache is not None:
+            self.range_cache.prefetch(file_path, self.get_file_type(file_path))
 
@@ -0,0 +1,237 @@
+"""Concurrent directory walker with .stacignore rules"""
+import fnmatch
+import logging
+import os
+import stat
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Per-directory exclude globs, applying to that directory and everything below it
+IGNORE_FILE = '.stacignore'
+# OS, NAS and archive metadata directories that never hold data
+SKIP_DIRECTORIES = frozenset({
+    '__macosx', '@eadir', '#recycle', '#snapshot', '$recycle.bin', 'system volume information', 'lost+found'
+})
+# Directories of files still being written, copied or unpacked
+TEMP_DIRECTORIES = frozenset({'tmp', 'temp'})
+TEMP_SUFFIXES = ('.tmp', '.temp', '.part', '.partial', '~')
+
+
+class WalkEntry(NamedTuple):
+    path: Path
+    stat: os.stat_result
+
+
+class IgnoreRule(NamedTuple):
+    # Directory of the ignore file relative to the root ('' for the root and global rules)
+    base: str
+    pattern: str
+    directory_only: bool
+    # Matched against the path below `base` instead of the entry name
+    anchored: bool
+
+
+def parse_ignore_rules(lines: Sequence[str], base: str = '') -> List[IgnoreRule]:
+    """
+    Parse gitignore-style exclude globs.
+
+    Blank lines and lines starting with '#' are skipped. A pattern ending in
+    '/' only matches directories. A pattern containing '/' is matched against
+    the path relative to the ignore file's directory, any other pattern
+    against the name of every file and directory below it. Negation ('!')
+    is not supported.
+    """
+    rules = []
+    for line in lines:
+        pattern = line.strip()
+        if not pattern or pattern.startswith('#'):
+            continue
+        if pattern.startswith('!'):
+            logger.warning(f"Ignoring unsupported negated pattern '{pattern}' in {base or '.'}/{IGNORE_FILE}")
+            continue
+        directory_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        if pattern.startswith('**/'):
+            pattern = pattern[3:]
+        anchored = '/' in pattern
+        if pattern:
+            rules.append(IgnoreRule(base, pattern.lstrip('/'), directory_only, anchored))
+    return rules
+
+
+def _ignored(rules: Sequence[IgnoreRule], relative_path: str, name: str, is_dir: bool) -> bool:
+    for rule in rules:
+        if rule.directory_only and not is_dir:
+            continue
+        if not rule.anchored:
+            if fnmatch.fnmatchcase(name, rule.pattern):
+                return True
+            continue
+        target = relative_path
+        if rule.base:
+            if not relative_path.startswith(rule.base + '/'):
+                continue
+            target = relative_path[len(rule.base) + 1:]
+        if fnmatch.fnmatchcase(target, rule.pattern):
+            return True
+    return False
+
+
+def _skip_directory(name: str, has_archive: bool) -> bool:
+    """Metadata, temporary and extracted-archive directories (`x/` next to `x.zip`)"""
+    lower = name.lower()
+    return lower in SKIP_DIRECTORIES or lower in TEMP_DIRECTORIES or lower.endswith(TEMP_SUFFIXES) or has_archive
+
+
+class DirectoryWalker:
+    """
+    Lists the files of a directory tree with os.scandir, several directories
+    at a time.
+
+    Only files whose name `classify` maps to a type are stat'ed, and their
+    stat results are returned so callers need no second system call. Hidden
+    entries (names starting with '.', e.g. AppleDouble sidecars and partial
+    rsync copies), metadata/temporary/extracted-archive directories and
+    entries matched by `exclude` or a .stacignore file are skipped, as are
+    directories deeper than `max_depth` (0 = only files in the root).
+    Symbolic links to directories are not followed.
+
+    Enumeration on network mounts is dominated by per-directory round
+    trips, which `workers` threads overlap.
+    """
+
+    def __init__(self, root: Path, classify: Callable[[str], Optional[str]], exclude: Sequence[str] = (),
+                 max_depth: Optional[int] = None, workers: int = 8):
+        self.root = Path(root)
+        self.classify = classify
+        self.rules = parse_ignore_rules(exclude)
+        self.max_depth = max_depth
+        self.workers = workers
+
+    def walk(self, start: Optional[Path] = None) -> List[Tuple[str, WalkEntry]]:
+        """(type, entry) of every included file below `start` (default the root), in no particular order"""
+        start = self.root if start is None else Path(start)
+        parts = self._relative_parts(start)
+        if parts is None or not start.is_dir():
+            return []
+        if parts and not self._includes_parts(parts, is_dir=True):
+            return []
+        first = (str(start), '/'.join(parts), len(parts), self._inherited_rules(parts))
+
+        files: List[Tuple[str, WalkEntry]] = []
+        if self.workers <= 1:
+            pending = [first]
+            while pending:
+                directory_files, subdirectories = self._scan(*pending.pop())
+                files.extend(directory_files)
+                pending.extend(subdirectories)
+            return files
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="walk") as pool:
+            futures = {pool.submit(self._scan, *first)}
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory_files, subdirectories = future.result()
+                    files.extend(directory_files)
+                    futures.update(pool.submit(self._scan, *subdirectory) for subdirectory in subdirectories)
+        return files
+
+    def _scan(self, path: str, relative: str, depth: int, rules: List[IgnoreRule]):
+        """Included files and subdirectories to walk of one directory"""
+        try:
+            with os.scandir(path) as iterator:
+                entries = list(iterator)
+        except OSError as e:
+            logger.warning(f"Cannot list {path}: {e}")
+            return [], []
+        names = {entry.name.lower() for entry in entries}
+        if IGNORE_FILE in names:
+            rules = rules + self._read_ignore_file(os.path.join(path, IGNORE_FILE), relative)
+
+        files, subdirectories = [], []
+        for entry in entries:
+            name = entry.name
+            if name.startswith('.'):
+                continue
+            child = f"{relative}/{name}" if relative else name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                if (self.max_depth is not None and depth >= self.max_depth) \
+                        or _skip_directory(name, name.lower() + '.zip' in names) \
+                        or _ignored(rules, child, name, True):
+                    continue
+                subdirectories.append((entry.path, child, depth + 1, rules))
+                continue
+            file_type = self.classify(name)
+            if file_type is None or _ignored(rules, child, name, False):
+                continue
+            try:
+                # Cached from the directory listing on Windows, which lacks the inode there
+                st = entry.stat() if os.name != 'nt' else os.stat(entry.path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                files.append((file_type, WalkEntry(Path(entry.path), st)))
+        return files, subdirectories
+
+    def includes(self, path: Path) -> bool:
+        """Whether a walk of the root would list `path` (a file or directory, which may no longer exist)"""
+        parts = self._relative_parts(Path(path))
+        if not parts:
+            return False
+        is_dir = os.path.isdir(path)
+        if not is_dir and self.classify(parts[-1]) is None:
+            return False
+        return self._includes_parts(parts, is_dir)
+
+    def _includes_parts(self, parts: List[str], is_dir: bool) -> bool:
+        if self.max_depth is not None and len(parts) - (0 if is_dir else 1) > self.max_depth:
+            return False
+        rules = list(self.rules)
+        directory = str(self.root)
+        for index, name in enumerate(parts):
+            relative = '/'.join(parts[:index])
+            rules += self._read_ignore_file(os.path.join(directory, IGNORE_FILE), relative)
+            entry_is_dir = is_dir or index < len(parts) - 1
+            if name.startswith('.') or _ignored(rules, '/'.join(parts[:index + 1]), name, entry_is_dir):
+                return False
+            if entry_is_dir and _skip_directory(name, os.path.exists(os.path.join(directory, name + '.zip'))):
+                return False
+            directory = os.path.join(directory, name)
+        return True
+
+    def _inherited_rules(self, parts: List[str]) -> List[IgnoreRule]:
+        """Global rules and those of the ignore files above the directory `parts`"""
+        rules = list(self.rules)
+        directory = str(self.root)
+        for index, name in enumerate(parts):
+            rules += self._read_ignore_file(os.path.join(directory, IGNORE_FILE), '/'.join(parts[:index]))
+            directory = os.path.join(directory, name)
+        return rules
+
+    def _relative_parts(self, path: Path) -> Optional[List[str]]:
+        """Path components below the root, None outside of it"""
+        relative = os.path.relpath(path, self.root)
+        if relative == os.curdir:
+            return []
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            return None
+        return relative.split(os.sep)
+
+    @staticmethod
+    def _read_ignore_file(path: str, base: str) -> List[IgnoreRule]:
+        try:
+            with open(path, encoding='utf-8') as f:
+                return parse_ignore_rules(f.read().splitlines(), base)
+        except FileNotFoundError:
+            return []
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning(f"Cannot read {path}: {e}")
+            return []
@@ -0,0 +1,220 @@
+"""Watch the data directory and apply file changes to the live catalog"""
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# watchfiles is optional - without it the watcher falls back to polling
+try:
+    import watchfiles
+    HAS_WATCHFILES = True
+except ImportError:
+    HAS_WATCHFILES = False
+    logger.warning("watchfiles not installed. The catalog watcher can only poll.")
+
+WATCH_MODES = ('off', 'auto', 'events', 'poll')
+
+# size, mtime_ns and inode of a file; None once it is gone
+FileSignature = Optional[Tuple[int, int, int]]
+
+
+def _signature(path: Path) -> FileSignature:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class CatalogWatcher:
+    """
+    Background thread that reports settled file changes under a directory.
+
+    Changes come from filesystem events (inotify through watchfiles) or,
+    for network mounts where events are not delivered, from comparing stat
+    snapshots every `poll_interval` seconds. A changed file is reported
+    once its size, mtime and inode stayed the same for `settle_seconds`, so
+    files still being written are not extracted half-way; write bursts to
+    the same file collapse into one report. Deleted files are reported
+    after the same delay. When `on_change` raises, the paths are reported
+    again after another settle delay, up to `max_retries` times.
+
+    `on_change` receives the settled paths, in the form the catalog scan
+    uses (below `root` as given), and runs on the watcher thread. Polling
+    lists files with `list_files` (path and stat result of every relevant
+    file), by default os.walk filtered by `is_relevant`.
+    """
+
+    def __init__(self, root: Path, on_change: Callable[[List[Path]], None],
+                 is_relevant: Callable[[Path], bool], mode: str = 'auto',
+                 settle_seconds: float = 2.0, poll_interval: float = 5.0,
+                 list_files: Optional[Callable[[], Iterable[Tuple[Path, os.stat_result]]]] = None,
+                 max_retries: int = 3):
+        if mode not in WATCH_MODES or mode == 'off':
+            raise ValueError(f"Invalid watch mode '{mode}'")
+        if mode == 'events' and not HAS_WATCHFILES:
+            logger.warning("watchfiles not installed, polling the data directory instead")
+        self.root = Path(root)
+        self.on_change = on_change
+        self.is_relevant = is_relevant
+        self.mode = 'events' if mode in ('auto', 'events') and HAS_WATCHFILES else 'poll'
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.list_files = list_files or self._walk_files
+        self.max_retries = max_retries
+        self._tick = max(0.05, min(0.5, settle_seconds / 4))
+        self._roots = {os.path.abspath(self.root), os.path.realpath(self.root)}
+
+        # Path -> last seen signature and when it last changed
+        self._pending: Dict[str, Tuple[FileSignature, float]] = {}
+        # Path -> failed reports since it last changed
+        self._failures: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        self.files = 0
+        self.errors = 0
+        self.dropped = 0
+        self.last_change: Optional[float] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="catalog-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Watching {self.root} for changes ({self.mode})")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        try:
+            if self.mode == 'events':
+                self._run_events()
+            else:
+                self._run_polling()
+        except Exception as e:
+            logger.error(f"Catalog watcher stopped: {e}")
+
+    def _run_events(self):
+        for changes in watchfiles.watch(self.root, watch_filter=None, stop_event=self._stop,
+                                        debounce=int(self._tick * 1000), rust_timeout=int(self._tick * 1000),
+                                        yield_on_timeout=True, raise_interrupt=False):
+            for _, path in changes:
+                self._mark(self._catalog_path(path))
+            self._flush()
+
+    def _run_polling(self):
+        snapshot = self._snapshot()
+        next_poll = time.monotonic() + self.poll_interval
+        while not self._stop.wait(self._tick):
+            if time.monotonic() >= next_poll:
+                current = self._snapshot()
+                for path in current.keys() | snapshot.keys():
+                    if current.get(path) != snapshot.get(path):
+                        self._mark(Path(path))
+                snapshot = current
+                next_poll = time.monotonic() + self.poll_interval
+            self._flush()
+
+    def _snapshot(self) -> Dict[str, FileSignature]:
+        return {str(path): (st.st_size, st.st_mtime_ns, st.st_ino) for path, st in self.list_files()}
+
+    def _walk_files(self) -> Iterable[Tuple[Path, os.stat_result]]:
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                path = Path(root) / name
+                if self.is_relevant(path):
+                    try:
+                        yield path, os.stat(path)
+                    except OSError:
+                        continue
+
+    def _catalog_path(self, path: str) -> Path:
+        """Map a reported absolute path onto `root` as the catalog scan sees it"""
+        for root in self._roots:
+            relative = os.path.relpath(path, root)
+            if not relative.startswith(os.pardir):
+                return self.root / relative
+        return Path(path)
+
+    def _mark(self, path: Path):
+        """Start (or restart) the settle delay of a changed path"""
+        if path.is_dir():
+            # A directory moved in as a whole only reports itself
+            for root, _, names in os.walk(path):
+                for name in names:
+                    if self.is_relevant(Path(root) / name):
+                        self._mark(Path(root) / name)
+            return
+        if not self.is_relevant(path) and path.exists():
+            return
+        # Paths that are gone may be removed directories; the catalog resolves them
+        self._pending[str(path)] = (_signature(path), time.monotonic())
+        self._failures.pop(str(path), None)
+        self.last_change = time.time()
+
+    def _flush(self):
+        """Report pending paths whose signature stayed the same for the settle delay"""
+        if not self._pending:
+            return
+        now = time.monotonic()
+        ready = []
+        for key, (signature, since) in list(self._pending.items()):
+            current = _signature(Path(key))
+            if current != signature:
+                self._pending[key] = (current, now)
+            elif now - since >= self.settle_seconds:
+                ready.append(Path(key))
+                del self._pending[key]
+        if not ready:
+            return
+        try:
+            self.on_change(ready)
+        except Exception as e:
+            self.errors += 1
+            self._requeue(ready, e)
+            return
+        self.batches += 1
+        self.files += len(ready)
+        for path in ready:
+            self._failures.pop(str(path), None)
+
+    def _requeue(self, paths: List[Path], error: Exception):
+        """Report paths of a failed batch again after the settle delay, until they run out of retries"""
+        now = time.monotonic()
+        dropped = 0
+        for path in paths:
+            key = str(path)
+            failures = self._failures.get(key, 0) + 1
+            if failures > self.max_retries:
+                self._failures.pop(key, None)
+                dropped += 1
+            elif key not in self._pending:
+                self._failures[key] = failures
+                self._pending[key] = (_signature(path), now)
+        self.dropped += dropped
+        if dropped:
+            logger.error(f"Could not apply changes to {len(paths)} files, giving up on {dropped} "
+                         f"after {self.max_retries} retries: {error}")
+        else:
+            logger.warning(f"Could not apply changes to {len(paths)} files, retrying: {error}")
+
+    def stats(self) -> Dict:
+        return {
+            'mode': self.mode,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'pending': len(self._pending),
+            'batches': self.batches,
+            'files': self.files,
+            'errors': self.errors,
+            'dropped': self.dropped,
+            'last_change': self.last_change,
+        }
@@ -0,0 +1,112 @@
+"""Validators and conditional request handling (RFC 7232)"""
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Mapping, Optional
+
+
+def make_etag(*parts, weak: bool = False) -> str:
+    """Build a quoted ETag from a hash of the given parts"""
+    digest = hashlib.blake2b(
+        "|".join(str(p) for p in parts).encode('utf-8'), digest_size=12
+    ).hexdigest()
+    return f'W/"{digest}"' if weak else f'"{digest}"'
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """Strong ETag for a file version: hash of size, mtime and inode"""
+    return make_etag(stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+
+def http_date(timestamp: float) -> str:
+    """Format a POSIX timestamp as an HTTP date (IMF-fixdate)"""
+    return formatdate(int(timestamp), usegmt=True)
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[int]:
+    """Parse an HTTP date header into whole seconds since the epoch"""
+    if not value:
+        return None
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _parse_etags(value: str) -> List[str]:
+    """Split an If-Match / If-None-Match header into its entity tags"""
+    return [tag.strip() for tag in value.split(',') if tag.strip()]
+
+
+def _opaque(etag: str) -> str:
+    """Strip the weakness indicator for weak comparison"""
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def _weak_match(etag: str, candidates: List[str]) -> bool:
+    return '*' in candidates or any(_opaque(etag) == _opaque(c) for c in candidates)
+
+
+def _strong_match(etag: str, candidates: List[str]) -> bool:
+    if etag.startswith('W/'):
+        return False
+    return '*' in candidates or any(etag == c for c in candidates)
+
+
+def evaluate_preconditions(method: str, headers: Mapping[str, str], etag: str,
+                           last_modified: Optional[float] = None) -> Optional[int]:
+    """
+    Evaluate conditional request headers against the current validators.
+
+    Follows the precedence in RFC 7232 section 6.
+
+    Args:
+        method: HTTP method of the request
+        headers: Request headers
+        etag: Current entity tag of the representation
+        last_modified: Modification time of the representation (POSIX timestamp)
+
+    Returns:
+        304 or 412 if the request should be answered without a body,
+        None if it should be processed normally
+    """
+    last_modified_s = int(last_modified) if last_modified is not None else None
+    safe = method in ('GET', 'HEAD')
+
+    if_match = headers.get('if-match')
+    if if_match is not None:
+        if not _strong_match(etag, _parse_etags(if_match)):
+            return 412
+    elif last_modified_s is not None:
+        since = _parse_http_date(headers.get('if-unmodified-since'))
+        if since is not None and last_modified_s > since:
+            return 412
+
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        if _weak_match(etag, _parse_etags(if_none_match)):
+            return 304 if safe else 412
+    elif safe and last_modified_s is not None:
+        since = _parse_http_date(headers.get('if-modified-since'))
+        if since is not None and last_modified_s <= since:
+            return 304
+
+    return None
+
+
+def if_range_matches(headers: Mapping[str, str], etag: str,
+                     last_modified: Optional[float] = None) -> bool:
+    """
+    Check whether a Range request may be served as a partial response.
+
+    Without If-Range the Range header always applies. An entity tag in If-Range
+    must match strongly; a date must equal the current Last-Modified exactly.
+    """
+    if_range = headers.get('if-range')
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return _strong_match(etag, [if_range])
+    since = _parse_http_date(if_range)
+    return since is not None and last_modified is not None and int(last_modified) == since
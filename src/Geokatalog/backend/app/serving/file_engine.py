@@ -0,0 +1,272 @@
+"""Zero-copy file serving engine for byte ranges of data files"""
+import mmap
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import anyio
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.cache.range_cache import FileIdentity, RangeCache, file_identity
+
+logger = logging.getLogger(__name__)
+
+# ASGI extension that lets the server hand a file descriptor to os.sendfile
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+# Largest mmap slice copied on the event loop; larger ones are copied in a worker
+# thread, where a cold page or a stalled network read only delays this response
+INLINE_COPY_BYTES = 4096
+
+
+class FileServingEngine:
+    """
+    Serve file byte ranges without pushing every byte through a Python generator.
+
+    Ranges covered by the optional RangeCache are answered from memory first.
+
+    Modes:
+        sendfile: hand ranges to the kernel with os.sendfile when the ASGI server
+                  supports the zerocopysend extension (falls back to read otherwise)
+        mmap:     slice ranges out of a shared, read-only memory map per file
+        read:     os.pread() in chunks of `chunk_size` in a worker thread
+        auto:     sendfile if available, otherwise read
+
+    mmap is opt-in: a file truncated while it is mapped raises SIGBUS on
+    access, so it only suits data directories whose files are replaced by
+    rename rather than rewritten in place.
+    """
+
+    MODES = ('auto', 'sendfile', 'mmap', 'read')
+
+    def __init__(self, mode: str = 'auto', chunk_size: int = 1024 * 1024,
+                 readahead: bool = True, max_open_maps: int = 128,
+                 range_cache: Optional[RangeCache] = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown file serving mode '{mode}', expected one of {self.MODES}")
+        self.mode = mode
+        self.chunk_size = max(4096, chunk_size)
+        self.readahead = readahead
+        self.max_open_maps = max_open_maps
+        self.range_cache = range_cache
+        self._maps: "OrderedDict[FileIdentity, mmap.mmap]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_map(self, path: Path, identity: FileIdentity) -> Optional[mmap.mmap]:
+        """
+        Get (or open) the shared memory map for a file version.
+
+        Returns:
+            None if the file on disk is no longer that version
+        """
+        with self._lock:
+            mapped = self._maps.get(identity)
+            if mapped is not None:
+                self._maps.move_to_end(identity)
+                return mapped
+
+        try:
+            with open(path, 'rb') as f:
+                # The file may have changed since the request stat'ed it; a map of
+                # another version would be cached under this identity
+                if file_identity(os.fstat(f.fileno())) != identity:
+                    return None
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        with self._lock:
+            existing = self._maps.get(identity)
+            if existing is not None:
+                return existing
+            self._maps[identity] = mapped
+            # Evicted maps are not closed explicitly: requests that still hold a
+            # reference keep slicing them, and the map is released by the GC.
+            while len(self._maps) > self.max_open_maps:
+                self._maps.popitem(last=False)
+        return mapped
+
+    def _advise(self, mapped: mmap.mmap, start: int, length: int):
+        """Ask the kernel to read ahead the pages of a range we are about to send"""
+        if not self.readahead or not hasattr(mapped, 'madvise'):
+            return
+        page = mmap.ALLOCATIONGRANULARITY
+        aligned = start - (start % page)
+        try:
+            mapped.madvise(mmap.MADV_WILLNEED, aligned, length + (start - aligned))
+        except (OSError, ValueError):
+            pass
+
+    def _fadvise(self, fd: int, start: int, length: int):
+        """posix_fadvise readahead hint for pread/sendfile modes"""
+        if not self.readahead or not hasattr(os, 'posix_fadvise'):
+            return
+        try:
+            os.posix_fadvise(fd, start, length, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+
+    def resolve_mode(self, scope: Scope) -> str:
+        """Pick the concrete serving mode for a request"""
+        has_zerocopy = ZEROCOPY_EXTENSION in (scope.get("extensions") or {})
+        if self.mode in ('auto', 'sendfile'):
+            return 'sendfile' if has_zerocopy else 'read'
+        return self.mode
+
+    async def send_range(self, send: Send, mode: str, path: Path,
+                         identity: FileIdentity,
+                         start: int, length: int, more_body: bool):
+        """Send `length` bytes of `path` starting at `start` as response body"""
+        if length <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": more_body})
+            return
+
+        # Hot header/index blocks come straight from memory
+        if self.range_cache is not None and length <= self.range_cache.max_block_bytes:
+            cached = self.range_cache.get(identity, start, length)
+            if cached is not None:
+                await send({"type": "http.response.body", "body": cached, "more_body": more_body})
+                return
+
+        if mode == 'sendfile':
+            with open(path, 'rb') as f:
+                self._fadvise(f.fileno(), start, length)
+                await send({
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": f,
+                    "offset": start,
+                    "count": length,
+                    "more_body": more_body,
+                })
+            return
+
+        # A file that changed since it was stat'ed is read instead of mapped
+        mapped = self._get_map(path, identity) if mode == 'mmap' else None
+        if mapped is not None:
+            end = start + length
+            if length <= INLINE_COPY_BYTES:
+                # Tiny ranges (headers, index probes) are copied inline
+                await send({"type": "http.response.body", "body": mapped[start:end],
+                            "more_body": more_body})
+                return
+            self._advise(mapped, start, length)
+            offset = start
+            while offset < end:
+                chunk_end = min(offset + self.chunk_size, end)
+                # Page faults on cold data must not block the event loop
+                chunk = await anyio.to_thread.run_sync(mapped.__getitem__, slice(offset, chunk_end))
+                offset = chunk_end
+                await send({"type": "http.response.body", "body": chunk,
+                            "more_body": more_body or offset < end})
+            return
+
+        fd = await anyio.to_thread.run_sync(os.open, str(path), os.O_RDONLY)
+        try:
+            self._fadvise(fd, start, length)
+            offset = start
+            end = start + length
+            while offset < end:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(self.chunk_size, end - offset), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                await send({"type": "http.response.body", "body": chunk,
+                            "more_body": more_body or offset < end})
+            if offset < end:
+                # File shrank under us; terminate the body
+                await send({"type": "http.response.body", "body": b"", "more_body": more_body})
+        finally:
+            os.close(fd)
+
+
+class RangeFileResponse(Response):
+    """Response that streams one byte range of a file through a FileServingEngine"""
+
+    def __init__(self, engine: FileServingEngine, path: Path, stat_result: os.stat_result,
+                 start: int, length: int, status_code: int = 200,
+                 headers: Optional[Dict[str, str]] = None,
+                 media_type: Optional[str] = None,
+                 background: Optional[BackgroundTask] = None,
+                 send_header_only: bool = False):
+        self.engine = engine
+        self.path = path
+        self.identity = file_identity(stat_result)
+        self.start = start
+        self.length = length
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = background
+        self.send_header_only = send_header_only
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            mode = self.engine.resolve_mode(scope)
+            await self.engine.send_range(send, mode, self.path, self.identity,
+                                         self.start, self.length, more_body=False)
+        if self.background is not None:
+            await self.background()
+
+
+class MultipartRangeFileResponse(RangeFileResponse):
+    """multipart/byteranges response for requests with several byte ranges"""
+
+    def __init__(self, engine: FileServingEngine, path: Path, stat_result: os.stat_result,
+                 ranges: List[Tuple[int, int]], content_type: str,
+                 headers: Optional[Dict[str, str]] = None,
+                 background: Optional[BackgroundTask] = None,
+                 send_header_only: bool = False):
+        self.boundary = secrets.token_hex(16)
+        file_size = stat_result.st_size
+        self.parts: List[Tuple[bytes, int, int]] = []
+        for start, end in ranges:
+            part_header = (
+                f"--{self.boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{file_size}\r\n"
+                "\r\n"
+            ).encode('latin-1')
+            self.parts.append((part_header, start, end - start + 1))
+        self.trailer = f"\r\n--{self.boundary}--\r\n".encode('latin-1')
+
+        # Each part after the first is preceded by the CRLF that ends the previous one
+        content_length = sum(len(h) + length for h, _, length in self.parts)
+        content_length += 2 * (len(self.parts) - 1) + len(self.trailer)
+
+        headers = dict(headers or {})
+        headers['Content-Length'] = str(content_length)
+        headers['Content-Type'] = f"multipart/byteranges; boundary={self.boundary}"
+        super().__init__(engine, path, stat_result, start=0, length=0, status_code=206,
+                         headers=headers, media_type=headers['Content-Type'],
+                         background=background, send_header_only=send_header_only)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            mode = self.engine.resolve_mode(scope)
+            for index, (part_header, start, length) in enumerate(self.parts):
+                prefix = part_header if index == 0 else b"\r\n" + part_header
+                await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                await self.engine.send_range(send, mode, self.path, self.identity,
+                                             start, length, more_body=True)
+            await send({"type": "http.response.body", "body": self.trailer, "more_body": False})
+        if self.background is not None:
+            await self.background()
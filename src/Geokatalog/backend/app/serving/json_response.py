@@ -0,0 +1,147 @@
+"""Pre-serialized, compressed JSON bodies with Accept-Encoding negotiation"""
+import gzip
+import json
+import logging
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from app.cache.lru import SizedLRUCache
+
+logger = logging.getLogger(__name__)
+
+# Fast encoders and extra codecs are optional - json and gzip are always available
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+# Server preference when the client accepts several codings with equal q
+SUPPORTED_ENCODINGS = [e for e, available in (('br', HAS_BROTLI), ('zstd', HAS_ZSTD), ('gzip', True)) if available]
+
+
+def _default(value):
+    """Values neither encoder handles: numpy scalars and arrays as numbers, anything else as a string"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+def dumps(content) -> bytes:
+    """Serialize to compact UTF-8 JSON, with orjson when it is installed"""
+    if HAS_ORJSON:
+        return orjson.dumps(content, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def loads(data):
+    """Parse JSON, with orjson when it is installed (json for NaN and Infinity, which orjson rejects)"""
+    if HAS_ORJSON:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick a content coding from an Accept-Encoding header.
+
+    Returns:
+        'br', 'zstd', 'gzip' or None for identity
+    """
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            weights[name] = q
+    wildcard = weights.get('*', 0.0)
+    best, best_q = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        q = weights.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress a body with a content coding from SUPPORTED_ENCODINGS"""
+    if encoding == 'br':
+        # Quality 5 is close to gzip speed with noticeably smaller output
+        return brotli.compress(body, quality=5)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+class JSONBodyCache:
+    """
+    Memory-bounded cache of serialized JSON bodies, per content coding.
+
+    The uncompressed body is cached as well, so another coding for the same
+    resource only costs a compression, not a new serialization.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, min_compress_size: int = 1024):
+        self.min_compress_size = min_compress_size
+        self._bodies = SizedLRUCache(max_bytes, max_entry_size=max_bytes // 4)
+
+    def get_body(self, key: Hashable, encoding: Optional[str],
+                 build: Callable[[], object]) -> Tuple[bytes, Optional[str]]:
+        """
+        Get the body for `key`, building and serializing it on a miss.
+
+        Returns:
+            (body, content coding actually applied or None)
+        """
+        if encoding is not None:
+            body = self._bodies.get((key, encoding))
+            if body is not None:
+                return body, encoding
+
+        body = self._bodies.get((key, None))
+        if body is None:
+            body = dumps(build())
+            self._bodies.put((key, None), body)
+
+        if encoding is None or len(body) < self.min_compress_size:
+            return body, None
+        compressed = compress(body, encoding)
+        self._bodies.put((key, encoding), compressed)
+        return compressed, encoding
+
+    def clear(self):
+        self._bodies.clear()
+
+    def stats(self) -> Dict:
+        stats = self._bodies.stats()
+        stats['encodings'] = SUPPORTED_ENCODINGS
+        stats['orjson'] = HAS_ORJSON
+        return stats
@@ -0,0 +1,57 @@
+"""Opaque continuation tokens and streamed feature sequences"""
+import base64
+import binascii
+import json
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from app.serving.json_response import dumps
+
+# Streamed output formats: media type and the bytes written before each record.
+# GeoJSON text sequences (RFC 8142) prefix every record with an ASCII record separator.
+STREAM_FORMATS: Dict[str, Tuple[str, bytes]] = {
+    'ndjson': ('application/x-ndjson', b''),
+    'geojsonseq': ('application/geo+json-seq', b'\x1e'),
+}
+
+
+class StaleToken(Exception):
+    """The token was issued for another catalog snapshot"""
+
+
+def encode_token(snapshot: str, position: int) -> str:
+    """Encode a position in the results of one catalog snapshot as an opaque token"""
+    payload = json.dumps({'s': snapshot, 'p': position}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_token(token: str, snapshot: str) -> int:
+    """
+    Decode a token back into a result position.
+
+    Raises:
+        ValueError: malformed token
+        StaleToken: the token belongs to another catalog snapshot
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        token_snapshot, position = payload['s'], payload['p']
+    except (binascii.Error, ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Invalid pagination token: {e}")
+    if not isinstance(position, int) or position < 0:
+        raise ValueError("Invalid pagination token")
+    if token_snapshot != snapshot:
+        raise StaleToken("Pagination token refers to another catalog version; restart from the first page")
+    return position
+
+
+def page_positions(position: int, limit: int, matched: int) -> Tuple[Optional[int], Optional[int]]:
+    """Start positions of the next and previous pages, None when there is none"""
+    next_position = position + limit if position + limit < matched else None
+    prev_position = max(0, position - limit) if position > 0 else None
+    return next_position, prev_position
+
+
+def iter_json_seq(contents: Iterable, prefix: bytes = b'') -> Iterator[bytes]:
+    """Serialize objects one at a time as newline-terminated JSON records"""
+    for content in contents:
+        yield prefix + dumps(content) + b'\n'
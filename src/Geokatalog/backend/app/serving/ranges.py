@@ -0,0 +1,91 @@
+"""HTTP Range header parsing (RFC 7233) for the /data endpoint"""
+from typing import List, Optional, Tuple
+
+# Overhead of one multipart/byteranges part header; ranges closer than this are
+# cheaper to send as one part than as two.
+MULTIPART_PART_OVERHEAD = 80
+
+# More ranges than this is treated as abuse and answered with the full file
+MAX_RANGES = 100
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested byte ranges overlap the file (HTTP 416)"""
+
+    def __init__(self, file_size: int):
+        super().__init__(f"Range not satisfiable for file of {file_size} bytes")
+        self.file_size = file_size
+
+
+def parse_range_header(range_header: str, file_size: int,
+                       coalesce_gap: int = MULTIPART_PART_OVERHEAD,
+                       max_ranges: int = MAX_RANGES) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse a Range header into a sorted list of inclusive (start, end) byte ranges.
+
+    Supports `bytes=a-b`, open ranges `bytes=a-`, suffix ranges `bytes=-n` and
+    comma separated lists of those. Overlapping and adjacent ranges (or ranges
+    separated by less than `coalesce_gap` bytes) are merged.
+
+    Args:
+        range_header: Value of the Range header
+        file_size: Size of the file in bytes
+        coalesce_gap: Merge ranges separated by fewer bytes than this
+        max_ranges: Ignore headers with more ranges than this
+
+    Returns:
+        List of (start, end) tuples, or None if the header must be ignored
+        (unknown unit, invalid syntax or too many ranges)
+
+    Raises:
+        RangeNotSatisfiable: If the header is valid but no range overlaps the file
+    """
+    unit, sep, spec = range_header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        return None
+
+    specs = [s.strip() for s in spec.split(',')]
+    specs = [s for s in specs if s]
+    if not specs or len(specs) > max_ranges:
+        return None
+
+    ranges: List[Tuple[int, int]] = []
+    for byte_range in specs:
+        first, dash, last = byte_range.partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+
+        if not first:
+            # Suffix range: the last N bytes
+            if not last:
+                return None
+            suffix_length = int(last)
+            if suffix_length == 0 or file_size == 0:
+                continue
+            ranges.append((max(0, file_size - suffix_length), file_size - 1))
+            continue
+
+        start = int(first)
+        end = int(last) if last else file_size - 1
+        if last and end < start:
+            return None
+        if start >= file_size:
+            continue
+        ranges.append((start, min(end, file_size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable(file_size)
+
+    return coalesce_ranges(ranges, coalesce_gap)
+
+
+def coalesce_ranges(ranges: List[Tuple[int, int]], gap: int = 0) -> List[Tuple[int, int]]:
+    """Sort ranges and merge those that overlap, touch or are less than `gap` bytes apart"""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1 + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
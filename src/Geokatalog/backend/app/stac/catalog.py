@@ -1,134 +1,489 @@
 """STAC Catalog generation and management"""
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 from pathlib import Path
+import hashlib
+import logging
+import os
+import threading
+import time
 import pystac
 from pystac import Catalog
 
+from app.cache.metadata_cache import MetadataCache
+from app.cache.range_cache import RangeCache
+from app.scanner.extraction import ParallelExtractor
 from app.scanner.file_scanner import FileScanner
 from app.stac.item import STACItemGenerator
 from app.stac.collection import STACCollectionManager
+from app.stac.snapshot import CatalogSnapshot, ItemLinker
+from app.stac.store import CatalogStore, FileRecord
+
+logger = logging.getLogger(__name__)
 
 
 class STACCatalogGenerator:
     """Generator and manager for STAC Catalog"""
     
     def __init__(self, data_directory: Path, base_url: str = "http://localhost:8000", 
-                 title: str = "STAC Catalog", description: str = "Dynamic STAC Catalog"):
+                 title: str = "STAC Catalog", description: str = "Dynamic STAC Catalog",
+                 range_cache: Optional[RangeCache] = None, store: Optional[CatalogStore] = None,
+                 extraction_workers: int = 1, extraction_io_threads: int = 8,
+                 extraction_timeout: float = 300.0, scan_exclude: Sequence[str] = (),
+                 scan_max_depth: Optional[int] = None, scan_workers: int = 8,
+                 metadata_cache: Optional[MetadataCache] = None):
         self.data_directory = data_directory
         self.base_url = base_url
         self.title = title
         self.description = description
         
-        self.scanner = FileScanner(data_directory, base_url)
+        self.scanner = FileScanner(data_directory, base_url, range_cache=range_cache, exclude=scan_exclude,
+                                   max_depth=scan_max_depth, walk_workers=scan_workers)
+        self.metadata_cache = metadata_cache
+        self.extractor = ParallelExtractor(self.scanner, workers=extraction_workers,
+                                           io_threads=extraction_io_threads, timeout=extraction_timeout,
+                                           cache=metadata_cache)
         self.item_generator = STACItemGenerator(base_url)
         self.collection_manager = STACCollectionManager(base_url)
         
-        self.catalog: Optional[Catalog] = None
-        self.items_by_collection: Dict[str, List[pystac.Item]] = {}
+        # Path -> file version and extracted metadata of the last build, persisted in `store`
+        self.store = store
+        self.manifest: Dict[str, FileRecord] = {}
+        # Formats whose manifest records came from another extractor version; re-extracted by the next scan
+        self._outdated_formats: set = set()
+        # Files per format seen by the running (or last) scan: total, scanned, extracted, cached, failed
+        self.scan_progress: Dict[str, Dict[str, int]] = {}
+        # Serializes scans and single-file updates, which both replace the manifest
+        self._update_lock = threading.RLock()
+        
+        # Published catalog; replaced as a whole, never modified
+        self.snapshot = CatalogSnapshot.empty(data_directory, base_url)
+        # Completes the links of items when they are first served
+        self.item_linker = ItemLinker()
+    
+    def build_catalog(self, reextract: bool = False, publish_interval: Optional[float] = None) -> Catalog:
+        """
+        Build the complete STAC catalog by scanning files.
+        
+        Files whose size, mtime and inode match the manifest (from the
+        previous build or the catalog store) keep their extracted metadata
+        and only new and changed files are opened, unless `reextract` is set.
+        Those are looked up in the metadata cache (skipped with `reextract`)
+        and the rest extracted in parallel by `extractor`; the manifest keeps
+        the scan order and items are sorted, so the result does not depend
+        on which extraction finished first.
+        
+        With `publish_interval` (seconds), newly extracted items are published
+        while the scan runs: after each format and at most that often within
+        one. Until a format is finished, its files from the previous manifest
+        stay visible. Progress per format is kept in `scan_progress`.
+        """
+        with self._update_lock:
+            return self._scan(reextract, publish_interval)
+    
+    def _scan(self, reextract: bool, publish_interval: Optional[float]) -> Catalog:
+        entries_by_type = self.scanner.scan_entries()
+        self.scan_progress = {
+            collection_id: {'total': len(entries), 'scanned': 0, 'extracted': 0, 'cached': 0, 'failed': 0}
+            for collection_id, entries in entries_by_type.items()
+        }
+        manifest: Dict[str, FileRecord] = {}
+        # Files to extract with their collection and the version that is extracted
+        pending: Dict[str, Tuple[str, os.stat_result]] = {}
+        order: List[str] = []
+        for collection_id, entries in entries_by_type.items():
+            progress = self.scan_progress[collection_id]
+            for file_path, st in entries:
+                key = str(file_path)
+                order.append(key)
+                record = self.manifest.get(key)
+                if reextract or record is None or collection_id in self._outdated_formats \
+                        or not record.matches(collection_id, st):
+                    pending[key] = (collection_id, st)
+                else:
+                    manifest[key] = record
+                    progress['scanned'] += 1
+        
+        remaining: Dict[str, int] = {collection_id: 0 for collection_id in entries_by_type}
+        for collection_id, _ in pending.values():
+            remaining[collection_id] += 1
+        completed = {collection_id for collection_id, count in remaining.items() if not count}
+        extracted = 0
+        cached = 0
+        unpublished = False
+        last_publish = time.monotonic()
+        for result in self.extractor.extract((Path(key) for key in pending), use_cache=not reextract):
+            key = str(result.path)
+            collection_id, st = pending[key]
+            manifest[key] = FileRecord(collection_id, st.st_size, st.st_mtime_ns, st.st_ino, result.metadata,
+                                       self._kept_item_id(self.manifest.get(key), collection_id))
+            extracted += 1
+            unpublished = True
+            progress = self.scan_progress[collection_id]
+            progress['scanned'] += 1
+            if result.cached:
+                cached += 1
+                progress['cached'] += 1
+            else:
+                progress['extracted'] += 1
+            if result.metadata is None:
+                progress['failed'] += 1
+            
+            remaining[collection_id] -= 1
+            if not remaining[collection_id]:
+                completed.add(collection_id)
+            if publish_interval is not None and unpublished and (
+                    not remaining[collection_id] or time.monotonic() - last_publish >= publish_interval):
+                self._publish_partial(manifest, completed)
+                unpublished, last_publish = False, time.monotonic()
+        # Scan order, whichever order the extractions finished in
+        manifest = {key: manifest[key] for key in order}
+        self._assign_item_ids(manifest)
+        
+        removed = [path for path in self.manifest if path not in manifest]
+        self._evict_cached(removed)
+        if self.store is not None:
+            try:
+                self.store.apply({path: record for path, record in manifest.items()
+                                  if self.manifest.get(path) is not record}, removed,
+                                 extractor_versions=self.scanner.EXTRACTOR_VERSIONS)
+            except Exception as e:
+                logger.error(f"Could not update catalog store {self.store.path}: {e}")
+        self._outdated_formats = set()
+        logger.info(f"Scanned {len(manifest)} files: {extracted - cached} extracted, {cached} from cache, "
+                    f"{len(manifest) - extracted} unchanged, {len(removed)} removed")
+        
+        if not reextract and not extracted and not removed and self.catalog is not None:
+            # Nothing changed since the published catalog
+            self.manifest = manifest
+            return self.catalog
+        self.manifest = manifest
+        return self._build_from_records(manifest)
+    
+    def update_files(self, paths: Iterable[Path]) -> bool:
+        """
+        Apply changes to single files without scanning the data directory.
+        
+        Each path is a file that was added, modified or deleted, or a
+        directory that was added or removed as a whole. Supported files are
+        re-extracted when their size, mtime or inode changed; paths that no
+        longer exist or that a scan would skip (ignore rules, depth limit)
+        drop their files from the catalog. Only the affected collections
+        are rebuilt.
+        
+        Returns:
+            True if the published catalog changed
+        """
+        with self._update_lock:
+            manifest = dict(self.manifest)
+            upserts: Dict[str, FileRecord] = {}
+            removed: List[str] = []
+            # Files to extract with their collection and the version that is extracted
+            changed: Dict[str, Tuple[str, os.stat_result]] = {}
+            for path in self._expand_paths(paths, manifest):
+                key = str(path)
+                collection_id = self.scanner.get_file_type(path)
+                st = None
+                if self.scanner.includes(path):
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        pass
+                if st is None:
+                    if manifest.pop(key, None) is not None:
+                        removed.append(key)
+                    continue
+                record = manifest.get(key)
+                if record is not None and record.matches(collection_id, st):
+                    continue
+                changed[key] = (collection_id, st)
+            for result in self.extractor.extract(Path(key) for key in changed):
+                key = str(result.path)
+                collection_id, st = changed[key]
+                manifest[key] = upserts[key] = FileRecord(
+                    collection_id, st.st_size, st.st_mtime_ns, st.st_ino, result.metadata,
+                    self._kept_item_id(manifest.get(key), collection_id)
+                )
+            
+            if not upserts and not removed:
+                return False
+            upserts.update(self._assign_item_ids(manifest))
+            self._evict_cached(removed)
+            if self.store is not None:
+                try:
+                    self.store.apply(upserts, removed)
+                except Exception as e:
+                    logger.error(f"Could not update catalog store {self.store.path}: {e}")
+            logger.info(f"Updated {len(upserts)} files, removed {len(removed)}")
+            self.manifest = manifest
+            self._build_from_records(manifest)
+            return True
+    
+    def _expand_paths(self, paths: Iterable[Path], manifest: Dict[str, FileRecord]) -> List[Path]:
+        """Files behind changed paths: directories expand to the files in them and known files under them"""
+        files: Dict[str, Path] = {}
+        for path in paths:
+            path = Path(path)
+            if path.is_dir():
+                for entries in self.scanner.scan_entries(path).values():
+                    for entry in entries:
+                        files[str(entry.path)] = entry.path
+            else:
+                files[str(path)] = path
+            # Files of a removed or replaced directory
+            prefix = str(path) + os.sep
+            for key in manifest:
+                if key.startswith(prefix):
+                    files.setdefault(key, Path(key))
+        return list(files.values())
+    
+    @staticmethod
+    def _kept_item_id(previous: Optional[FileRecord], collection_id: str) -> Optional[str]:
+        """Item ID a re-extracted file keeps: its previous one, unless it moved to another collection"""
+        return previous.item_id if previous is not None and previous.collection == collection_id else None
+    
+    def _assign_item_ids(self, manifest: Dict[str, FileRecord]) -> Dict[str, FileRecord]:
+        """
+        Record item IDs in the manifest: files keep the ID stored in their
+        record, new files get one that no other file of the collection has.
+        
+        Returns:
+            The records that were given an ID (replaced in `manifest`)
+        """
+        paths_by_collection: Dict[str, List[Path]] = {}
+        for key, record in manifest.items():
+            paths_by_collection.setdefault(record.collection, []).append(Path(key))
+        changed: Dict[str, FileRecord] = {}
+        for file_paths in paths_by_collection.values():
+            existing = {path: manifest[str(path)].item_id for path in file_paths if manifest[str(path)].item_id}
+            if len(existing) == len(file_paths):
+                continue
+            for path, item_id in self.item_generator.assign_item_ids(file_paths, self.data_directory,
+                                                                     existing).items():
+                key = str(path)
+                if manifest[key].item_id != item_id:
+                    manifest[key] = changed[key] = manifest[key]._replace(item_id=item_id)
+        return changed
+    
+    def _evict_cached(self, removed: List[str]):
+        """Drop metadata cache entries of files that are gone"""
+        if self.metadata_cache is None or not removed:
+            return
+        try:
+            self.metadata_cache.evict(removed)
+        except Exception as e:
+            logger.warning(f"Could not evict removed files from the metadata cache: {e}")
+    
+    def _publish_partial(self, manifest: Dict[str, FileRecord], completed: set):
+        """Publish a scan in progress over the previous manifest of unfinished formats"""
+        records = {path: record for path, record in self.manifest.items() if record.collection not in completed}
+        records.update(manifest)
+        self._build_from_records(records)
+    
+    def load_snapshot(self) -> bool:
+        """
+        Publish the catalog saved by the last build without opening any data
+        file, or an empty catalog when there is none. Call build_catalog
+        afterwards to reconcile with the disk.
+        
+        Returns:
+            True if a stored catalog was loaded
+        """
+        with self._update_lock:
+            records: Dict[str, FileRecord] = {}
+            if self.store is not None:
+                try:
+                    records = self.store.load()
+                    # Stores written before versions were recorded hold version 1 metadata
+                    stored_versions = self.store.extractor_versions()
+                    self._outdated_formats = {
+                        file_type for file_type, version in self.scanner.EXTRACTOR_VERSIONS.items()
+                        if stored_versions.get(file_type, 1) != version
+                    }
+                except Exception as e:
+                    logger.error(f"Could not load catalog store {self.store.path}: {e}")
+            self.manifest = records
+            self._build_from_records(records)
+            return bool(records)
+    
+    def _affected_collections(self, records: Dict[str, FileRecord]) -> set:
+        """Collections with a file added, changed or removed since the published snapshot"""
+        published = self.snapshot.records
+        affected = set()
+        for path, record in records.items():
+            previous = published.get(path)
+            if previous is not record:
+                affected.add(record.collection)
+                if previous is not None:
+                    affected.add(previous.collection)
+        for path, previous in published.items():
+            if path not in records:
+                affected.add(previous.collection)
+        return affected
     
-    def build_catalog(self) -> Catalog:
-        """Build the complete STAC catalog by scanning files"""
+    def _build_from_records(self, records: Dict[str, FileRecord]) -> Catalog:
+        """
+        Build a snapshot with items, collections and search indexes from a
+        manifest and publish it.
+        
+        Only collections with added, changed or removed files are rebuilt;
+        their unchanged files keep their items when the item ID is unchanged.
+        Other collections, with their extents, are taken over as they are.
+        Objects of the published snapshot are never modified: reused items
+        are copied before they join a rebuilt collection, and unchanged
+        collections are linked from the new root without being re-parented.
+        Items get their own links from `item_linker` when first served.
+        """
+        previous = self.snapshot
+        affected = self._affected_collections(records)
+        
+        paths_by_collection: Dict[str, List[Path]] = {
+            collection_id: [] for collection_id in self.scanner.SUPPORTED_EXTENSIONS
+        }
+        for path, record in records.items():
+            paths_by_collection.setdefault(record.collection, []).append(Path(path))
+        
         # Create root catalog
-        self.catalog = Catalog(
+        catalog = Catalog(
             id='root',
             title=self.title,
             description=self.description
         )
         
-        self.catalog.add_link(pystac.Link(
+        catalog.add_link(pystac.Link(
             rel='self',
             target=f"{self.base_url}/"
         ))
         
-        # Scan files
-        files_by_type = self.scanner.scan_directory()
+        items_by_collection: Dict[str, List[pystac.Item]] = {}
+        items_by_path: Dict[str, pystac.Item] = {}
+        collections: Dict[str, pystac.Collection] = {}
         
         # Process each file type as a collection
-        for collection_id, file_paths in files_by_type.items():
+        for collection_id, file_paths in paths_by_collection.items():
             if not file_paths:
                 continue
             
-            # Create items for this collection
+            if collection_id not in affected:
+                if collection_id in previous.collections:
+                    items_by_collection[collection_id] = previous.items_by_collection[collection_id]
+                    collection = collections[collection_id] = previous.collections[collection_id]
+                    catalog.add_link(pystac.Link.child(collection))
+                    for file_path in file_paths:
+                        item = previous.items_by_path.get(str(file_path))
+                        if item is not None:
+                            items_by_path[str(file_path)] = item
+                continue
+            
+            # Create items for this collection, in a stable order with unique IDs
+            file_paths = sorted(file_paths)
+            # Recorded IDs; files of a scan in progress get theirs assigned
+            item_ids = self.item_generator.assign_item_ids(
+                file_paths, self.data_directory,
+                {path: records[str(path)].item_id for path in file_paths if records[str(path)].item_id}
+            )
             items = []
             for file_path in file_paths:
-                metadata = self.scanner.extract_metadata(file_path)
-                if metadata:
-                    item = self.item_generator.create_item(file_path, metadata, collection_id)
-                    if item:
-                        items.append(item)
+                key = str(file_path)
+                record = records[key]
+                item = previous.items_by_path.get(key) if previous.records.get(key) is record else None
+                if item is not None and item.id == item_ids[file_path]:
+                    # Published items stay untouched; the copy gets the new collection's links
+                    item = self.item_linker.clone(item)
+                else:
+                    item = None
+                    if record.metadata:
+                        item = self.item_generator.create_item(file_path, record.metadata, collection_id,
+                                                               item_id=item_ids[file_path])
+                if item:
+                    items.append(item)
+                    items_by_path[key] = item
             
             if items:
                 # Store items
-                self.items_by_collection[collection_id] = items
+                items_by_collection[collection_id] = items
                 
-                # Create collection
+                # Create collection (with its extents) and add items to it
                 collection = self.collection_manager.create_collection(collection_id, items)
-                
-                # Add collection to catalog
-                self.catalog.add_child(collection)
-                
-                # Add items to collection
-                for item in items:
-                    collection.add_item(item)
+                self.item_linker.add(collection, items)
+                catalog.add_child(collection)
+                collections[collection_id] = collection
         
-        return self.catalog
+        # The manager adds collections as it creates them; it must not write into the snapshot's dict
+        self.collection_manager.collections = dict(collections)
+        fingerprint = hashlib.blake2b(
+            "\n".join(sorted(f"{path}|{record.version}" for path, record in records.items())).encode('utf-8'),
+            digest_size=16
+        ).hexdigest()
+        # Publishing is a single reference swap; readers holding the old snapshot keep it
+        self.snapshot = CatalogSnapshot(previous.version + 1, catalog, collections, items_by_collection,
+                                        records, items_by_path, fingerprint,
+                                        self.data_directory, self.base_url, self.item_linker)
+        return catalog
+    
+    @property
+    def catalog(self) -> Optional[Catalog]:
+        return self.snapshot.catalog
+    
+    @property
+    def version(self) -> int:
+        """Incremented on every published snapshot"""
+        return self.snapshot.version
+    
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the scanned file versions behind the published snapshot"""
+        return self.snapshot.fingerprint
+    
+    @property
+    def built_at(self) -> float:
+        return self.snapshot.built_at
     
     def get_catalog(self) -> Optional[Catalog]:
         """Get the current catalog"""
-        return self.catalog
+        return self.snapshot.get_catalog()
     
     def get_collection(self, collection_id: str) -> Optional[pystac.Collection]:
         """Get a specific collection"""
-        return self.collection_manager.get_collection(collection_id)
+        return self.snapshot.get_collection(collection_id)
     
     def get_collections(self) -> List[pystac.Collection]:
         """Get all collections"""
-        return self.collection_manager.get_all_collections()
+        return self.snapshot.get_collections()
+    
+    def get_items(self, collection_id: str, limit: Optional[int] = 100, offset: int = 0) -> List[pystac.Item]:
+        """Get items from a collection with pagination (no limit when None)"""
+        return self.snapshot.get_items(collection_id, limit, offset)
     
-    def get_items(self, collection_id: str, limit: int = 100, offset: int = 0) -> List[pystac.Item]:
-        """Get items from a collection with pagination"""
-        items = self.items_by_collection.get(collection_id, [])
-        return items[offset:offset + limit]
+    def count_items(self, collection_id: str) -> int:
+        """Number of items in a collection"""
+        return self.snapshot.count_items(collection_id)
     
     def get_item(self, collection_id: str, item_id: str) -> Optional[pystac.Item]:
         """Get a specific item"""
-        items = self.items_by_collection.get(collection_id, [])
-        for item in items:
-            if item.id == item_id:
-                return item
-        return None
+        return self.snapshot.get_item(collection_id, item_id)
+    
+    def get_item_path(self, collection_id: str, item_id: str) -> Optional[Path]:
+        """Get the local file behind an item's data asset"""
+        return self.snapshot.get_item_path(collection_id, item_id)
     
     def search_items(self, bbox: Optional[List[float]] = None, 
                     datetime_range: Optional[str] = None,
                     collections: Optional[List[str]] = None,
-                    limit: int = 100) -> List[pystac.Item]:
-        """Search items with filters"""
-        results = []
-        
-        # Determine which collections to search
-        if collections:
-            search_collections = collections
-        else:
-            search_collections = list(self.items_by_collection.keys())
-        
-        for collection_id in search_collections:
-            items = self.items_by_collection.get(collection_id, [])
-            
-            for item in items:
-                # Apply bbox filter
-                if bbox and item.bbox:
-                    if not self._bbox_intersects(item.bbox, bbox):
-                        continue
-                
-                # Apply datetime filter (simplified)
-                # TODO: Implement proper datetime range filtering
-                
-                results.append(item)
-                
-                if len(results) >= limit:
-                    return results
-        
-        return results
+                    limit: int = 100,
+                    intersects: Optional[Dict] = None,
+                    filter: Optional[Dict] = None) -> List[pystac.Item]:
+        """Search items with filters (see CatalogSnapshot.search_page)"""
+        items, _ = self.snapshot.search_page(bbox, datetime_range, collections, limit, intersects,
+                                             filter=filter)
+        return items
+    
+    def search_page(self, *args, **kwargs) -> Tuple[List[pystac.Item], int]:
+        """One page of search results from the published snapshot (see CatalogSnapshot.search_page)"""
+        return self.snapshot.search_page(*args, **kwargs)
+    
+    def get_queryables(self, collection_id: Optional[str] = None) -> Dict[str, Dict]:
+        """JSON Schema properties that can be used in filters"""
+        return self.snapshot.get_queryables(collection_id)
     
     def _bbox_intersects(self, bbox1: List[float], bbox2: List[float]) -> bool:
         """Check if two bounding boxes intersect"""
@@ -137,9 +492,11 @@ class STACCatalogGenerator:
                    bbox1[3] < bbox2[1] or  # bbox1 is below bbox2
                    bbox1[1] > bbox2[3])    # bbox1 is above bbox2
     
-    def refresh_catalog(self):
-        """Refresh the catalog by re-scanning files"""
-        self.items_by_collection.clear()
-        self.collection_manager.collections.clear()
-        return self.build_catalog()
+    def refresh_catalog(self, full: bool = False):
+        """
+        Refresh the catalog by re-scanning files. Only added and modified
+        files are extracted and only affected collections are rebuilt,
+        unless `full` is set, which re-extracts every file.
+        """
+        return self.build_catalog(reextract=full)
 
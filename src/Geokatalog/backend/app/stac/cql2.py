@@ -0,0 +1,413 @@
+"""
+CQL2 filters for the STAC API Filter extension.
+
+CQL2-text is parsed into the CQL2-JSON form, which is evaluated as
+vectorized pyarrow.compute predicates over a PropertyTable.
+"""
+import json
+import re
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from shapely import wkt
+from shapely.geometry import box, mapping, shape
+
+from app.stac.index import bbox_2d, parse_datetime
+from app.stac.properties import TIMESTAMP_TYPE
+
+# Conformance classes of the supported subset
+CONFORMANCE_CLASSES = [
+    "https://api.stacspec.org/v1.0.0/item-search#filter",
+    "http://www.opengis.net/spec/ogcapi-features-3/1.0/conf/filter",
+    "http://www.opengis.net/spec/ogcapi-features-3/1.0/conf/features-filter",
+    "http://www.opengis.net/spec/cql2/1.0/conf/cql2-text",
+    "http://www.opengis.net/spec/cql2/1.0/conf/cql2-json",
+    "http://www.opengis.net/spec/cql2/1.0/conf/basic-cql2",
+    "http://www.opengis.net/spec/cql2/1.0/conf/advanced-comparison-operators",
+    "http://www.opengis.net/spec/cql2/1.0/conf/basic-spatial-functions",
+]
+
+COMPARISONS = {
+    '=': pc.equal,
+    '<>': pc.not_equal,
+    '<': pc.less,
+    '<=': pc.less_equal,
+    '>': pc.greater,
+    '>=': pc.greater_equal,
+}
+
+WKT_TYPES = {'POINT', 'LINESTRING', 'POLYGON', 'MULTIPOINT', 'MULTILINESTRING', 'MULTIPOLYGON',
+             'GEOMETRYCOLLECTION'}
+
+
+class CQL2Error(ValueError):
+    """Malformed or unsupported CQL2 filter"""
+
+
+# --- CQL2-text ---
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<number>-?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|-?\.\d+(?:[eE][+-]?\d+)?)
+      | (?P<string>'(?:[^']|'')*')
+      | (?P<quoted>"(?:[^"]|"")*")
+      | (?P<ident>[A-Za-z_][A-Za-z0-9_:.]*)
+      | (?P<op><>|<=|>=|=|<|>|\(|\)|,)
+    )""", re.VERBOSE)
+
+
+class _Parser:
+    """Recursive descent parser from CQL2-text to CQL2-JSON"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = []
+        position = 0
+        while position < len(text):
+            if text[position:].strip() == '':
+                break
+            match = _TOKEN.match(text, position)
+            if not match:
+                raise CQL2Error(f"Unexpected input at position {position}: {text[position:position + 20]!r}")
+            kind = match.lastgroup
+            self.tokens.append((kind, match.group(kind), match.start(kind), match.end(kind)))
+            position = match.end()
+        self.index = 0
+
+    def _peek(self, offset: int = 0):
+        index = self.index + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None, len(self.text), len(self.text))
+
+    def _keyword(self, *words: str) -> bool:
+        """Consume a keyword sequence if it comes next"""
+        for offset, word in enumerate(words):
+            kind, value, _, _ = self._peek(offset)
+            if kind != 'ident' or value.upper() != word:
+                return False
+        self.index += len(words)
+        return True
+
+    def _expect(self, value: str):
+        kind, token, start, _ = self._peek()
+        if token != value or kind not in ('op', 'ident'):
+            raise CQL2Error(f"Expected {value!r} at position {start}")
+        self.index += 1
+
+    def parse(self) -> Dict:
+        node = self._or()
+        kind, value, start, _ = self._peek()
+        if kind is not None:
+            raise CQL2Error(f"Unexpected {value!r} at position {start}")
+        return node
+
+    def _or(self):
+        args = [self._and()]
+        while self._keyword('OR'):
+            args.append(self._and())
+        return args[0] if len(args) == 1 else {'op': 'or', 'args': args}
+
+    def _and(self):
+        args = [self._not()]
+        while self._keyword('AND'):
+            args.append(self._not())
+        return args[0] if len(args) == 1 else {'op': 'and', 'args': args}
+
+    def _not(self):
+        if self._keyword('NOT'):
+            return {'op': 'not', 'args': [self._not()]}
+        return self._predicate()
+
+    def _predicate(self):
+        kind, value, _, _ = self._peek()
+        if kind == 'op' and value == '(':
+            # A parenthesized boolean expression
+            self.index += 1
+            node = self._or()
+            self._expect(')')
+            return node
+
+        left = self._scalar()
+        kind, value, _, _ = self._peek()
+        if kind == 'op' and value in COMPARISONS:
+            self.index += 1
+            return {'op': value, 'args': [left, self._scalar()]}
+
+        negate = self._keyword('NOT')
+        if self._keyword('LIKE'):
+            node = {'op': 'like', 'args': [left, self._scalar()]}
+        elif self._keyword('BETWEEN'):
+            low = self._scalar()
+            self._expect('AND')
+            node = {'op': 'between', 'args': [left, low, self._scalar()]}
+        elif self._keyword('IN'):
+            self._expect('(')
+            values = [self._scalar()]
+            while self._peek()[1] == ',':
+                self.index += 1
+                values.append(self._scalar())
+            self._expect(')')
+            node = {'op': 'in', 'args': [left, values]}
+        elif not negate and self._keyword('IS', 'NOT', 'NULL'):
+            return {'op': 'not', 'args': [{'op': 'isNull', 'args': [left]}]}
+        elif not negate and self._keyword('IS', 'NULL'):
+            return {'op': 'isNull', 'args': [left]}
+        elif negate:
+            raise CQL2Error(f"Expected LIKE, BETWEEN or IN after NOT at position {self._peek()[2]}")
+        elif isinstance(left, (bool, dict)) and (isinstance(left, bool) or 'op' in left):
+            # Boolean literal or function call used as a predicate
+            return left
+        else:
+            raise CQL2Error(f"Expected a predicate at position {self._peek()[2]}")
+        return {'op': 'not', 'args': [node]} if negate else node
+
+    def _scalar(self):
+        kind, value, start, end = self._peek()
+        if kind is None:
+            raise CQL2Error("Unexpected end of filter")
+        self.index += 1
+        if kind == 'number':
+            return float(value) if any(c in value for c in '.eE') else int(value)
+        if kind == 'string':
+            return value[1:-1].replace("''", "'")
+        if kind == 'quoted':
+            return {'property': value[1:-1].replace('""', '"')}
+        if kind == 'op':
+            raise CQL2Error(f"Unexpected {value!r} at position {start}")
+
+        upper = value.upper()
+        if upper in ('TRUE', 'FALSE'):
+            return upper == 'TRUE'
+        if self._peek()[1] != '(':
+            return {'property': value}
+        if upper in WKT_TYPES:
+            return mapping(wkt.loads(self.text[start:self._balanced_end()]))
+        self._expect('(')
+        args = []
+        if self._peek()[1] != ')':
+            args.append(self._scalar())
+            while self._peek()[1] == ',':
+                self.index += 1
+                args.append(self._scalar())
+        self._expect(')')
+        if upper in ('TIMESTAMP', 'DATE'):
+            if len(args) != 1 or not isinstance(args[0], str):
+                raise CQL2Error(f"{upper} takes one string argument")
+            return {upper.lower(): args[0]}
+        if upper == 'BBOX':
+            return {'bbox': args}
+        return {'op': value.lower(), 'args': args}
+
+    def _balanced_end(self) -> int:
+        """Skip a parenthesized WKT body and return its end offset in the text"""
+        depth = 0
+        while True:
+            kind, value, start, end = self._peek()
+            if kind is None:
+                raise CQL2Error("Unbalanced parentheses in geometry")
+            self.index += 1
+            if value == '(':
+                depth += 1
+            elif value == ')':
+                depth -= 1
+                if depth == 0:
+                    return end
+
+
+def parse_cql2_text(text: str) -> Dict:
+    """Parse a CQL2-text filter into CQL2-JSON"""
+    try:
+        return _Parser(text).parse()
+    except CQL2Error:
+        raise
+    except Exception as e:
+        raise CQL2Error(f"Invalid CQL2-text filter: {e}")
+
+
+def parse_filter(value: Union[str, Dict], filter_lang: Optional[str]) -> Dict:
+    """
+    Normalize a filter parameter to CQL2-JSON.
+
+    Raises:
+        CQL2Error: unknown filter language or malformed filter
+    """
+    lang = filter_lang or ('cql2-text' if isinstance(value, str) else 'cql2-json')
+    if lang == 'cql2-text':
+        if not isinstance(value, str):
+            raise CQL2Error("A cql2-text filter must be a string")
+        return parse_cql2_text(value)
+    if lang == 'cql2-json':
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError as e:
+                raise CQL2Error(f"Invalid CQL2-JSON filter: {e}")
+        if not isinstance(value, (dict, bool)):
+            raise CQL2Error("A cql2-json filter must be an object")
+        return value
+    raise CQL2Error(f"Unsupported filter-lang: {lang}")
+
+
+# --- Evaluation ---
+
+def _boolean_result(value, size: int) -> pa.Array:
+    if isinstance(value, pa.ChunkedArray):
+        value = value.combine_chunks()
+    if isinstance(value, pa.Scalar):
+        return pa.array([value.as_py()] * size, type=pa.bool_())
+    if isinstance(value, bool):
+        return pa.array([value] * size, type=pa.bool_())
+    if not isinstance(value, pa.Array) or not pa.types.is_boolean(value.type):
+        raise CQL2Error("Filter expression is not a predicate")
+    return value
+
+
+class FilterEvaluator:
+    """
+    Evaluates CQL2-JSON against a PropertyTable, one vectorized kernel per node.
+
+    Comparisons follow SQL three-valued logic: a missing property is null,
+    and rows where the filter is null are not selected. `geometry_filter`
+    resolves S_INTERSECTS against the item footprints.
+    """
+
+    def __init__(self, columns: Callable[[str], pa.Array], size: int,
+                 geometry_filter: Callable[[Dict], np.ndarray]):
+        self.columns = columns
+        self.size = size
+        self.geometry_filter = geometry_filter
+
+    def mask(self, node) -> np.ndarray:
+        """Boolean numpy mask of the rows selected by the filter"""
+        try:
+            result = _boolean_result(self._predicate(node), self.size)
+        except pa.ArrowNotImplementedError as e:
+            raise CQL2Error(f"Incompatible types in filter: {e}")
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            raise CQL2Error(f"Invalid filter: {e}")
+        return result.fill_null(False).to_numpy(zero_copy_only=False)
+
+    def _predicate(self, node):
+        if isinstance(node, bool):
+            return node
+        if not isinstance(node, dict) or 'op' not in node:
+            raise CQL2Error(f"Expected a predicate, got {node!r}")
+        op = node['op'] if node['op'] in COMPARISONS else str(node['op']).lower()
+        args = node.get('args', [])
+
+        if op in ('and', 'or'):
+            if not args:
+                raise CQL2Error(f"'{op}' needs arguments")
+            combine = pc.and_kleene if op == 'and' else pc.or_kleene
+            result = _boolean_result(self._predicate(args[0]), self.size)
+            for arg in args[1:]:
+                result = combine(result, _boolean_result(self._predicate(arg), self.size))
+            return result
+        if op == 'not':
+            self._arity(op, args, 1)
+            return pc.invert(_boolean_result(self._predicate(args[0]), self.size))
+        if op in COMPARISONS:
+            self._arity(op, args, 2)
+            left, right = self._operands(args[0], args[1])
+            return COMPARISONS[op](left, right)
+        if op == 'isnull':
+            self._arity(op, args, 1)
+            return pc.is_null(self._column_or_literal(args[0]))
+        if op == 'like':
+            self._arity(op, args, 2)
+            if not isinstance(args[1], str):
+                raise CQL2Error("LIKE needs a string pattern")
+            return pc.match_like(self._column_or_literal(args[0]), args[1])
+        if op == 'between':
+            self._arity(op, args, 3)
+            value, low = self._operands(args[0], args[1])
+            value, high = self._operands(args[0], args[2])
+            return pc.and_kleene(pc.greater_equal(value, low), pc.less_equal(value, high))
+        if op == 'in':
+            self._arity(op, args, 2)
+            if not isinstance(args[1], list):
+                raise CQL2Error("IN needs a list of values")
+            if not args[1]:
+                return False
+            value = self._column_or_literal(args[0])
+            values = [self._literal(v, value.type) for v in args[1]]
+            if pa.types.is_null(value.type):
+                value = pa.nulls(self.size, type=values[0].type)
+            value_set = pa.array([v.as_py() for v in values]).cast(value.type)
+            matched = pc.is_in(value, value_set=value_set)
+            return pc.if_else(pc.is_null(value), pa.scalar(None, pa.bool_()), matched)
+        if op == 's_intersects':
+            self._arity(op, args, 2)
+            geometry = next((a for a in args if not self._is_property(a)), None)
+            if geometry is None or not any(self._is_property(a, 'geometry') for a in args):
+                raise CQL2Error("S_INTERSECTS compares the geometry property with a geometry literal")
+            if isinstance(geometry, dict) and 'bbox' in geometry:
+                bbox = bbox_2d(geometry['bbox'])
+                if bbox is None:
+                    raise CQL2Error("BBOX takes 4 or 6 numbers")
+                geometry = mapping(box(*bbox))
+            else:
+                try:
+                    geometry = mapping(shape(geometry))
+                except Exception as e:
+                    raise CQL2Error(f"Invalid geometry literal in S_INTERSECTS: {e}")
+            mask = np.zeros(self.size, dtype=bool)
+            mask[self.geometry_filter(geometry)] = True
+            return pa.array(mask)
+        raise CQL2Error(f"Unsupported operator: {node['op']}")
+
+    @staticmethod
+    def _arity(op: str, args: List, count: int):
+        if len(args) != count:
+            raise CQL2Error(f"'{op}' takes {count} argument(s)")
+
+    @staticmethod
+    def _is_property(node, name: Optional[str] = None) -> bool:
+        return isinstance(node, dict) and 'property' in node and (name is None or node['property'] == name)
+
+    def _column_or_literal(self, node):
+        if self._is_property(node):
+            return self.columns(node['property'])
+        return self._literal(node)
+
+    def _operands(self, left, right):
+        """
+        Evaluate two operands, typing literals after the column they are
+        compared with. A missing property becomes nulls of the other side's type.
+        """
+        left_value = self.columns(left['property']) if self._is_property(left) else None
+        right_value = self.columns(right['property']) if self._is_property(right) else None
+        if left_value is None:
+            left_value = self._literal(left, right_value.type if right_value is not None else None)
+        if right_value is None:
+            right_value = self._literal(right, left_value.type)
+        if pa.types.is_null(left_value.type) and not pa.types.is_null(right_value.type):
+            left_value = pa.nulls(self.size, type=right_value.type)
+        elif pa.types.is_null(right_value.type) and not pa.types.is_null(left_value.type):
+            right_value = pa.nulls(self.size, type=left_value.type)
+        return left_value, right_value
+
+    def _literal(self, node, column_type: Optional[pa.DataType] = None) -> pa.Scalar:
+        if isinstance(node, dict):
+            if 'timestamp' in node or 'date' in node:
+                try:
+                    value = parse_datetime(node.get('timestamp') or node.get('date'))
+                except (TypeError, ValueError) as e:
+                    raise CQL2Error(f"Invalid temporal literal {node!r}: {e}")
+                return pa.scalar(value, type=TIMESTAMP_TYPE)
+            if 'op' in node:
+                raise CQL2Error(f"Unsupported function in a comparison: {node['op']}")
+            raise CQL2Error(f"Unsupported literal {node!r}")
+        if isinstance(node, list):
+            raise CQL2Error("Array literals are only supported in IN")
+        if column_type is not None and pa.types.is_timestamp(column_type) and isinstance(node, str):
+            # Datetime properties compared with plain strings, as many clients send them
+            try:
+                return pa.scalar(parse_datetime(node), type=TIMESTAMP_TYPE)
+            except ValueError as e:
+                raise CQL2Error(f"Invalid datetime {node!r}: {e}")
+        if isinstance(node, datetime):
+            return pa.scalar(node, type=TIMESTAMP_TYPE)
+        return pa.scalar(node)
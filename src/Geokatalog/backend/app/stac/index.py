@@ -0,0 +1,261 @@
+"""Spatial and temporal indexes over STAC items for /search"""
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+
+def bbox_2d(bbox: Optional[Sequence[float]]) -> Optional[List[float]]:
+    """Reduce a 2D or 3D STAC bbox to [minx, miny, maxx, maxy]"""
+    if not bbox:
+        return None
+    if len(bbox) == 6:
+        return [bbox[0], bbox[1], bbox[3], bbox[4]]
+    if len(bbox) == 4:
+        return list(bbox)
+    return None
+
+
+class SpatialIndex:
+    """
+    STRtree over item bounding boxes, addressed by item position.
+
+    Positions are indexes into the sequence the index was built from. Items
+    without a bbox are never pruned by a bbox query (they were never filtered
+    out by the linear search either); they do not match geometry queries.
+    Footprints for exact geometry tests are built on first use.
+    """
+
+    def __init__(self, bboxes: Sequence[Optional[Sequence[float]]],
+                 geometries: Optional[Sequence[Optional[Dict]]] = None):
+        self.size = len(bboxes)
+        boxes = [bbox_2d(b) for b in bboxes]
+        has_bbox = np.array([b is not None for b in boxes], dtype=bool)
+        self._positions = np.nonzero(has_bbox)[0]
+        self._unbounded = np.nonzero(~has_bbox)[0]
+
+        coords = np.array([b for b in boxes if b is not None], dtype=float).reshape(-1, 4)
+        self._coords = coords
+        self._slots = np.full(self.size, -1, dtype=np.int64)
+        self._slots[self._positions] = np.arange(len(self._positions))
+        if len(coords):
+            self._extent = (coords[:, 0].min(), coords[:, 1].min(), coords[:, 2].max(), coords[:, 3].max())
+        else:
+            self._extent = None
+        self._boxes = shapely.box(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3])
+        self.tree = shapely.STRtree(self._boxes)
+
+        self._geometries = geometries
+        self._footprints: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def query_bbox(self, bbox: Sequence[float]) -> np.ndarray:
+        """Sorted positions of items whose bbox intersects `bbox`"""
+        hits = self._positions[self.tree.query(shapely.box(*bbox_2d(bbox)))]
+        return np.union1d(hits, self._unbounded)
+
+    def estimate_bbox(self, bbox: Sequence[float]) -> float:
+        """
+        Rough number of matches for `bbox`, assuming items are spread evenly
+        over the extent of all bboxes. Only used to order filters.
+        """
+        minx, miny, maxx, maxy = bbox_2d(bbox)
+        if self._extent is None:
+            return float(len(self._unbounded))
+        ext_minx, ext_miny, ext_maxx, ext_maxy = self._extent
+        extent_area = (ext_maxx - ext_minx) * (ext_maxy - ext_miny)
+        if extent_area <= 0:
+            return float(self.size)
+        overlap = max(0.0, min(maxx, ext_maxx) - max(minx, ext_minx)) * \
+            max(0.0, min(maxy, ext_maxy) - max(miny, ext_miny))
+        return len(self._positions) * overlap / extent_area + len(self._unbounded)
+
+    def filter_bbox(self, positions: np.ndarray, bbox: Sequence[float]) -> np.ndarray:
+        """Keep the positions whose bbox intersects `bbox` (or that have none)"""
+        minx, miny, maxx, maxy = bbox_2d(bbox)
+        slots = self._slots[positions]
+        bounded = slots >= 0
+        coords = self._coords[slots[bounded]]
+        keep = ~bounded
+        keep[bounded] = ~((coords[:, 0] > maxx) | (coords[:, 2] < minx) |
+                          (coords[:, 1] > maxy) | (coords[:, 3] < miny))
+        return positions[keep]
+
+    def _footprint_array(self) -> np.ndarray:
+        """Item footprints in tree order, falling back to the bbox polygon"""
+        with self._lock:
+            if self._footprints is None:
+                self._footprints = self._build_footprints()
+            return self._footprints
+
+    def _build_footprints(self) -> np.ndarray:
+        footprints = self._boxes.copy()
+        if self._geometries is None:
+            return footprints
+
+        # Single-ring polygons (most item footprints) are built in one vectorized call
+        ring_slots: List[int] = []
+        ring_coords: List = []
+        ring_indices: List[int] = []
+        for i, position in enumerate(self._positions):
+            geometry = self._geometries[position]
+            if not geometry:
+                continue
+            coordinates = geometry.get('coordinates')
+            if geometry.get('type') == 'Polygon' and coordinates and len(coordinates) == 1 \
+                    and len(coordinates[0]) >= 4:
+                ring_indices.extend([len(ring_slots)] * len(coordinates[0]))
+                ring_coords.extend(coordinates[0])
+                ring_slots.append(i)
+                continue
+            try:
+                footprints[i] = shape(geometry)
+            except Exception:
+                pass
+
+        if ring_slots:
+            try:
+                rings = shapely.linearrings(np.asarray(ring_coords, dtype=float)[:, :2],
+                                            indices=np.asarray(ring_indices))
+                footprints[np.asarray(ring_slots)] = shapely.polygons(rings)
+            except Exception:
+                # Mixed dimensions or malformed rings: fall back to one geometry at a time
+                for i in ring_slots:
+                    try:
+                        footprints[i] = shape(self._geometries[self._positions[i]])
+                    except Exception:
+                        pass
+        return footprints
+
+    def query_geometry(self, geometry: Dict) -> np.ndarray:
+        """Sorted positions of items whose footprint intersects a GeoJSON geometry"""
+        query = shape(geometry)
+        shapely.prepare(query)
+        candidates = self.tree.query(query)
+        if len(candidates) == 0:
+            return candidates
+        exact = shapely.intersects(query, self._footprint_array()[candidates])
+        return np.sort(self._positions[candidates[exact]])
+
+    def filter_geometry(self, positions: np.ndarray, geometry: Dict) -> np.ndarray:
+        """Keep the positions whose footprint intersects a GeoJSON geometry"""
+        query = shape(geometry)
+        positions = self.filter_bbox(positions, query.bounds)
+        slots = self._slots[positions]
+        bounded = slots >= 0
+        positions, slots = positions[bounded], slots[bounded]
+        if len(slots) == 0:
+            return positions
+        shapely.prepare(query)
+        return positions[shapely.intersects(query, self._footprint_array()[slots])]
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+DatetimeInterval = Tuple[Optional[datetime], Optional[datetime]]
+
+
+def parse_datetime(value: str) -> datetime:
+    """Parse an RFC 3339 datetime; values without an offset are taken as UTC"""
+    text = value.strip()
+    if text[-1:] in ('Z', 'z'):
+        text = text[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(text)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def parse_datetime_interval(value: str) -> DatetimeInterval:
+    """
+    Parse a STAC `datetime` parameter: an instant, a closed interval
+    ("start/end") or an open interval with ".." or an empty end.
+
+    Returns:
+        (start, end), None for an open end
+
+    Raises:
+        ValueError: malformed value, both ends open or start after end
+    """
+    if '/' not in value:
+        instant = parse_datetime(value)
+        return instant, instant
+    parts = value.split('/')
+    if len(parts) != 2:
+        raise ValueError("Expected an instant or a start/end interval")
+    start, end = (None if part.strip() in ('', '..') else parse_datetime(part) for part in parts)
+    if start is None and end is None:
+        raise ValueError("At least one end of the interval must be given")
+    if start is not None and end is not None and start > end:
+        raise ValueError("Interval start is after its end")
+    return start, end
+
+
+def to_microseconds(value: datetime) -> int:
+    """Microseconds since the Unix epoch (naive values are taken as UTC)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+class TemporalIndex:
+    """
+    Sorted interval index over item [start, end] times, addressed by item position.
+
+    Items are kept sorted both by start and by end, so the items starting
+    before the query end and the items ending after the query start are each
+    a contiguous run found by bisection. The shorter run is scanned and
+    filtered on the other bound. Items without a time never match.
+    """
+
+    def __init__(self, intervals: Sequence[Optional[Tuple[datetime, datetime]]]):
+        self.size = len(intervals)
+        has_time = np.array([interval is not None for interval in intervals], dtype=bool)
+        self._positions = np.nonzero(has_time)[0]
+        self._starts = np.array([to_microseconds(i[0]) for i in intervals if i is not None], dtype=np.int64)
+        self._ends = np.array([to_microseconds(i[1]) for i in intervals if i is not None], dtype=np.int64)
+        self._slots = np.full(self.size, -1, dtype=np.int64)
+        self._slots[self._positions] = np.arange(len(self._positions))
+
+        self._by_start = np.argsort(self._starts, kind='stable')
+        self._sorted_starts = self._starts[self._by_start]
+        self._by_end = np.argsort(self._ends, kind='stable')
+        self._sorted_ends = self._ends[self._by_end]
+
+    @staticmethod
+    def _bounds(interval: DatetimeInterval) -> Tuple[int, int]:
+        start, end = interval
+        return (np.iinfo(np.int64).min if start is None else to_microseconds(start),
+                np.iinfo(np.int64).max if end is None else to_microseconds(end))
+
+    def _runs(self, interval: DatetimeInterval) -> Tuple[int, int, int, int]:
+        start, end = self._bounds(interval)
+        started = int(np.searchsorted(self._sorted_starts, end, side='right'))
+        not_ended = int(np.searchsorted(self._sorted_ends, start, side='left'))
+        return start, end, started, not_ended
+
+    def estimate(self, interval: DatetimeInterval) -> int:
+        """Upper bound on the number of matches, in O(log n)"""
+        _, _, started, not_ended = self._runs(interval)
+        return min(started, len(self._sorted_ends) - not_ended)
+
+    def query(self, interval: DatetimeInterval) -> np.ndarray:
+        """Sorted positions of items whose [start, end] overlaps `interval`"""
+        start, end, started, not_ended = self._runs(interval)
+        if started <= len(self._sorted_ends) - not_ended:
+            slots = self._by_start[:started]
+            slots = slots[self._ends[slots] >= start]
+        else:
+            slots = self._by_end[not_ended:]
+            slots = slots[self._starts[slots] <= end]
+        return np.sort(self._positions[slots])
+
+    def filter(self, positions: np.ndarray, interval: DatetimeInterval) -> np.ndarray:
+        """Keep the positions whose [start, end] overlaps `interval`"""
+        start, end = self._bounds(interval)
+        slots = self._slots[positions]
+        timed = slots >= 0
+        positions, slots = positions[timed], slots[timed]
+        return positions[(self._starts[slots] <= end) & (self._ends[slots] >= start)]
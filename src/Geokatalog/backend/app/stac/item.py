@@ -1,6 +1,7 @@
 """STAC Item generation for different geospatial formats"""
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional
+import hashlib
 import pystac
 from datetime import datetime
 
@@ -11,14 +12,15 @@ class STACItemGenerator:
     def __init__(self, base_url: str = "http://localhost:8000"):
         self.base_url = base_url
     
-    def create_item(self, file_path: Path, metadata: Dict, collection_id: str) -> Optional[pystac.Item]:
+    def create_item(self, file_path: Path, metadata: Dict, collection_id: str,
+                    item_id: Optional[str] = None) -> Optional[pystac.Item]:
         """Create a STAC Item from file metadata"""
         if not metadata:
             return None
         
         try:
-            # Create item ID from file path
-            item_id = self._create_item_id(file_path)
+            # Create item ID from file path unless one was assigned
+            item_id = item_id or self._create_item_id(file_path)
             
             # Extract required fields from metadata
             bbox = metadata.get('bbox')
@@ -51,7 +53,8 @@ class STACItemGenerator:
                         # Add alternate representations for QGIS
                         "alternate": {
                             "vsicurl": f"/vsicurl/{asset_href}",  # GDAL virtual file system
-                        }
+                        },
+                        **({"file:size": asset_data['file:size']} if 'file:size' in asset_data else {})
                     }
                 )
                 
@@ -62,7 +65,11 @@ class STACItemGenerator:
                 item.stac_extensions.append(
                     "https://stac-extensions.github.io/projection/v1.1.0/schema.json"
                 )
-                item.properties['proj:epsg'] = self._extract_epsg(properties['crs'])
+                crs = properties['crs']
+                if isinstance(crs, dict):
+                    # CRS objects from the scanner carry the "EPSG:<code>" name
+                    crs = crs.get('properties', {}).get('name', '')
+                item.properties['proj:epsg'] = self._extract_epsg(crs)
             
             # Set self link
             item.add_link(pystac.Link(
@@ -90,6 +97,57 @@ class STACItemGenerator:
         # Remove extension and use stem as ID
         return file_path.stem.replace(' ', '_').replace('.', '_')
     
+    def assign_item_ids(self, file_paths: Iterable[Path], root: Path,
+                        existing: Optional[Dict[Path, str]] = None) -> Dict[Path, str]:
+        """
+        Assign unique item IDs to the files of one collection.
+        
+        Files listed in `existing` keep the ID they were published under, so
+        adding a file never renames another one. Other files get their stem
+        ID unless it is taken or another new file has the same stem. Of
+        colliding new files, the one closest to `root` (then by path) gets
+        the stem and the others an ID from their relative path, with a short
+        hash of the path appended if that is taken too. The result does not
+        depend on the order of `file_paths`.
+        """
+        existing = existing or {}
+        ids: Dict[Path, str] = {}
+        used = set()
+        for file_path in sorted(file_paths):
+            item_id = existing.get(file_path)
+            if item_id and item_id not in used:
+                ids[file_path] = item_id
+                used.add(item_id)
+        
+        by_stem: Dict[str, list] = {}
+        for file_path in file_paths:
+            if file_path not in ids:
+                by_stem.setdefault(self._create_item_id(file_path), []).append(file_path)
+        
+        def relative(file_path: Path) -> Path:
+            try:
+                return file_path.relative_to(root)
+            except ValueError:
+                return file_path
+        
+        # Path-derived IDs must not take the stem of another new file either
+        reserved = used | set(by_stem)
+        for stem_id in sorted(by_stem):
+            paths = sorted(by_stem[stem_id], key=lambda p: (len(relative(p).parts), relative(p).as_posix()))
+            for index, file_path in enumerate(paths):
+                if index == 0 and stem_id not in used:
+                    item_id = stem_id
+                else:
+                    rel = relative(file_path)
+                    item_id = '_'.join(rel.parent.parts + (stem_id,)).replace(' ', '_').replace('.', '_')
+                    if item_id in reserved:
+                        digest = hashlib.blake2b(rel.as_posix().encode('utf-8'), digest_size=4).hexdigest()
+                        item_id = f"{item_id}_{digest}"
+                used.add(item_id)
+                reserved.add(item_id)
+                ids[file_path] = item_id
+        return ids
+    
     def _parse_datetime(self, datetime_str: Optional[str]) -> Optional[datetime]:
         """Parse datetime string to datetime object"""
         if not datetime_str:
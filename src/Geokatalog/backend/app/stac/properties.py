@@ -0,0 +1,114 @@
+"""Columnar copy of STAC item properties for vectorized filters"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pyarrow as pa
+import pystac
+
+from app.stac.index import parse_datetime
+
+# Properties holding RFC 3339 datetimes, stored as UTC timestamps
+DATETIME_PROPERTIES = {'datetime', 'start_datetime', 'end_datetime', 'created', 'updated'}
+# Fields of the data asset exposed as queryables when the properties lack them
+ASSET_FIELDS = ('file:size',)
+TIMESTAMP_TYPE = pa.timestamp('us', tz='UTC')
+
+
+def _timestamp(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return parse_datetime(value.isoformat())
+    if isinstance(value, str):
+        try:
+            return parse_datetime(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _column(name: str, values: List[Any]) -> Optional[pa.Array]:
+    """
+    Build a typed column from one property of every item.
+
+    Objects are not queryable and are left out. Numbers of mixed int/float
+    type become doubles; any other mix of types is stored as strings.
+    """
+    if name in DATETIME_PROPERTIES:
+        return pa.array([_timestamp(v) for v in values], type=TIMESTAMP_TYPE)
+    present = [v for v in values if v is not None]
+    if any(isinstance(v, dict) or (isinstance(v, list) and any(isinstance(x, (dict, list)) for x in v))
+           for v in present):
+        return None
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        pass
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        return pa.array([None if v is None else float(v) for v in values], type=pa.float64())
+    if any(isinstance(v, list) for v in present):
+        return None
+    return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+class PropertyTable:
+    """
+    Item properties as an Arrow table, one row per item position.
+
+    Besides the item properties it has `id` and `collection` columns and the
+    data asset's `file:size`. Properties missing from an item are null.
+    """
+
+    def __init__(self, entries: Sequence[Tuple[str, pystac.Item]]):
+        self.size = len(entries)
+        values: Dict[str, List[Any]] = {}
+        for row, (collection_id, item) in enumerate(entries):
+            fields = dict(item.properties)
+            data_asset = item.assets.get('data')
+            if data_asset is not None:
+                for field in ASSET_FIELDS:
+                    if field not in fields and field in data_asset.extra_fields:
+                        fields[field] = data_asset.extra_fields[field]
+            fields['id'] = item.id
+            fields['collection'] = collection_id
+            for name, value in fields.items():
+                column = values.get(name)
+                if column is None:
+                    column = values[name] = [None] * self.size
+                column[row] = value
+
+        columns = {}
+        for name, column_values in values.items():
+            column = _column(name, column_values)
+            if column is not None:
+                columns[name] = column
+        self.table = pa.table(columns) if columns else pa.table({'id': pa.array([], pa.string())})
+
+    def column(self, name: str) -> pa.Array:
+        """A property column; nulls for properties no item has"""
+        if name in self.table.column_names:
+            return self.table.column(name).combine_chunks()
+        return pa.nulls(self.size)
+
+    def queryables(self, rows: Optional[Sequence[int]] = None) -> Dict[str, Dict]:
+        """JSON Schema of the queryable properties, optionally only those set on `rows`"""
+        table = self.table if rows is None else self.table.take(pa.array(rows, type=pa.int64()))
+        properties: Dict[str, Dict] = {'geometry': {'$ref': 'https://geojson.org/schema/Geometry.json'}}
+        for name in sorted(table.column_names):
+            column = table.column(name)
+            if column.null_count == len(column):
+                continue
+            properties[name] = _json_schema(column.type)
+        return properties
+
+
+def _json_schema(data_type: pa.DataType) -> Dict:
+    if pa.types.is_timestamp(data_type):
+        return {'type': 'string', 'format': 'date-time'}
+    if pa.types.is_boolean(data_type):
+        return {'type': 'boolean'}
+    if pa.types.is_integer(data_type):
+        return {'type': 'integer'}
+    if pa.types.is_floating(data_type):
+        return {'type': 'number'}
+    if pa.types.is_list(data_type):
+        return {'type': 'array', 'items': _json_schema(data_type.value_type)}
+    return {'type': 'string'}
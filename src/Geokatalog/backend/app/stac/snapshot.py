@@ -0,0 +1,256 @@
+"""Immutable, versioned views of the published catalog"""
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import os
+import threading
+import time
+import weakref
+
+import numpy as np
+import pystac
+from pystac import Catalog
+from shapely.geometry import shape
+
+from app.stac.cql2 import FilterEvaluator
+from app.stac.index import SpatialIndex, TemporalIndex, parse_datetime_interval
+from app.stac.properties import PropertyTable
+from app.stac.store import FileRecord
+
+
+class ItemLinker:
+    """
+    Links items into their collection when they are first handed out.
+
+    Wiring the root, parent, self and collection links of an item takes
+    longer than creating it, and most items of a large catalog are never
+    requested between two rebuilds. A collection gets the `item` links of
+    all its items when it is built; each item gets its own links on first
+    use, with the hrefs pystac's add_item would have given it. Shared by
+    all snapshots of a generator, so an item is linked at most once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # item -> (collection, self href) until the item is first handed out
+        self._pending = weakref.WeakKeyDictionary()
+
+    def add(self, collection: pystac.Collection, items: List[pystac.Item]):
+        """Add the item links to `collection` and defer the items' own links"""
+        strategy = pystac.layout.BestPracticesLayoutStrategy()
+        parent_dir = os.path.dirname(collection.get_self_href())
+        pending = []
+        for item in items:
+            self_href = strategy.get_href(item, parent_dir)
+            collection.add_link(pystac.Link(pystac.RelType.ITEM, self_href, media_type=pystac.MediaType.JSON))
+            pending.append((item, (collection, self_href)))
+        with self.lock:
+            self._pending.update(pending)
+
+    def link(self, items: List[pystac.Item]) -> List[pystac.Item]:
+        """Complete the links of `items` that were not handed out before"""
+        with self.lock:
+            for item in items:
+                pending = self._pending.pop(item, None)
+                if pending is None:
+                    continue
+                collection, self_href = pending
+                item.set_root(collection.get_root())
+                item.set_parent(collection)
+                item.set_self_href(self_href)
+                item.set_collection(collection)
+        return items
+
+    def clone(self, item: pystac.Item) -> pystac.Item:
+        """Copy of a published item, never taken while it is being linked"""
+        with self.lock:
+            return item.clone()
+
+
+class CatalogSnapshot:
+    """
+    One published version of the catalog: collections, items and the
+    search indexes over them.
+
+    A snapshot is built completely before it is published and is never
+    changed afterwards; a refresh publishes a new one by replacing the
+    generator's reference to it. Readers take the reference once per request
+    and see one consistent version without locking, however long they hold it.
+    Items and collections unaffected by a change are shared between snapshots
+    and must not be modified; the only exception is `linker` completing the
+    links of an item the first time it is handed out.
+    """
+
+    def __init__(self, version: int, catalog: Optional[Catalog],
+                 collections: Dict[str, pystac.Collection],
+                 items_by_collection: Dict[str, List[pystac.Item]],
+                 records: Dict[str, FileRecord], items_by_path: Dict[str, pystac.Item],
+                 fingerprint: str, data_directory: Path, base_url: str,
+                 linker: Optional[ItemLinker] = None):
+        self.version = version
+        self.catalog = catalog
+        self.collections = collections
+        self.items_by_collection = items_by_collection
+        # collection ID -> item ID -> item, for constant-time item lookups
+        self.items_by_id: Dict[str, Dict[str, pystac.Item]] = {
+            collection_id: {item.id: item for item in items}
+            for collection_id, items in items_by_collection.items()
+        }
+        # Manifest the snapshot was built from, with the item of every file
+        self.records = records
+        self.items_by_path = items_by_path
+        # Hash of the file versions behind the snapshot, for ETags and page tokens
+        self.fingerprint = fingerprint
+        self.data_directory = data_directory
+        self.base_url = base_url
+        self.linker = linker or ItemLinker()
+        self.built_at = time.time()
+        self._build_search_index()
+
+    @classmethod
+    def empty(cls, data_directory: Path, base_url: str) -> 'CatalogSnapshot':
+        """Placeholder published before anything was loaded or scanned"""
+        return cls(0, None, {}, {}, {}, {}, "", data_directory, base_url)
+
+    def _build_search_index(self):
+        """Index all items for /search; positions follow the catalog order"""
+        entries = [
+            (collection_id, item)
+            for collection_id, items in self.items_by_collection.items()
+            for item in items
+        ]
+        self._collection_ids = list(self.items_by_collection.keys())
+        codes = {collection_id: code for code, collection_id in enumerate(self._collection_ids)}
+        self._collection_codes = np.array([codes[c] for c, _ in entries], dtype=np.int32)
+        self.spatial_index = SpatialIndex(
+            [item.bbox for _, item in entries],
+            [item.geometry for _, item in entries]
+        )
+        self.temporal_index = TemporalIndex([self._item_interval(item) for _, item in entries])
+        self.property_table = PropertyTable(entries)
+        self.search_entries = entries
+
+    @staticmethod
+    def _item_interval(item: pystac.Item) -> Optional[Tuple[datetime, datetime]]:
+        """Item time as [start, end]: start/end_datetime when given, else datetime"""
+        try:
+            start = item.common_metadata.start_datetime or item.datetime
+            end = item.common_metadata.end_datetime or item.datetime
+        except Exception:
+            return None
+        if start is None and end is None:
+            return None
+        return (start or end, end or start)
+
+    def get_catalog(self) -> Optional[Catalog]:
+        return self.catalog
+
+    def get_collection(self, collection_id: str) -> Optional[pystac.Collection]:
+        return self.collections.get(collection_id)
+
+    def get_collections(self) -> List[pystac.Collection]:
+        return list(self.collections.values())
+
+    def get_items(self, collection_id: str, limit: Optional[int] = 100, offset: int = 0) -> List[pystac.Item]:
+        """Items of a collection from `offset` (no limit when None)"""
+        items = self.items_by_collection.get(collection_id, [])
+        return self.linker.link(items[offset:] if limit is None else items[offset:offset + limit])
+
+    def count_items(self, collection_id: str) -> int:
+        return len(self.items_by_collection.get(collection_id, []))
+
+    def get_item(self, collection_id: str, item_id: str) -> Optional[pystac.Item]:
+        item = self.items_by_id.get(collection_id, {}).get(item_id)
+        return item if item is None else self.linker.link([item])[0]
+
+    def get_item_path(self, collection_id: str, item_id: str) -> Optional[Path]:
+        """Local file behind an item's data asset"""
+        item = self.items_by_id.get(collection_id, {}).get(item_id)
+        if not item or 'data' not in item.assets:
+            return None
+        prefix = f"{self.base_url}/data/"
+        href = item.assets['data'].href
+        if not href.startswith(prefix):
+            return None
+        return Path(self.data_directory) / href[len(prefix):]
+
+    def search_page(self, bbox: Optional[List[float]] = None,
+                    datetime_range: Optional[str] = None,
+                    collections: Optional[List[str]] = None,
+                    limit: Optional[int] = 100,
+                    intersects: Optional[Dict] = None,
+                    offset: int = 0,
+                    filter: Optional[Dict] = None) -> Tuple[List[pystac.Item], int]:
+        """
+        Search items with filters and return one page of the results.
+
+        bbox and intersects use the spatial index; intersects is tested
+        exactly against item footprints. datetime_range is a STAC datetime
+        (instant or interval) matched against the temporal index. When both
+        filters are given, the one estimated to match fewer items is queried
+        first and the other is applied to its candidates. `filter` is a
+        CQL2-JSON expression evaluated over the columnar property table.
+        Results are ordered
+        by the requested collections, then by catalog order.
+
+        The result order is stable for a catalog version, so offsets into it
+        can be used to page through the results.
+
+        Returns:
+            (items from `offset`, at most `limit` or all when None; number of matches)
+
+        Raises:
+            ValueError: malformed datetime_range
+            CQL2Error: invalid or unsupported filter
+        """
+        entries = self.search_entries
+        interval = parse_datetime_interval(datetime_range) if datetime_range else None
+        spatial_estimate = float(len(entries))
+        if intersects is not None:
+            spatial_estimate = self.spatial_index.estimate_bbox(shape(intersects).bounds)
+        elif bbox:
+            spatial_estimate = self.spatial_index.estimate_bbox(bbox)
+
+        if interval is not None and self.temporal_index.estimate(interval) <= spatial_estimate:
+            positions = self.temporal_index.query(interval)
+            if intersects is not None:
+                positions = self.spatial_index.filter_geometry(positions, intersects)
+            elif bbox:
+                positions = self.spatial_index.filter_bbox(positions, bbox)
+        else:
+            if intersects is not None:
+                positions = self.spatial_index.query_geometry(intersects)
+            elif bbox:
+                positions = self.spatial_index.query_bbox(bbox)
+            else:
+                positions = np.arange(len(entries))
+            if interval is not None:
+                positions = self.temporal_index.filter(positions, interval)
+
+        if filter is not None:
+            evaluator = FilterEvaluator(self.property_table.column, self.property_table.size,
+                                        geometry_filter=self.spatial_index.query_geometry)
+            positions = positions[evaluator.mask(filter)[positions]]
+
+        if collections:
+            codes = {collection_id: code for code, collection_id in enumerate(self._collection_ids)}
+            rank = np.full(len(self._collection_ids), len(collections), dtype=np.int64)
+            for order, collection_id in reversed(list(enumerate(collections))):
+                if collection_id in codes:
+                    rank[codes[collection_id]] = order
+            position_ranks = rank[self._collection_codes[positions]]
+            keep = position_ranks < len(collections)
+            positions = positions[keep]
+            positions = positions[np.argsort(position_ranks[keep], kind='stable')]
+
+        end = len(positions) if limit is None else offset + limit
+        return self.linker.link([entries[position][1] for position in positions[offset:end]]), len(positions)
+
+    def get_queryables(self, collection_id: Optional[str] = None) -> Dict[str, Dict]:
+        """JSON Schema properties that can be used in filters"""
+        if collection_id is None:
+            return self.property_table.queryables()
+        if collection_id not in self._collection_ids:
+            return {}
+        code = self._collection_ids.index(collection_id)
+        return self.property_table.queryables(np.nonzero(self._collection_codes == code)[0])
@@ -0,0 +1,140 @@
+"""Persistent catalog state: file manifest and extraction results in SQLite"""
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from app.serving.json_response import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Bump when the stored layout or the meaning of stored metadata changes
+SCHEMA_VERSION = 1
+
+
+class FileRecord(NamedTuple):
+    """One scanned file: its version on disk and what extraction produced (None if it failed)"""
+    collection: str
+    size: int
+    mtime_ns: int
+    inode: int
+    metadata: Optional[Dict]
+    # Item ID the file was published under; kept for as long as the file exists
+    item_id: Optional[str] = None
+
+    def matches(self, collection: str, stat_result: os.stat_result) -> bool:
+        """True if the file is still the version this record was extracted from"""
+        return (self.collection == collection and self.size == stat_result.st_size
+                and self.mtime_ns == stat_result.st_mtime_ns and self.inode == stat_result.st_ino)
+
+    @property
+    def version(self) -> str:
+        return f"{self.size}|{self.mtime_ns}|{self.inode}"
+
+
+class CatalogStore:
+    """
+    SQLite file holding the manifest of the last scan and the extracted
+    metadata of every file, so a restart can publish the catalog without
+    opening any data file and only re-extract files that changed.
+
+    Items and collections are derived from the stored metadata, so they are
+    always built by the current code. The store is tied to the base URL the
+    hrefs were made with; a store written for another URL or schema version
+    is ignored.
+    """
+
+    def __init__(self, path: Path, base_url: str):
+        self.path = Path(path)
+        self.base_url = base_url
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        # WAL lets other workers read while one of them writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                collection TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                metadata TEXT,
+                item_id TEXT
+            );
+        """)
+        self._conn.commit()
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def is_compatible(self) -> bool:
+        return self._meta('schema_version') == str(SCHEMA_VERSION) and self._meta('base_url') == self.base_url
+
+    def load(self) -> Dict[str, FileRecord]:
+        """Stored manifest by path; empty when the store is new or incompatible"""
+        with self._lock:
+            if not self.is_compatible():
+                return {}
+            records = {}
+            for path, collection, size, mtime_ns, inode, metadata, item_id in self._conn.execute(
+                    "SELECT path, collection, size, mtime_ns, inode, metadata, item_id FROM files"):
+                try:
+                    records[path] = FileRecord(collection, size, mtime_ns, inode,
+                                               loads(metadata) if metadata else None, item_id)
+                except ValueError:
+                    logger.warning(f"Ignoring unreadable catalog store entry for {path}")
+            return records
+
+    def extractor_versions(self) -> Dict[str, int]:
+        """Extractor version per format the stored metadata was produced with"""
+        with self._lock:
+            value = self._meta('extractor_versions')
+        try:
+            return loads(value) if value else {}
+        except ValueError:
+            return {}
+
+    def apply(self, upserts: Dict[str, FileRecord], deletes: Iterable[str],
+              extractor_versions: Optional[Dict[str, int]] = None):
+        """
+        Write changed records and remove deleted paths in one transaction.
+        Pass `extractor_versions` once every stored record was produced by them.
+        """
+        rows = [
+            (path, r.collection, r.size, r.mtime_ns, r.inode,
+             None if r.metadata is None else dumps(r.metadata).decode('utf-8'), r.item_id)
+            for path, r in upserts.items()
+        ]
+        with self._lock, self._conn:
+            if not self.is_compatible():
+                # Entries written for another base URL or layout are stale
+                self._conn.execute("DELETE FROM files")
+                self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+                    ('schema_version', str(SCHEMA_VERSION)), ('base_url', self.base_url)
+                ])
+            self._conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in deletes])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (path, collection, size, mtime_ns, inode, metadata, item_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            if extractor_versions is not None:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('extractor_versions', ?)",
+                                   (dumps(extractor_versions).decode('utf-8'),))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return {
+            'path': str(self.path),
+            'files': count,
+            'size_bytes': self.path.stat().st_size if self.path.exists() else 0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
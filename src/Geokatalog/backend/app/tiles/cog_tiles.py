@@ -0,0 +1,265 @@
+"""Dynamic XYZ tile rendering from Cloud Optimized GeoTIFFs"""
+import logging
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+
+from app.cache.disk_cache import DiskCache
+from app.cache.lru import SizedLRUCache
+from app.cache.range_cache import FileIdentity, file_identity
+
+logger = logging.getLogger(__name__)
+
+WEB_MERCATOR_HALF_WORLD = 20037508.342789244
+
+# Cached in place of tiles without data; no PNG or WEBP is a single NUL byte
+EMPTY_TILE = b'\0'
+# Memory accounted per cached tile besides its bytes (key, LRU bookkeeping)
+TILE_ENTRY_OVERHEAD = 256
+
+TILE_FORMATS = {
+    'png': ('PNG', 'image/png', {}),
+    'webp': ('WEBP', 'image/webp', {'quality': 85}),
+}
+
+
+def mercator_tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Bounds of an XYZ tile in EPSG:3857"""
+    tile_span = 2 * WEB_MERCATOR_HALF_WORLD / (2 ** z)
+    min_x = -WEB_MERCATOR_HALF_WORLD + x * tile_span
+    max_y = WEB_MERCATOR_HALF_WORLD - y * tile_span
+    return (min_x, max_y - tile_span, min_x + tile_span, max_y)
+
+
+@dataclass
+class _HandlePool:
+    """Idle dataset handles for one (file, overview level)"""
+    identity: FileIdentity
+    idle: List = field(default_factory=list)
+
+
+@dataclass
+class COGInfo:
+    """Per-file facts needed to render tiles, computed once per file version"""
+    crs: object
+    resolution: float
+    overview_factors: List[int]
+    bounds_3857: Tuple[float, float, float, float]
+    band_indexes: Tuple[int, ...]
+    has_nodata: bool
+    rescale: Optional[List[Tuple[float, float]]]
+
+
+class DatasetPool:
+    """
+    Pool of open rasterio datasets per file and overview level.
+
+    rasterio datasets must not be shared between threads, so each render
+    borrows a handle and returns it; at most `handles_per_file` idle handles
+    are kept per key and at most `max_files` keys stay open.
+    """
+
+    def __init__(self, max_files: int = 32, handles_per_file: int = 4):
+        self.max_files = max_files
+        self.handles_per_file = handles_per_file
+        self._pools: "OrderedDict[Tuple[Path, Optional[int]], _HandlePool]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def open(self, path: Path, overview_level: Optional[int] = None) -> Iterator:
+        identity = file_identity(os.stat(path))
+        key = (path, overview_level)
+        to_close = []
+        dataset = None
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None and pool.identity != identity:
+                to_close.extend(pool.idle)
+                pool = None
+            if pool is None:
+                pool = _HandlePool(identity)
+                self._pools[key] = pool
+            self._pools.move_to_end(key)
+            while len(self._pools) > self.max_files:
+                _, evicted = self._pools.popitem(last=False)
+                to_close.extend(evicted.idle)
+            if pool.idle:
+                dataset = pool.idle.pop()
+        for ds in to_close:
+            ds.close()
+
+        if dataset is None:
+            if overview_level is None:
+                dataset = rasterio.open(path)
+            else:
+                dataset = rasterio.open(path, overview_level=overview_level)
+        try:
+            yield dataset
+        finally:
+            with self._lock:
+                if self._pools.get(key) is pool and len(pool.idle) < self.handles_per_file:
+                    pool.idle.append(dataset)
+                    dataset = None
+            if dataset is not None:
+                dataset.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'open_keys': len(self._pools),
+                'idle_handles': sum(len(p.idle) for p in self._pools.values()),
+            }
+
+
+class COGTileRenderer:
+    """
+    Render XYZ (Web Mercator) PNG/WEBP tiles from COG files.
+
+    Each tile is read from the overview level whose resolution best matches the
+    zoom, warped to EPSG:3857 and encoded; results go into a memory LRU and an
+    optional disk cache keyed by file identity.
+    """
+
+    def __init__(self, tile_size: int = 256, workers: int = 4, max_open_files: int = 32,
+                 handles_per_file: int = 4, memory_cache_bytes: int = 64 * 1024 * 1024,
+                 disk_cache: Optional[DiskCache] = None):
+        self.tile_size = tile_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cog-render')
+        self.datasets = DatasetPool(max_files=max_open_files, handles_per_file=handles_per_file)
+        self.memory_cache = SizedLRUCache(memory_cache_bytes, sizeof=lambda tile: len(tile) + TILE_ENTRY_OVERHEAD,
+                                          max_entry_size=4 * 1024 * 1024)
+        self.disk_cache = disk_cache
+        self._info = SizedLRUCache(1024, sizeof=lambda _: 1)
+
+    def _file_info(self, path: Path, identity: FileIdentity) -> COGInfo:
+        info = self._info.get(identity)
+        if info is not None:
+            return info
+
+        with self.datasets.open(path) as ds:
+            band_indexes = (1, 2, 3) if ds.count >= 3 else (1,)
+            rescale = None
+            if ds.dtypes[0] != 'uint8':
+                # Stretch from a decimated read; GDAL serves it from the coarsest overviews
+                scale = max(1, max(ds.width, ds.height) // 1024)
+                sample = ds.read(band_indexes, masked=True,
+                                 out_shape=(len(band_indexes), max(1, ds.height // scale), max(1, ds.width // scale)))
+                rescale = []
+                for band in sample:
+                    values = band.compressed()
+                    if values.size:
+                        low, high = np.percentile(values, [2, 98])
+                    else:
+                        low, high = 0.0, 1.0
+                    rescale.append((float(low), float(high) if high > low else float(low) + 1.0))
+
+            info = COGInfo(
+                crs=ds.crs,
+                resolution=max(abs(ds.res[0]), abs(ds.res[1])),
+                overview_factors=ds.overviews(1),
+                bounds_3857=transform_bounds(ds.crs, 'EPSG:3857', *ds.bounds),
+                band_indexes=band_indexes,
+                has_nodata=ds.nodata is not None,
+                rescale=rescale,
+            )
+        self._info.put(identity, info)
+        return info
+
+    def _overview_level(self, info: COGInfo, bounds: Tuple[float, float, float, float]) -> Optional[int]:
+        """Coarsest overview that still has at least the resolution the tile needs"""
+        left, bottom, right, top = transform_bounds('EPSG:3857', info.crs, *bounds)
+        target_resolution = max(right - left, top - bottom) / self.tile_size
+        level = None
+        for index, factor in enumerate(info.overview_factors):
+            if info.resolution * factor <= target_resolution:
+                level = index
+        return level
+
+    def render_tile(self, path: Path, z: int, x: int, y: int, fmt: str) -> Optional[bytes]:
+        """Render one tile. Returns None if the tile has no data."""
+        identity = file_identity(os.stat(path))
+        info = self._file_info(path, identity)
+        bounds = mercator_tile_bounds(z, x, y)
+
+        data_bounds = info.bounds_3857
+        if (bounds[2] <= data_bounds[0] or bounds[0] >= data_bounds[2]
+                or bounds[3] <= data_bounds[1] or bounds[1] >= data_bounds[3]):
+            return None
+
+        level = self._overview_level(info, bounds)
+        size = self.tile_size
+        with self.datasets.open(path, level) as ds:
+            with WarpedVRT(ds, crs='EPSG:3857', transform=from_bounds(*bounds, size, size),
+                           width=size, height=size, resampling=Resampling.bilinear,
+                           add_alpha=not info.has_nodata) as vrt:
+                data = vrt.read(indexes=list(info.band_indexes))
+                mask = vrt.dataset_mask()
+
+        if not mask.any():
+            return None
+
+        if info.rescale:
+            scaled = np.empty(data.shape, dtype='uint8')
+            for i, (low, high) in enumerate(info.rescale):
+                band = (data[i].astype('float32') - low) * (255.0 / (high - low))
+                scaled[i] = np.clip(band, 0, 255).astype('uint8')
+            data = scaled
+        else:
+            data = data.astype('uint8', copy=False)
+
+        if data.shape[0] == 1:
+            data = np.repeat(data, 3, axis=0)
+        rgba = np.concatenate([data, mask[np.newaxis].astype('uint8')], axis=0)
+
+        driver, _, options = TILE_FORMATS[fmt]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', NotGeoreferencedWarning)
+            with MemoryFile() as memfile:
+                with memfile.open(driver=driver, width=size, height=size, count=4,
+                                  dtype='uint8', **options) as dst:
+                    dst.write(rgba)
+                return memfile.read()
+
+    def get_tile(self, path: Path, z: int, x: int, y: int, fmt: str) -> Optional[bytes]:
+        """Get a tile from the memory/disk cache, rendering it on a miss"""
+        identity = file_identity(os.stat(path))
+        key = f"{'-'.join(map(str, identity))}/{z}/{x}/{y}/{self.tile_size}.{fmt}"
+
+        tile = self.memory_cache.get(key)
+        if tile is not None:
+            # EMPTY_TILE, or b'' written by earlier versions of the disk cache
+            return tile if len(tile) > len(EMPTY_TILE) else None
+        if self.disk_cache is not None:
+            tile = self.disk_cache.get(key)
+            if tile is not None:
+                self.memory_cache.put(key, tile)
+                return tile if len(tile) > len(EMPTY_TILE) else None
+
+        tile = self.render_tile(path, z, x, y, fmt)
+        # Empty tiles are cached as a marker so repeated misses stay cheap
+        self.memory_cache.put(key, tile or EMPTY_TILE)
+        if self.disk_cache is not None:
+            self.disk_cache.put(key, tile or EMPTY_TILE)
+        return tile or None
+
+    def stats(self) -> Dict:
+        return {
+            'datasets': self.datasets.stats(),
+            'memory_cache': self.memory_cache.stats(),
+            'disk_cache': self.disk_cache.stats() if self.disk_cache else None,
+        }
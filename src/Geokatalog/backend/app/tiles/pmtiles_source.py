@@ -0,0 +1,141 @@
+"""Server-side PMTiles tile lookup with cached directories"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from pmtiles.reader import Reader as PMTilesReader
+from pmtiles.reader import MmapSource
+from pmtiles.tile import Compression, TileType, deserialize_directory, find_tile, zxy_to_tileid
+
+from app.cache.lru import SizedLRUCache
+from app.cache.range_cache import FileIdentity, file_identity
+
+logger = logging.getLogger(__name__)
+
+# Maximum directory depth defined by the PMTiles v3 spec
+MAX_DIRECTORY_DEPTH = 4
+
+TILE_MEDIA_TYPES = {
+    TileType.MVT: 'application/vnd.mapbox-vector-tile',
+    TileType.PNG: 'image/png',
+    TileType.JPEG: 'image/jpeg',
+    TileType.WEBP: 'image/webp',
+    TileType.AVIF: 'image/avif',
+}
+
+TILE_CONTENT_ENCODINGS = {
+    Compression.GZIP: 'gzip',
+    Compression.BROTLI: 'br',
+    Compression.ZSTD: 'zstd',
+}
+
+
+class PMTilesArchive:
+    """An open PMTiles archive: memory-mapped file, parsed header and root directory"""
+
+    def __init__(self, path: Path, identity: FileIdentity, leaf_cache: SizedLRUCache):
+        self.path = path
+        self.identity = identity
+        self.leaf_cache = leaf_cache
+
+        with open(path, 'rb') as f:
+            # The mapping outlives the file object
+            self.get_bytes = MmapSource(f)
+        self.reader = PMTilesReader(self.get_bytes)
+        self.header = self.reader.header()
+        if self.header['internal_compression'] != Compression.GZIP:
+            raise ValueError(f"Unsupported PMTiles directory compression "
+                             f"{self.header['internal_compression']} in {path}")
+        self.root = deserialize_directory(
+            self.get_bytes(self.header['root_offset'], self.header['root_length'])
+        )
+        self._metadata: Optional[Dict] = None
+
+    @property
+    def media_type(self) -> str:
+        return TILE_MEDIA_TYPES.get(self.header['tile_type'], 'application/octet-stream')
+
+    @property
+    def content_encoding(self) -> Optional[str]:
+        return TILE_CONTENT_ENCODINGS.get(self.header['tile_compression'])
+
+    def metadata(self) -> Dict:
+        """JSON metadata of the archive (vector_layers, attribution, ...)"""
+        if self._metadata is None:
+            self._metadata = self.reader.metadata()
+        return self._metadata
+
+    def _leaf_directory(self, offset: int, length: int) -> List:
+        key = (self.identity, offset)
+        directory = self.leaf_cache.get(key)
+        if directory is None:
+            directory = deserialize_directory(
+                self.get_bytes(self.header['leaf_directory_offset'] + offset, length)
+            )
+            self.leaf_cache.put(key, directory)
+        return directory
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[Tuple[bytes, int]]:
+        """
+        Look up a tile without decompressing it.
+
+        Returns:
+            (tile bytes, offset of the tile in the tile data section) or None if missing
+        """
+        tile_id = zxy_to_tileid(z, x, y)
+        directory = self.root
+        for _ in range(MAX_DIRECTORY_DEPTH):
+            entry = find_tile(directory, tile_id)
+            if entry is None:
+                return None
+            if entry.run_length > 0:
+                data = self.get_bytes(self.header['tile_data_offset'] + entry.offset, entry.length)
+                return data, entry.offset
+            directory = self._leaf_directory(entry.offset, entry.length)
+        return None
+
+
+class PMTilesArchivePool:
+    """
+    Bounded pool of open PMTiles archives.
+
+    Leaf directories of all archives share one LRU cache bounded by the number
+    of directory entries, so many open archives cannot exhaust memory.
+    """
+
+    def __init__(self, max_open: int = 64, directory_cache_entries: int = 500_000):
+        self.max_open = max_open
+        self.leaf_cache = SizedLRUCache(directory_cache_entries, sizeof=len)
+        self._archives: "OrderedDict[Path, PMTilesArchive]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> PMTilesArchive:
+        """Get an open archive, reopening it if the file has changed on disk"""
+        identity = file_identity(os.stat(path))
+        with self._lock:
+            archive = self._archives.get(path)
+            if archive is not None and archive.identity == identity:
+                self._archives.move_to_end(path)
+                return archive
+
+        archive = PMTilesArchive(path, identity, self.leaf_cache)
+        with self._lock:
+            previous = self._archives.get(path)
+            if previous is not None and previous.identity != identity:
+                self.leaf_cache.discard_where(lambda key: key[0] == previous.identity)
+            self._archives[path] = archive
+            self._archives.move_to_end(path)
+            while len(self._archives) > self.max_open:
+                _, evicted = self._archives.popitem(last=False)
+                self.leaf_cache.discard_where(lambda key, i=evicted.identity: key[0] == i)
+        logger.info(f"Opened PMTiles archive {path}")
+        return archive
+
+    def stats(self) -> Dict:
+        return {
+            'open_archives': len(self._archives),
+            'directory_cache': self.leaf_cache.stats(),
+        }
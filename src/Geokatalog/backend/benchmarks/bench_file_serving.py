@@ -0,0 +1,134 @@
+"""
+Benchmark for /data byte-range serving.
+
+Compares the old 8 KB generator + StreamingResponse with the FileServingEngine
+modes by driving the ASGI responses in-process (no network), so the numbers
+reflect the per-request cost inside the interpreter.
+
+Usage:
+    python -m benchmarks.bench_file_serving --size-mb 256 --requests 2000 --concurrency 32
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+from starlette.responses import StreamingResponse
+
+from app.serving.file_engine import FileServingEngine, RangeFileResponse
+
+
+def legacy_response(path: Path, start: int, length: int) -> StreamingResponse:
+    """The generator-based response used before the serving engine"""
+    def iterfile():
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(8192, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    return StreamingResponse(iterfile(), status_code=206,
+                             headers={'Content-Length': str(length)},
+                             media_type='application/octet-stream')
+
+
+async def run_one(make_response, start: int, length: int, scope: dict) -> Tuple[float, int]:
+    """Run a single response to completion and return (seconds, bytes sent)"""
+    sent = 0
+
+    async def receive():
+        # The client never disconnects during the benchmark
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal sent
+        if message["type"] == "http.response.body":
+            sent += len(message.get("body", b""))
+
+    t0 = time.perf_counter()
+    response = make_response(start, length)
+    await response(scope, receive, send)
+    return time.perf_counter() - t0, sent
+
+
+async def run_case(name: str, make_response, ranges: List[Tuple[int, int]], concurrency: int):
+    scope = {"type": "http", "extensions": {}}
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    total_bytes = 0
+
+    async def worker(start, length):
+        nonlocal total_bytes
+        async with semaphore:
+            seconds, sent = await run_one(make_response, start, length, scope)
+            latencies.append(seconds)
+            total_bytes += sent
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(s, l) for s, l in ranges))
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{name:<12} {len(ranges) / elapsed:>10.0f} req/s {total_bytes / elapsed / 1e6:>10.1f} MB/s "
+          f"p50 {p50:>8.2f} ms  p99 {p99:>8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /data range serving")
+    parser.add_argument('--size-mb', type=int, default=256, help="Size of the test file")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--range-kb', type=int, default=256, help="Maximum size of each range")
+    parser.add_argument('--file', type=Path, help="Use an existing file instead of a temporary one")
+    args = parser.parse_args()
+
+    tmp = None
+    path = args.file
+    if path is None:
+        tmp = tempfile.NamedTemporaryFile(suffix='.bin', delete=False)
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            tmp.write(block)
+        tmp.close()
+        path = Path(tmp.name)
+
+    try:
+        stat_result = path.stat()
+        size = stat_result.st_size
+        rng = random.Random(42)
+        ranges = []
+        for _ in range(args.requests):
+            length = rng.randint(1, args.range_kb * 1024)
+            start = rng.randint(0, max(0, size - length))
+            ranges.append((start, length))
+
+        print(f"File: {path} ({size / 1e6:.0f} MB), {args.requests} ranges, concurrency {args.concurrency}")
+        cases = [('generator', lambda s, l: legacy_response(path, s, l))]
+        for mode in ('mmap', 'read'):
+            engine = FileServingEngine(mode=mode)
+            cases.append((mode, lambda s, l, e=engine: RangeFileResponse(
+                e, path, stat_result, start=s, length=l, status_code=206,
+                headers={'Content-Length': str(l)}, media_type='application/octet-stream')))
+
+        for name, make_response in cases:
+            asyncio.run(run_case(name, make_response, ranges, args.concurrency))
+        print("sendfile mode needs an ASGI server with the zerocopysend extension; "
+              "without it the engine serves from mmap.")
+    finally:
+        if tmp is not None:
+            os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
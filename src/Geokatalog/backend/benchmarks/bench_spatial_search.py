@@ -0,0 +1,96 @@
+"""
+Benchmark for /search spatial filtering.
+
+Compares the linear bbox scan that search_items used before with the
+SpatialIndex (STRtree) bbox query and the exact footprint query, on synthetic
+item bboxes spread over mainland Norway.
+
+Usage:
+    python -m benchmarks.bench_spatial_search --items 10000 100000 1000000 --queries 200
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import Callable, List
+
+from app.stac.catalog import STACCatalogGenerator
+from app.stac.index import SpatialIndex
+
+EXTENT = (4.5, 57.9, 31.2, 71.2)
+
+
+def make_bboxes(count: int, rng: random.Random) -> List[List[float]]:
+    """Small tiles with a few large footprints, roughly like N50 and survey items"""
+    bboxes = []
+    for _ in range(count):
+        size = 0.5 if rng.random() < 0.01 else rng.uniform(0.01, 0.1)
+        minx = rng.uniform(EXTENT[0], EXTENT[2] - size)
+        miny = rng.uniform(EXTENT[1], EXTENT[3] - size)
+        bboxes.append([minx, miny, minx + size, miny + size])
+    return bboxes
+
+
+def footprint(bbox: List[float]) -> dict:
+    minx, miny, maxx, maxy = bbox
+    return {'type': 'Polygon', 'coordinates': [[
+        [minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]
+    ]]}
+
+
+def make_queries(count: int, rng: random.Random) -> List[List[float]]:
+    """Viewport-sized query boxes"""
+    queries = []
+    for _ in range(count):
+        size = rng.uniform(0.2, 2.0)
+        minx = rng.uniform(EXTENT[0], EXTENT[2] - size)
+        miny = rng.uniform(EXTENT[1], EXTENT[3] - size)
+        queries.append([minx, miny, minx + size, miny + size])
+    return queries
+
+
+def run_case(name: str, search: Callable[[List[float]], int], queries: List[List[float]]):
+    latencies = []
+    hits = 0
+    for query in queries:
+        t0 = time.perf_counter()
+        hits += search(query)
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"  {name:<12} p50 {p50:>9.3f} ms  p99 {p99:>9.3f} ms  avg hits {hits / len(queries):>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /search spatial filtering")
+    parser.add_argument('--items', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--linear-queries', type=int, default=20,
+                        help="Queries for the linear scan (slow at 1M items)")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    queries = make_queries(args.queries, rng)
+    intersects = STACCatalogGenerator._bbox_intersects
+
+    for count in args.items:
+        bboxes = make_bboxes(count, rng)
+        geometries = [footprint(b) for b in bboxes]
+        t0 = time.perf_counter()
+        index = SpatialIndex(bboxes, geometries)
+        build = time.perf_counter() - t0
+        print(f"{count} items (index build {build:.2f} s)")
+
+        run_case('linear', lambda q: sum(1 for b in bboxes if intersects(None, b, q)),
+                 queries[:args.linear_queries])
+        run_case('strtree', lambda q: len(index.query_bbox(q)), queries)
+
+        t0 = time.perf_counter()
+        index.query_geometry(footprint(queries[0]))
+        print(f"  footprints built in {time.perf_counter() - t0:.2f} s")
+        run_case('footprint', lambda q: len(index.query_geometry(footprint(q))), queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""CQL2-text parsing and vectorized filter evaluation over item properties"""
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pystac
+import pytest
+
+from app.stac.cql2 import CQL2Error, FilterEvaluator, parse_cql2_text, parse_filter
+from app.stac.properties import TIMESTAMP_TYPE, PropertyTable
+
+
+def make_item(item_id, properties, file_size=None):
+    """Item with its datetime in the properties, as STACItemGenerator creates them"""
+    properties = {'datetime': '2024-01-01T00:00:00Z', **properties}
+    item = pystac.Item(item_id, {'type': 'Point', 'coordinates': [5.5, 60.5]}, [5.5, 60.5, 5.5, 60.5],
+                       datetime(2024, 1, 1, tzinfo=timezone.utc), properties)
+    if file_size is not None:
+        item.add_asset('data', pystac.Asset(f'/data/{item_id}.fgb', extra_fields={'file:size': file_size}))
+    return item
+
+
+@pytest.fixture
+def table() -> PropertyTable:
+    return PropertyTable([
+        ('flatgeobuf', make_item('a', {'name': 'roads', 'count': 1, 'mixed': 1, 'tags': {'x': 1}}, 100)),
+        ('flatgeobuf', make_item('b', {'name': 'rivers', 'count': 5, 'mixed': 'two'}, 2000)),
+        ('cog', make_item('c', {'count': 2.5, 'mixed': 3.5})),
+    ])
+
+
+def select(table: PropertyTable, cql2, geometry_positions=()):
+    """Item IDs selected by a CQL2-text or CQL2-JSON filter"""
+    node = parse_cql2_text(cql2) if isinstance(cql2, str) else cql2
+    evaluator = FilterEvaluator(table.column, table.size,
+                                geometry_filter=lambda geometry: np.array(geometry_positions, dtype=np.int64))
+    ids = table.column('id').to_pylist()
+    return [ids[row] for row in np.flatnonzero(evaluator.mask(node))]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("name = 'roads'", {'op': '=', 'args': [{'property': 'name'}, 'roads']}),
+    ("count >= 2 AND NOT name IS NULL", {'op': 'and', 'args': [
+        {'op': '>=', 'args': [{'property': 'count'}, 2]},
+        {'op': 'not', 'args': [{'op': 'isNull', 'args': [{'property': 'name'}]}]},
+    ]}),
+    ("a = 1 OR b = 2 AND c = 3", {'op': 'or', 'args': [
+        {'op': '=', 'args': [{'property': 'a'}, 1]},
+        {'op': 'and', 'args': [{'op': '=', 'args': [{'property': 'b'}, 2]},
+                               {'op': '=', 'args': [{'property': 'c'}, 3]}]},
+    ]}),
+    ("name NOT LIKE 'r%'", {'op': 'not', 'args': [{'op': 'like', 'args': [{'property': 'name'}, 'r%']}]}),
+    ("count BETWEEN 1 AND 2.5", {'op': 'between', 'args': [{'property': 'count'}, 1, 2.5]}),
+    ("\"eo:cloud_cover\" IN (1, 2)", {'op': 'in', 'args': [{'property': 'eo:cloud_cover'}, [1, 2]]}),
+    ("datetime > TIMESTAMP('2024-01-01T00:00:00Z')",
+     {'op': '>', 'args': [{'property': 'datetime'}, {'timestamp': '2024-01-01T00:00:00Z'}]}),
+    ("name = 'it''s'", {'op': '=', 'args': [{'property': 'name'}, "it's"]}),
+])
+def test_parse_text(text, expected):
+    assert parse_cql2_text(text) == expected
+
+
+def test_parse_wkt_literal_as_geojson():
+    node = parse_cql2_text("S_INTERSECTS(geometry, POLYGON((0 0, 1 0, 1 1, 0 0)))")
+    assert node == {'op': 's_intersects', 'args': [
+        {'property': 'geometry'},
+        {'type': 'Polygon', 'coordinates': (((0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 0.0)),)},
+    ]}
+
+
+@pytest.mark.parametrize('text', ["name =", "name = 'a' AND", "(name = 'a'", "name ~ 'a'", "count NOT 1",
+                                  "S_INTERSECTS(geometry, POLYGON((0 0, 1 0)"])
+def test_parse_text_errors(text):
+    with pytest.raises(CQL2Error):
+        parse_cql2_text(text)
+
+
+def test_parse_filter_languages():
+    assert parse_filter('{"op": "=", "args": [{"property": "id"}, "a"]}', 'cql2-json') == \
+        {'op': '=', 'args': [{'property': 'id'}, 'a']}
+    with pytest.raises(CQL2Error):
+        parse_filter("id = 'a'", 'sql')
+    with pytest.raises(CQL2Error):
+        parse_filter('[1, 2]', 'cql2-json')
+
+
+def test_property_table_columns(table):
+    assert table.column('count').type == pa.float64()
+    assert table.column('mixed').to_pylist() == ['1', 'two', '3.5']
+    assert table.column('datetime').type == TIMESTAMP_TYPE
+    assert table.column('file:size').to_pylist() == [100, 2000, None]
+    assert table.column('collection').to_pylist() == ['flatgeobuf', 'flatgeobuf', 'cog']
+    assert 'tags' not in table.table.column_names
+    assert table.column('missing').null_count == 3
+
+
+def test_property_table_queryables(table):
+    queryables = table.queryables()
+    assert queryables['count'] == {'type': 'number'}
+    assert queryables['datetime'] == {'type': 'string', 'format': 'date-time'}
+    assert 'name' not in table.queryables(rows=[2])
+
+
+def test_three_valued_logic(table):
+    # Item c has no name: the comparison is null, so neither it nor its negation selects c
+    assert select(table, "name = 'roads'") == ['a']
+    assert select(table, "NOT name = 'roads'") == ['b']
+    assert select(table, "name = 'roads' OR count > 2") == ['a', 'b', 'c']
+    assert select(table, "NOT (name = 'x' AND count > 100)") == ['a', 'b', 'c']
+    assert select(table, "name IS NULL") == ['c']
+    assert select(table, "missing = 1") == []
+    assert select(table, "NOT missing = 1") == []
+
+
+def test_literal_typing(table):
+    assert select(table, "count = 1") == ['a']
+    assert select(table, "count > 2") == ['b', 'c']
+    assert select(table, "datetime >= '2024-01-01'") == ['a', 'b', 'c']
+    assert select(table, "datetime < TIMESTAMP('2024-01-01T00:00:00Z')") == []
+    with pytest.raises(CQL2Error):
+        select(table, "datetime > 'not a date'")
+    with pytest.raises(CQL2Error):
+        select(table, "name > 1")
+
+
+def test_like_in_between(table):
+    assert select(table, "name LIKE 'r%s'") == ['a', 'b']
+    assert select(table, "name LIKE 'riv%'") == ['b']
+    assert select(table, "name NOT LIKE 'riv%'") == ['a']
+    assert select(table, "id IN ('a', 'c', 'z')") == ['a', 'c']
+    assert select(table, "name NOT IN ('roads')") == ['b']
+    assert select(table, "count BETWEEN 1 AND 2.5") == ['a', 'c']
+    assert select(table, "\"file:size\" BETWEEN 50 AND 500") == ['a']
+
+
+def test_s_intersects(table):
+    assert select(table, "S_INTERSECTS(geometry, POINT(5.5 60.5))", [1]) == ['b']
+    assert select(table, {'op': 's_intersects', 'args': [
+        {'property': 'geometry'}, {'bbox': [5, 60, 6, 61]}]}, [0, 2]) == ['a', 'c']
+
+
+@pytest.mark.parametrize('geometry', [
+    {'type': 'Polygon', 'coordinates': 'bad'},
+    {'type': 'Foo'},
+    'POINT(1 2)',
+    {'bbox': [1, 2, 3]},
+])
+def test_s_intersects_malformed_geometry(table, geometry):
+    with pytest.raises(CQL2Error):
+        select(table, {'op': 's_intersects', 'args': [{'property': 'geometry'}, geometry]})
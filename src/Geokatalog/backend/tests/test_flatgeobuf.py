@@ -0,0 +1,60 @@
+"""Packed R-tree layout and single-feature FlatGeobuf files"""
+import json
+import os
+from pathlib import Path
+
+import fiona
+import pytest
+
+from app.cache.lru import SizedLRUCache
+from app.cache.range_cache import file_identity
+from app.features.flatgeobuf import FlatGeobufFile, packed_rtree_level_bounds, packed_rtree_size
+
+
+@pytest.mark.parametrize('num_items, node_size, expected', [
+    (1, 16, [(1, 2), (0, 1)]),
+    (2, 16, [(1, 3), (0, 1)]),
+    (16, 16, [(1, 17), (0, 1)]),
+    (17, 16, [(3, 20), (1, 3), (0, 1)]),
+])
+def test_level_bounds(num_items, node_size, expected):
+    assert packed_rtree_level_bounds(num_items, node_size) == expected
+
+
+def test_single_item_index_has_a_root():
+    assert packed_rtree_size(1, 16) == 2 * 40
+
+
+@pytest.fixture
+def single_polygon(tmp_path: Path) -> Path:
+    path = tmp_path / 'one.fgb'
+    schema = {'geometry': 'Polygon', 'properties': {'name': 'str'}}
+    with fiona.open(path, 'w', driver='FlatGeobuf', schema=schema, crs='EPSG:4326') as dst:
+        dst.write({
+            'geometry': {'type': 'Polygon', 'coordinates': [[(5, 60), (6, 60), (6, 61), (5, 60)]]},
+            'properties': {'name': 'a'},
+        })
+    return path
+
+
+def open_file(path: Path) -> FlatGeobufFile:
+    node_cache = SizedLRUCache(1024 * 1024, sizeof=lambda nodes: nodes.nbytes)
+    return FlatGeobufFile(path, file_identity(os.stat(path)), node_cache)
+
+
+def test_single_feature_query(single_polygon: Path):
+    fgb = open_file(single_polygon)
+    assert fgb.header.has_index
+    for bbox in (None, (4.0, 59.0, 7.0, 62.0)):
+        collection = json.loads(b''.join(fgb.iter_geojson(bbox)))
+        assert collection['numberReturned'] == 1
+        assert collection['features'][0]['properties'] == {'name': 'a'}
+    assert fgb.count((10.0, 10.0, 11.0, 11.0)) == 0
+
+
+def test_single_feature_footprint_from_index(single_polygon: Path):
+    fgb = open_file(single_polygon)
+    with open(single_polygon, 'rb') as f:
+        nodes = fgb.level_nodes(f, 256)
+    assert len(nodes) == 1
+    assert tuple(nodes[0])[:4] == (5.0, 60.0, 6.0, 61.0)
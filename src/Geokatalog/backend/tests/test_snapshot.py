@@ -0,0 +1,50 @@
+"""Items linked into their collection on first use"""
+from pathlib import Path
+
+import pystac
+
+from app.stac.collection import STACCollectionManager
+from app.stac.item import STACItemGenerator
+from app.stac.snapshot import ItemLinker
+
+BASE_URL = 'http://localhost:8000'
+
+
+def build(item_ids, link):
+    """Root catalog with one FlatGeobuf collection, its items added by `link`"""
+    items = [
+        STACItemGenerator(BASE_URL).create_item(Path(f'/data/{item_id}.fgb'), {
+            'bbox': [5, 60, 6, 61],
+            'geometry': {'type': 'Point', 'coordinates': [5.5, 60.5]},
+            'properties': {'datetime': '2024-01-01T00:00:00Z'},
+            'assets': {'data': {'href': f'{BASE_URL}/data/{item_id}.fgb', 'type': 'application/flatgeobuf',
+                                'title': f'{item_id}.fgb', 'roles': ['data']}},
+        }, 'flatgeobuf', item_id=item_id)
+        for item_id in item_ids
+    ]
+    catalog = pystac.Catalog(id='root', title='STAC Catalog', description='Test')
+    catalog.add_link(pystac.Link(rel='self', target=f'{BASE_URL}/'))
+    collection = STACCollectionManager(BASE_URL).create_collection('flatgeobuf', items)
+    link(collection, items)
+    catalog.add_child(collection)
+    return collection, items
+
+
+def test_lazy_links_match_add_item():
+    eager_collection, eager_items = build(['a', 'b'], lambda c, items: [c.add_item(i) for i in items])
+    linker = ItemLinker()
+    lazy_collection, lazy_items = build(['a', 'b'], linker.add)
+
+    assert lazy_collection.to_dict() == eager_collection.to_dict()
+    linker.link(lazy_items)
+    assert [i.to_dict() for i in lazy_items] == [i.to_dict() for i in eager_items]
+
+
+def test_items_are_linked_once():
+    linker = ItemLinker()
+    _, items = build(['a'], linker.add)
+    linker.link(items)
+    links = items[0].to_dict()['links']
+    linker.link(items)
+    assert items[0].to_dict()['links'] == links
+    assert [link['rel'] for link in links].count('parent') == 1